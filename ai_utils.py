@@ -1,4 +1,36 @@
-import json, openai, os, re, tempfile
+import difflib, json, openai, os, re, tempfile, time
+from functools import lru_cache
+from metrics_utils import (
+    TRANSCRIPTION_SECONDS, TRANSCRIPTION_BYTES, TRANSCRIPTIONS_TOTAL, LLM_SECONDS, LLM_CALLS, LLM_TOKENS
+)
+from log_utils import get_logger, fields, log_payload
+from rules_utils import rule_verdict
+from ratelimit_utils import TRANSCRIBE_LIMITER, CHAT_LIMITER, call_limited
+from replay_utils import recorder, chat_key, audio_key
+
+logger = get_logger(__name__)
+
+# Point at a local stand-in (see fake_openai.py) for load testing, e.g. http://localhost:9000/v1
+OPENAI_BASE_URL = os.getenv("OPENAI_BASE_URL") or None
+CHAT_MODEL = "gpt-4o-mini"
+TRANSCRIBE_MODEL = "gpt-4o-transcribe"
+
+@lru_cache(maxsize=1)
+def get_openai_client():
+    return openai.OpenAI(api_key=os.getenv("OPENAI_API_KEY"), base_url=OPENAI_BASE_URL)
+
+@lru_cache(maxsize=1)
+def get_api_client():
+    # same connection pool; retries are done by ratelimit_utils.call_limited so each attempt is budgeted
+    return get_openai_client().with_options(max_retries=0)
+
+# rough audio token cost for the transcription TPM budget, the text response carries no usage
+TRANSCRIBE_TOKENS_PER_SEC = float(os.getenv("TRANSCRIBE_TOKENS_PER_SEC", 10))
+
+def _audio_seconds(raw: bytes):
+    # PCM or the mu-law preprocess_wav writes (the wave module reads only PCM)
+    from audio_utils import wav_seconds
+    return wav_seconds(raw)
 
 def extract_json_block(text: str):
     match = re.search(r"(\{.*\}|\[.*\])", text, re.DOTALL)
@@ -12,25 +44,128 @@ def extract_json_block(text: str):
     return json.loads(block)
 
 def transcribe_one(raw: bytes):
-    print("Transcribing one")
-    openai_client = openai.OpenAI(api_key=os.getenv("OPENAI_API_KEY"))
+    logger.debug("transcribing", extra=fields("transcription", bytes=len(raw)))
+    key = audio_key(TRANSCRIBE_MODEL, raw)
+    replayed = recorder.replay("transcription", key)
+    if replayed is not None:
+        return {"raw": replayed}
+    openai_client = get_api_client()
     with tempfile.NamedTemporaryFile(suffix=".wav") as tmp:
         tmp.write(raw)
         tmp.flush()
 
-        with open(tmp.name, "rb") as f:
-            response = openai_client.audio.transcriptions.create(
-                model="gpt-4o-transcribe",
-                file=f,
-                response_format="text",
-            )
-
+        TRANSCRIPTION_BYTES.observe(len(raw))
+        start = time.perf_counter()
+
+        def send():
+            with open(tmp.name, "rb") as f:
+                return openai_client.audio.transcriptions.with_raw_response.create(
+                    model=TRANSCRIBE_MODEL,
+                    file=f,
+                    response_format="text",
+                )
+
+        try:
+            response = call_limited(
+                TRANSCRIBE_LIMITER, send, tokens=int(_audio_seconds(raw) * TRANSCRIBE_TOKENS_PER_SEC)
+            ).parse()
+        except Exception:
+            TRANSCRIPTIONS_TOTAL.labels("error").inc()
+            raise
+        TRANSCRIPTION_SECONDS.observe(time.perf_counter() - start)
+        TRANSCRIPTIONS_TOTAL.labels("ok").inc()
+
+    recorder.record("transcription", key, {"model": TRANSCRIBE_MODEL, "bytes": len(raw), "seconds": _audio_seconds(raw)}, response)
     return {"raw": response}
 
-
-def detect_voicemail(transcript):
-    openai_client = openai.OpenAI(api_key=os.getenv("OPENAI_API_KEY"))
-    prompt = f"""
+# how many words at each side of a chunk boundary are compared when removing the overlap,
+# and how far from the boundary the repeated run may end/start (edge words get cut off)
+STITCH_WINDOW_WORDS = int(os.getenv("STITCH_WINDOW_WORDS", 20))
+STITCH_EDGE_WORDS = int(os.getenv("STITCH_EDGE_WORDS", 8))
+
+def _norm_word(w):
+    return re.sub(r"[^\w']", "", w.lower())
+
+def stitch_transcripts(texts):
+    # Chunks overlap in time, so the end of one text repeats at the start of the next.
+    # The longest common run of words between the tail of the text so far and the head
+    # of the next chunk is kept once; without one the chunks are simply joined.
+    words = []
+    for text in texts:
+        nxt = (text or "").split()
+        if not words:
+            words = nxt
+            continue
+        tail = words[-STITCH_WINDOW_WORDS:]
+        head = nxt[:STITCH_WINDOW_WORDS]
+        m = difflib.SequenceMatcher(
+            None, [_norm_word(w) for w in tail], [_norm_word(w) for w in head], autojunk=False
+        ).find_longest_match(0, len(tail), 0, len(head))
+        near_edges = m.a + m.size >= len(tail) - STITCH_EDGE_WORDS and m.b <= STITCH_EDGE_WORDS
+        if near_edges and (m.size >= 2 or (m.size == 1 and len(_norm_word(tail[m.a])) > 3)):
+            words = words[:len(words) - len(tail) + m.a + m.size] + nxt[m.b + m.size:]
+        else:
+            words = words + nxt
+    return " ".join(words)
+
+
+def skipped_transcript(reason, analysis=None):
+    # stored instead of an API transcript when the local signal analyser finds no speech
+    return {"raw": "", "skipped": reason, "analysis": analysis or {}}
+
+def is_skipped_transcript(transcript):
+    return isinstance(transcript, dict) and bool(transcript.get("skipped"))
+
+
+def chat_request(prompt):
+    return {
+        "model": CHAT_MODEL,
+        "messages": [
+            {"role": "system", "content": "Output only TRUE or FALSE."},
+            {"role": "user", "content": prompt}
+        ],
+        "temperature": 0,
+    }
+
+def record_usage(classifier, usage):
+    # usage is an SDK object for live calls and a plain dict in batch results
+    if usage is None:
+        return
+    if not isinstance(usage, dict):
+        usage = usage.model_dump()
+    LLM_TOKENS.labels(classifier, "prompt").inc(usage.get("prompt_tokens") or 0)
+    LLM_TOKENS.labels(classifier, "completion").inc(usage.get("completion_tokens") or 0)
+
+def _complete(classifier, prompt):
+    request = chat_request(prompt)
+    key = chat_key(request)
+    replayed = recorder.replay("chat", key)
+    if replayed is not None:
+        return replayed.strip().lower()
+    openai_client = get_api_client()
+    # ~4 characters per token, plus the one-word answer
+    estimate = sum(len(m["content"]) for m in request["messages"]) // 4 + 8
+    start = time.perf_counter()
+    try:
+        completion = call_limited(
+            CHAT_LIMITER, lambda: openai_client.chat.completions.with_raw_response.create(**request), tokens=estimate
+        ).parse()
+    except Exception:
+        LLM_CALLS.labels(classifier, "error").inc()
+        raise
+    LLM_SECONDS.labels(classifier).observe(time.perf_counter() - start)
+    LLM_CALLS.labels(classifier, "ok").inc()
+    record_usage(classifier, completion.usage)
+    if completion.usage is not None:
+        CHAT_LIMITER.settle(estimate, completion.usage.total_tokens)
+
+    content = completion.choices[0].message.content
+    recorder.record("chat", key, {"classifier": classifier, **request}, content)
+    return content.strip().lower()
+
+
+def voicemail_prompt(transcript):
+    return f"""
 Take the following call transcript. It is a two-party phone conversation
 between an optical store manager (receptionist/staff) and a client.
 Decide if an OUTBOUND call reached voicemail (answering machine / mailbox).
@@ -46,24 +181,8 @@ Transcript:
 {transcript}
 """
 
-    completion = openai_client.chat.completions.create(
-        model="gpt-4o-mini",
-        messages=[
-            {"role": "system", "content": "Output only TRUE or FALSE."},
-            {"role": "user", "content": prompt}
-        ],
-        temperature=0,
-    )
-
-    resp = completion.choices[0].message.content.strip().lower()
-    print(resp)
-    print("-----------") 
-    return bool(re.search(r"\btrue\b", resp))
-
-def detect_proactive(transcript):
-    openai_client = openai.OpenAI(api_key=os.getenv("OPENAI_API_KEY"))
-
-    prompt = f"""
+def proactive_prompt(transcript):
+    return f"""
 You are a strict boolean classifier.
 
 Task: Decide if the OUTBOUND call below is a PROACTIVE RECALL/REMINDER (TRUE) or NOT (FALSE).
@@ -86,24 +205,8 @@ Transcript:
 \"\"\"{transcript.strip()}\"\"\"
 """
 
-    completion = openai_client.chat.completions.create(
-        model="gpt-4o-mini",
-        messages=[
-            {"role": "system", "content": "Output only TRUE or FALSE."},
-            {"role": "user", "content": prompt},
-        ],
-        temperature=0
-    )
-    resp = completion.choices[0].message.content.strip().lower()
-    print(transcript)
-    print(resp)
-    print("-----------")
-    return bool(re.search(r"\btrue\b", resp))
-
-
-def detect_new_patient(transcript):
-    openai_client = openai.OpenAI(api_key=os.getenv("OPENAI_API_KEY"))
-    prompt = f"""
+def new_patient_prompt(transcript):
+    return f"""
 You are a strict boolean classifier. Output only TRUE or FALSE.
 
 Task: Decide if this INBOUND call is a NEW PATIENT CALL (caller is not an existing patient).
@@ -128,27 +231,9 @@ Output policy:
 Transcript:
 \"\"\"{transcript.strip()}\"\"\"
 """
-    completion = openai_client.chat.completions.create(
-        model="gpt-4o-mini",
-        messages=[
-            {"role": "system", "content": "Output only TRUE or FALSE."},
-            {"role": "user", "content": prompt},
-        ],
-        temperature=0
-    )
-    resp = completion.choices[0].message.content.strip().lower()
-    # safer than substring match: require standalone 'true'
-    print(transcript)
-    print(resp)
-    print("-----------")
-    return bool(re.search(r"\btrue\b", resp))
-
 
-def detect_dropped(transcript):
-    if len(transcript) > 300: return False
-
-    openai_client = openai.OpenAI(api_key=os.getenv("OPENAI_API_KEY"))
-    prompt = f"""
+def dropped_prompt(transcript):
+    return f"""
 You are a strict boolean classifier. Output only TRUE or FALSE.
 
 Task: Decide if this call was DROPPED/UNANSWERED.
@@ -167,28 +252,8 @@ Transcript:
 {transcript}
 """
 
-    completion = openai_client.chat.completions.create(
-        model="gpt-4o-mini",
-        messages=[
-            {"role": "system", "content": "Output only TRUE or FALSE."},
-            {"role": "user", "content": prompt}
-        ],
-        temperature=0,
-    )
-
-    resp = completion.choices[0].message.content.strip().lower()
-    print(transcript)
-    print(resp)
-    print("---------")
-    if "true" in resp:
-        return True
-    else:
-        return False
-    
-
-def detect_booked(transcript):
-    openai_client = openai.OpenAI(api_key=os.getenv("OPENAI_API_KEY"))
-    prompt = f"""
+def booked_prompt(transcript):
+    return f"""
 You are a strict boolean classifier. Output only TRUE or FALSE.
 
 Task: Decide if this call LED TO A NEW BOOKING (a new appointment was created on this call).
@@ -213,20 +278,42 @@ Transcript:
 {transcript}
 """
 
-    completion = openai_client.chat.completions.create(
-        model="gpt-4o-mini",
-        messages=[
-            {"role": "system", "content": "Output only TRUE or FALSE."},
-            {"role": "user", "content": prompt}
-        ],
-        temperature=0,
-    )
-
-    resp = completion.choices[0].message.content.strip().lower()
-    print(transcript)
-    print(resp)
-    print("---------")
-    if "true" in resp:
-        return True
-    else:
-        return False
\ No newline at end of file
+PROMPTS = {
+    "voicemail": voicemail_prompt,
+    "proactive": proactive_prompt,
+    "new_patient": new_patient_prompt,
+    "dropped": dropped_prompt,
+    "booked": booked_prompt,
+}
+
+def parse_verdict(classifier, resp):
+    resp = resp.strip().lower()
+    if classifier in ("dropped", "booked"):
+        return "true" in resp
+    # safer than substring match: require standalone 'true'
+    return bool(re.search(r"\btrue\b", resp))
+
+def classify(classifier, transcript):
+    verdict = rule_verdict(classifier, transcript)
+    if verdict is not None:
+        return verdict
+
+    resp = _complete(classifier, PROMPTS[classifier](transcript))
+    log_payload(logger, "classifier", classifier, transcript, verdict=resp)
+    return parse_verdict(classifier, resp)
+
+
+def detect_voicemail(transcript):
+    return classify("voicemail", transcript)
+
+def detect_proactive(transcript):
+    return classify("proactive", transcript)
+
+def detect_new_patient(transcript):
+    return classify("new_patient", transcript)
+
+def detect_dropped(transcript):
+    return classify("dropped", transcript)
+
+def detect_booked(transcript):
+    return classify("booked", transcript)
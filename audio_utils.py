@@ -0,0 +1,315 @@
+import io, os, struct, wave
+import numpy as np
+
+# CPU-only audio pre-processing before transcription: downmix to mono, resample,
+# trim leading/trailing silence and re-encode compactly. Telephone audio is
+# narrowband, so the target rate is a ceiling: 8 kHz recordings are never upsampled.
+AUDIO_PREPROCESS = os.getenv("AUDIO_PREPROCESS", "1").strip().lower() in {"1", "true", "yes", "on"}
+AUDIO_TARGET_RATE = int(os.getenv("AUDIO_TARGET_RATE", 16000))
+AUDIO_TRIM_SILENCE = os.getenv("AUDIO_TRIM_SILENCE", "1").strip().lower() in {"1", "true", "yes", "on"}
+AUDIO_SILENCE_DB = float(os.getenv("AUDIO_SILENCE_DB", -45))  # relative to full scale
+AUDIO_SILENCE_PAD_SEC = float(os.getenv("AUDIO_SILENCE_PAD_SEC", 0.3))
+AUDIO_ENCODING = os.getenv("AUDIO_ENCODING", "pcm16")  # "pcm16" or "mulaw" (8-bit G.711 in WAV)
+
+# Local pre-filter for obviously empty calls (silence, ringing, instant hang-up).
+# Calls it flags are stored with a synthetic transcript and never reach the API.
+VAD_ENABLED = os.getenv("VAD_ENABLED", "1").strip().lower() in {"1", "true", "yes", "on"}
+VAD_ENERGY_DB = float(os.getenv("VAD_ENERGY_DB", -40))  # frame loudness floor, dBFS
+VAD_MIN_SPEECH_RATIO = float(os.getenv("VAD_MIN_SPEECH_RATIO", 0.5))  # 300-3400 Hz share of frame energy
+VAD_TONAL_RATIO = float(os.getenv("VAD_TONAL_RATIO", 0.8))  # share of energy in the strongest bins
+VAD_MIN_VOICED_SEC = float(os.getenv("VAD_MIN_VOICED_SEC", 1.5))
+VAD_MIN_DURATION_SEC = float(os.getenv("VAD_MIN_DURATION_SEC", 1.0))
+VAD_CLIP_LEVEL = 0.99
+VAD_FRAME_SEC = 0.032
+VAD_TONAL_BINS = 6
+
+# Long recordings are cut at quiet points into overlapping chunks that are transcribed
+# concurrently and stitched back together (see ai_utils.stitch_transcripts).
+SPLIT_ENABLED = os.getenv("SPLIT_ENABLED", "1").strip().lower() in {"1", "true", "yes", "on"}
+SPLIT_MIN_SEC = float(os.getenv("SPLIT_MIN_SEC", 360))  # only recordings longer than this
+SPLIT_CHUNK_SEC = float(os.getenv("SPLIT_CHUNK_SEC", 120))
+SPLIT_OVERLAP_SEC = float(os.getenv("SPLIT_OVERLAP_SEC", 2))
+SPLIT_SEARCH_SEC = float(os.getenv("SPLIT_SEARCH_SEC", 10))  # look this far either side for a quiet point
+
+FRAME_SEC = 0.02
+RESAMPLE_BLOCK_SEC = 10
+RESAMPLE_PAD_SEC = 0.1
+
+MULAW_BIAS = 0x84
+MULAW_CLIP = 32635
+# segment (exponent) of a biased sample, looked up by its top 8 bits
+MULAW_SEGMENT = np.array([0] + [i.bit_length() - 1 for i in range(1, 256)], dtype=np.int32)
+
+def _mulaw_decode_table():
+    # G.711 ulaw2linear for every code, scaled like 16-bit PCM
+    code = ~np.arange(256) & 0xFF
+    exponent = (code >> 4) & 0x07
+    magnitude = ((((code & 0x0F) << 3) + MULAW_BIAS) << exponent) - MULAW_BIAS
+    return (np.where(code & 0x80, -magnitude, magnitude) / 32768).astype(np.float32)
+
+MULAW_DECODE = _mulaw_decode_table()
+
+WAVE_FORMAT_MULAW = 7
+
+def _wav_chunks(raw: bytes):
+    # ((format tag, channels, rate, byte rate, block align, bits), data) read straight from the
+    # RIFF chunks, for the WAVs the wave module refuses (it only reads PCM)
+    if raw[:4] != b"RIFF" or raw[8:12] != b"WAVE":
+        raise ValueError("not a WAV file")
+    pos, fmt = 12, None
+    while pos + 8 <= len(raw):
+        chunk, size = raw[pos:pos + 4], struct.unpack("<I", raw[pos + 4:pos + 8])[0]
+        if chunk == b"fmt ":
+            fmt = struct.unpack("<HHIIHH", raw[pos + 8:pos + 24])
+        elif chunk == b"data":
+            if fmt is None:
+                break
+            return fmt, raw[pos + 8:pos + 8 + size]
+        pos += 8 + size + (size & 1)
+    raise ValueError("WAV without fmt or data chunk")
+
+def decode_wav(raw: bytes):
+    # returns (float32 samples shaped (n, channels), rate); raises on input other than PCM
+    # or the G.711 mu-law encode_wav writes
+    try:
+        with wave.open(io.BytesIO(raw), "rb") as wf:
+            channels = wf.getnchannels()
+            width = wf.getsampwidth()
+            rate = wf.getframerate()
+            frames = wf.readframes(wf.getnframes())
+    except wave.Error:
+        (tag, channels, rate, _, _, _), frames = _wav_chunks(raw)
+        if tag != WAVE_FORMAT_MULAW:
+            raise
+        width = None
+
+    if width is None:
+        x = MULAW_DECODE[np.frombuffer(frames, dtype=np.uint8)]
+    elif width == 1:
+        x = (np.frombuffer(frames, dtype=np.uint8).astype(np.float32) - 128) / 128
+    elif width == 2:
+        x = np.frombuffer(frames, dtype="<i2").astype(np.float32) / 32768
+    elif width == 3:
+        b = np.frombuffer(frames, dtype=np.uint8).reshape(-1, 3).astype(np.int32)
+        v = b[:, 0] | (b[:, 1] << 8) | (b[:, 2] << 16)
+        v = np.where(v & 0x800000, v - 0x1000000, v)
+        x = v.astype(np.float32) / 8388608
+    elif width == 4:
+        x = np.frombuffer(frames, dtype="<i4").astype(np.float32) / 2147483648
+    else:
+        raise ValueError(f"unsupported sample width: {width}")
+
+    usable = len(x) - len(x) % channels
+    return x[:usable].reshape(-1, channels), rate
+
+def wav_seconds(raw: bytes) -> float:
+    # duration from the header (PCM or mu-law); 0 when raw is not a readable WAV
+    try:
+        with wave.open(io.BytesIO(raw), "rb") as wf:
+            return wf.getnframes() / float(wf.getframerate())
+    except wave.Error:
+        pass
+    except Exception:
+        return 0.0
+    try:
+        (tag, channels, rate, _, _, _), data = _wav_chunks(raw)
+    except Exception:
+        return 0.0
+    if tag != WAVE_FORMAT_MULAW or not rate or not channels:
+        return 0.0
+    return len(data) / float(rate * channels)
+
+def downmix(x: np.ndarray) -> np.ndarray:
+    if x.ndim == 1:
+        return x
+    return x.mean(axis=1, dtype=np.float32)
+
+def resample(x: np.ndarray, src_rate: int, dst_rate: int) -> np.ndarray:
+    # Band-limited FFT resampling, done in padded blocks so memory stays flat for long calls.
+    if src_rate == dst_rate or len(x) == 0:
+        return x
+    ratio = dst_rate / src_rate
+    block = int(RESAMPLE_BLOCK_SEC * src_rate)
+    pad = int(RESAMPLE_PAD_SEC * src_rate)
+    out = []
+    for start in range(0, len(x), block):
+        end = min(start + block, len(x))
+        lo, hi = max(0, start - pad), min(len(x), end + pad)
+        n_out = int(round(hi * ratio)) - int(round(lo * ratio))
+        if n_out <= 0:
+            continue
+        spec = np.fft.rfft(x[lo:hi])
+        keep = n_out // 2 + 1
+        trimmed = np.zeros(keep, dtype=spec.dtype)
+        m = min(keep, len(spec))
+        trimmed[:m] = spec[:m]
+        y = np.fft.irfft(trimmed, n_out) * (n_out / (hi - lo))
+        a = int(round(start * ratio)) - int(round(lo * ratio))
+        b = a + int(round(end * ratio)) - int(round(start * ratio))
+        out.append(y[a:b].astype(np.float32))
+    return np.concatenate(out) if out else x[:0]
+
+def frame_rms(x: np.ndarray, rate: int, frame_sec: float = FRAME_SEC) -> np.ndarray:
+    n = max(1, int(rate * frame_sec))
+    usable = len(x) - len(x) % n
+    if usable == 0:
+        return np.zeros(0, dtype=np.float32)
+    frames = x[:usable].reshape(-1, n)
+    return np.sqrt(np.mean(frames * frames, axis=1))
+
+def trim_silence(x: np.ndarray, rate: int) -> np.ndarray:
+    rms = frame_rms(x, rate)
+    loud = np.flatnonzero(rms > 10 ** (AUDIO_SILENCE_DB / 20))
+    if len(loud) == 0:
+        return x
+    n = max(1, int(rate * FRAME_SEC))
+    pad = int(AUDIO_SILENCE_PAD_SEC * rate)
+    start = max(0, loud[0] * n - pad)
+    end = min(len(x), (loud[-1] + 1) * n + pad)
+    return x[start:end]
+
+# segment (exponent) of a biased sample, looked up by its top 8 bits
+
+def mulaw_encode(x: np.ndarray) -> bytes:
+    # G.711 mu-law (the classic linear2ulaw), vectorised over 16-bit samples
+    pcm = np.round(np.clip(x, -1, 1) * 32767).astype(np.int32)
+    sign = np.where(pcm < 0, 0x80, 0)
+    pcm = np.minimum(np.abs(pcm), MULAW_CLIP) + MULAW_BIAS
+    exponent = MULAW_SEGMENT[(pcm >> 7) & 0xFF]
+    mantissa = (pcm >> (exponent + 3)) & 0x0F
+    return (~(sign | (exponent << 4) | mantissa) & 0xFF).astype(np.uint8).tobytes()
+
+def encode_wav(x: np.ndarray, rate: int, encoding: str = "pcm16") -> bytes:
+    if encoding == "mulaw":
+        data = mulaw_encode(x)
+        fmt = struct.pack("<HHIIHHH", WAVE_FORMAT_MULAW, 1, rate, rate, 1, 8, 0)
+        fact = b"fact" + struct.pack("<II", 4, len(data))
+        body = b"WAVE" + b"fmt " + struct.pack("<I", len(fmt)) + fmt + fact + b"data" + struct.pack("<I", len(data)) + data
+        return b"RIFF" + struct.pack("<I", len(body)) + body
+
+    pcm = (np.clip(x, -1, 1) * 32767).astype("<i2")
+    buf = io.BytesIO()
+    with wave.open(buf, "wb") as wf:
+        wf.setnchannels(1)
+        wf.setsampwidth(2)
+        wf.setframerate(rate)
+        wf.writeframes(pcm.tobytes())
+    return buf.getvalue()
+
+def analyse_signal(x: np.ndarray, rate: int):
+    n = max(16, int(rate * VAD_FRAME_SEC))
+    duration = len(x) / rate if rate else 0
+    clipping = float(np.mean(np.abs(x) >= VAD_CLIP_LEVEL)) if len(x) else 0.0
+    usable = len(x) - len(x) % n
+    if usable == 0:
+        return {"duration_sec": round(duration, 2), "voiced_sec": 0.0, "tonal_sec": 0.0,
+                "speech_energy_ratio": 0.0, "clipping_ratio": clipping, "empty": "short"}
+
+    frames = x[:usable].reshape(-1, n) * np.hanning(n).astype(np.float32)
+    power = np.abs(np.fft.rfft(frames, axis=1)) ** 2
+    freqs = np.fft.rfftfreq(n, 1 / rate)
+    total = power.sum(axis=1) + 1e-12
+    band = power[:, (freqs >= 300) & (freqs <= 3400)].sum(axis=1)
+    top = np.sort(power, axis=1)[:, -VAD_TONAL_BINS:].sum(axis=1)
+
+    rms = np.sqrt(np.mean(x[:usable].reshape(-1, n) ** 2, axis=1))
+    loud = rms > 10 ** (VAD_ENERGY_DB / 20)
+    tonal = loud & (top / total >= VAD_TONAL_RATIO)
+    voiced = loud & ~tonal & (band / total >= VAD_MIN_SPEECH_RATIO)
+
+    frame_sec = n / rate
+    voiced_sec = float(voiced.sum() * frame_sec)
+    tonal_sec = float(tonal.sum() * frame_sec)
+    speech_ratio = float(band[loud].sum() / total[loud].sum()) if loud.any() else 0.0
+
+    empty = None
+    if duration < VAD_MIN_DURATION_SEC:
+        empty = "short"
+    elif voiced_sec < VAD_MIN_VOICED_SEC:
+        empty = "ringing" if tonal_sec > voiced_sec else "silent"
+
+    return {
+        "duration_sec": round(duration, 2),
+        "voiced_sec": round(voiced_sec, 2),
+        "tonal_sec": round(tonal_sec, 2),
+        "speech_energy_ratio": round(speech_ratio, 3),
+        "clipping_ratio": round(clipping, 5),
+        "empty": empty,
+    }
+
+def preprocess_wav(raw: bytes):
+    # Returns (bytes to upload, stats). Falls back to the original bytes when the WAV
+    # can't be decoded or processing would not make it smaller. stats["skip_reason"]
+    # is set when the signal analyser judges the call empty.
+    stats = {"bytes_in": len(raw), "bytes_out": len(raw), "processed": False, "skip_reason": None}
+    if not AUDIO_PREPROCESS and not VAD_ENABLED:
+        return raw, stats
+    try:
+        x, rate = decode_wav(raw)
+    except Exception as e:
+        stats["error"] = repr(e)
+        return raw, stats
+
+    stats["channels_in"] = x.shape[1]
+    stats["rate_in"] = rate
+    stats["duration_in"] = round(len(x) / rate, 2) if rate else 0
+
+    mono = downmix(x)
+    target = min(rate, AUDIO_TARGET_RATE)
+    mono = resample(mono, rate, target)
+    if VAD_ENABLED:
+        stats["analysis"] = analyse_signal(mono, target)
+        stats["skip_reason"] = stats["analysis"]["empty"]
+    if not AUDIO_PREPROCESS:
+        return raw, stats
+    if AUDIO_TRIM_SILENCE:
+        mono = trim_silence(mono, target)
+    out = encode_wav(mono, target, AUDIO_ENCODING)
+
+    stats["rate_out"] = target
+    stats["duration_out"] = round(len(mono) / target, 2) if target else 0
+    if len(out) >= len(raw):
+        return raw, stats
+    stats["bytes_out"] = len(out)
+    stats["processed"] = True
+    return out, stats
+
+def split_points(x: np.ndarray, rate: int, chunk_sec: float = None, search_sec: float = None):
+    # sample offsets of the cuts: for each nominal boundary, the quietest frame within
+    # search_sec of it. Chunks never come out shorter than half a nominal chunk.
+    chunk_sec = chunk_sec or SPLIT_CHUNK_SEC
+    search_sec = SPLIT_SEARCH_SEC if search_sec is None else search_sec
+    rms = frame_rms(x, rate)
+    n = max(1, int(rate * FRAME_SEC))
+    chunk = int(chunk_sec / FRAME_SEC)
+    search = int(search_sec / FRAME_SEC)
+    cuts, start = [], 0
+    while len(rms) - start > chunk + chunk // 2:
+        target = start + chunk
+        lo, hi = max(start + chunk // 2, target - search), min(len(rms) - chunk // 2, target + search + 1)
+        cut = lo + int(np.argmin(rms[lo:hi])) if hi > lo else target
+        cuts.append(cut * n)
+        start = cut
+    return cuts
+
+def split_wav(raw: bytes):
+    # [raw] when the recording is short, splitting is off or the WAV can't be decoded;
+    # otherwise mono chunks overlapping by SPLIT_OVERLAP_SEC on each side of a cut
+    if not SPLIT_ENABLED:
+        return [raw]
+    try:
+        x, rate = decode_wav(raw)
+    except Exception:
+        return [raw]
+    if not rate or len(x) / rate <= SPLIT_MIN_SEC:
+        return [raw]
+
+    mono = downmix(x)
+    overlap = int(SPLIT_OVERLAP_SEC * rate)
+    bounds = [0, *split_points(mono, rate), len(mono)]
+    # chunks keep the compact encoding when the input came out of preprocess_wav
+    encoding = AUDIO_ENCODING if AUDIO_PREPROCESS else "pcm16"
+    return [
+        encode_wav(mono[max(0, a - overlap):min(len(mono), b + overlap)], rate, encoding)
+        for a, b in zip(bounds, bounds[1:])
+    ]
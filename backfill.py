@@ -0,0 +1,187 @@
+import argparse, json, os, sys, time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from datetime import date, datetime, timedelta
+from multiprocessing import get_context
+from pathlib import Path
+
+# Re-runs the join and flag stages over a range of days, one day per worker process.
+# Each day runs join_calls_at_date then generate_flags_from_transcripts, exactly as the
+# transcription job does. Progress is checkpointed in BACKFILL_DIR after every day, so an
+# interrupted run continues with --resume.
+#
+#   python backfill.py run --start 2025-07-01 --end 2025-09-30 --workers 8
+#   python backfill.py run --start 2025-07-01 --end 2025-09-30 --incomplete --dry-run
+#   python backfill.py run --start 2025-07-01 --end 2025-09-30 --stages flags --all   # after a prompt change
+#   python backfill.py resume backfill-20250701-20250930-20251019120000
+#   python backfill.py status
+#
+# The OpenAI budgets (ratelimit_utils) are per process, so each worker gets 1/N of them.
+
+BACKFILL_DIR = Path(os.getenv("BACKFILL_DIR", "backfills"))
+BACKFILL_WORKERS = int(os.getenv("BACKFILL_WORKERS", 4))
+STAGES = ("join", "flags")
+RATE_ENV = ("TRANSCRIBE_RPM", "TRANSCRIBE_TPM", "CHAT_RPM", "CHAT_TPM")
+
+def _path(run_id):
+    return BACKFILL_DIR / f"{run_id}.json"
+
+def save_run(run):
+    BACKFILL_DIR.mkdir(parents=True, exist_ok=True)
+    tmp = _path(run["id"]).with_suffix(".tmp")
+    tmp.write_text(json.dumps(run, indent=1))
+    tmp.replace(_path(run["id"]))
+
+def load_run(run_id):
+    return json.loads(_path(run_id).read_text())
+
+def list_runs():
+    if not BACKFILL_DIR.exists():
+        return []
+    return [json.loads(p.read_text()) for p in sorted(BACKFILL_DIR.glob("*.json"))]
+
+def date_range(start: date, end: date):
+    d = start
+    while d <= end:
+        yield d
+        d += timedelta(days=1)
+
+def incomplete_dates(start: date, end: date):
+    # days with raw calls whose metrics are missing or not fully flagged (same rule as /completeness)
+    from report_utils import get_completeness
+    return [
+        (date.fromisoformat(day["date"]), day["totals"])
+        for day in get_completeness(start, end)
+        if day["totals"]["raw"] and not day["complete"]
+    ]
+
+def _rate_env(workers):
+    # split the parent's effective budgets evenly; 0 (no limit) stays 0
+    from ratelimit_utils import TRANSCRIBE_RPM, TRANSCRIBE_TPM, CHAT_RPM, CHAT_TPM
+    values = (TRANSCRIBE_RPM, TRANSCRIBE_TPM, CHAT_RPM, CHAT_TPM)
+    return {name: str(value / workers) for name, value in zip(RATE_ENV, values)}
+
+def _init_worker(env):
+    # spawned workers have not imported ratelimit_utils yet, so it reads these
+    os.environ.update(env)
+
+def process_day(day: str, stages, only_pending=True):
+    # worker entry point; returns instead of raising so one bad day does not stop the run
+    from join_utils import join_calls_at_date
+    from transcript_utils import generate_flags_from_transcripts
+    d = date.fromisoformat(day)
+    start = time.perf_counter()
+    try:
+        if "join" in stages:
+            join_calls_at_date(d)
+        if "flags" in stages:
+            generate_flags_from_transcripts(d, only_pending=only_pending)
+    except Exception as e:
+        return {"date": day, "ok": False, "seconds": time.perf_counter() - start, "error": repr(e)}
+    return {"date": day, "ok": True, "seconds": time.perf_counter() - start}
+
+def create_run(dates, stages, only_pending):
+    first, last = min(dates), max(dates)
+    return {
+        "id": f"backfill-{first:%Y%m%d}-{last:%Y%m%d}-{datetime.utcnow():%Y%m%d%H%M%S}",
+        "dates": [d.isoformat() for d in dates],
+        "stages": list(stages),
+        "only_pending": only_pending,
+        "done": {},
+        "failed": {},
+        "created_at": datetime.utcnow().isoformat(),
+    }
+
+def _eta(elapsed, done, remaining):
+    if not done:
+        return "?"
+    sec = elapsed / done * remaining
+    return f"{int(sec // 60)}m{int(sec % 60):02d}s"
+
+def execute(run, workers):
+    todo = [d for d in run["dates"] if d not in run["done"]]
+    run["failed"] = {}
+    save_run(run)
+    total, finished = len(todo), 0
+    print(f"{run['id']}: {total} days to process ({len(run['done'])} already done), "
+          f"stages={','.join(run['stages'])}, workers={workers}", file=sys.stderr)
+    if not todo:
+        return run
+
+    start = time.perf_counter()
+    ctx = get_context("spawn")  # fresh interpreters: no inherited DB sockets or logging threads
+    with ProcessPoolExecutor(max_workers=workers, mp_context=ctx, initializer=_init_worker, initargs=(_rate_env(workers),)) as pool:
+        futures = [pool.submit(process_day, d, run["stages"], run["only_pending"]) for d in todo]
+        for f in as_completed(futures):
+            r = f.result()
+            finished += 1
+            if r["ok"]:
+                run["done"][r["date"]] = round(r["seconds"], 2)
+                status = "ok"
+            else:
+                run["failed"][r["date"]] = r["error"]
+                status = f"FAILED {r['error']}"
+            save_run(run)
+            elapsed = time.perf_counter() - start
+            print(f"[{finished}/{total}] {r['date']} {status} {r['seconds']:.1f}s  "
+                  f"elapsed {elapsed:.0f}s eta {_eta(elapsed, finished, total - finished)}", file=sys.stderr)
+    return run
+
+def main():
+    parser = argparse.ArgumentParser(description="Re-run join and flag stages over a date range")
+    sub = parser.add_subparsers(dest="cmd", required=True)
+
+    p_run = sub.add_parser("run", help="process a date range")
+    p_run.add_argument("--start", required=True)
+    p_run.add_argument("--end")
+    p_run.add_argument("--incomplete", action="store_true", help="only days that /completeness reports as incomplete")
+    p_run.add_argument("--stages", default="join,flags", help="comma-separated subset of join,flags")
+    p_run.add_argument("--all", action="store_true", help="re-flag every transcript, not only pending ones")
+    p_run.add_argument("--workers", type=int, default=BACKFILL_WORKERS)
+    p_run.add_argument("--dry-run", action="store_true", help="list the days that would be processed and exit")
+
+    p_resume = sub.add_parser("resume", help="continue a checkpointed run (failed days are retried)")
+    p_resume.add_argument("run_id")
+    p_resume.add_argument("--workers", type=int, default=BACKFILL_WORKERS)
+
+    sub.add_parser("status", help="list checkpointed runs")
+    args = parser.parse_args()
+
+    if args.cmd == "status":
+        for run in list_runs():
+            print(f"{run['id']}  done={len(run['done'])}/{len(run['dates'])} failed={len(run['failed'])} "
+                  f"stages={','.join(run['stages'])} only_pending={run['only_pending']}")
+        return
+
+    if args.cmd == "resume":
+        run = load_run(args.run_id)
+    else:
+        stages = [s.strip() for s in args.stages.split(",") if s.strip()]
+        if not stages or set(stages) - set(STAGES):
+            parser.error(f"--stages must be a subset of {','.join(STAGES)}")
+        start = date.fromisoformat(args.start)
+        end = date.fromisoformat(args.end) if args.end else start
+        if end < start:
+            parser.error("--end is before --start")
+
+        if args.incomplete:
+            found = incomplete_dates(start, end)
+            dates = [d for d, _ in found]
+        else:
+            found, dates = None, list(date_range(start, end))
+
+        if args.dry_run:
+            for d, totals in found or [(d, None) for d in dates]:
+                print(d.isoformat() + (f"  {totals}" if totals else ""))
+            print(f"{len(dates)} days, stages={','.join(stages)}, only_pending={not args.all}", file=sys.stderr)
+            return
+        if not dates:
+            print("nothing to do", file=sys.stderr)
+            return
+        run = create_run(dates, stages, only_pending=not args.all)
+
+    run = execute(run, max(1, args.workers))
+    print(f"{run['id']}: {len(run['done'])}/{len(run['dates'])} done, {len(run['failed'])} failed")
+    sys.exit(1 if run["failed"] else 0)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,332 @@
+import argparse, io, json, os, time
+from datetime import date, datetime, timedelta
+from pathlib import Path
+import pandas as pd
+from db_utils import query_all, update_metrics_with_flags
+from ai_utils import PROMPTS, chat_request, parse_verdict, classify, record_usage, get_openai_client, is_skipped_transcript
+from rules_utils import rule_verdict
+from transcript_utils import PENDING_FLAGS_SQL, split_skipped, fill_unrecorded_on_date
+from log_utils import get_logger, fields
+
+# Batch-API classification for non-urgent backfills (half price, up to 24h turnaround).
+# Phase 1 asks voicemail (outbound), new_patient (inbound) and dropped (all);
+# phase 2 asks proactive (outbound, not voicemail) and booked (not voicemail, not
+# dropped) once phase 1 is known. Job state lives in BATCH_DIR so a restarted
+# process resumes where it stopped.
+#
+#   python batch_flags.py run --start 2025-07-01 --end 2025-09-30
+#   python batch_flags.py resume flags-20250701-20250930-...
+#   python batch_flags.py status
+
+BATCH_DIR = Path(os.getenv("BATCH_DIR", "batches"))
+BATCH_POLL_SEC = float(os.getenv("BATCH_POLL_SEC", 60))
+TERMINAL = {"completed", "failed", "expired", "cancelled"}
+FLAGS = ["is_voicemail", "is_proactive", "is_new_patient", "is_dropped", "is_booked"]
+
+logger = get_logger(__name__)
+
+def day_bounds_range(start: date, end: date):
+    lo = datetime.combine(start, datetime.min.time())
+    hi = datetime.combine(end, datetime.min.time()) + timedelta(days=1)
+    return lo, hi
+
+def get_transcriptions_in_range(start: date, end: date, only_pending=True):
+    lo, hi = day_bounds_range(start, end)
+    return query_all(
+        f"""
+        SELECT
+            t.call_id,
+            t.transcript,
+            md5(t.transcript::text) AS transcript_md5,
+            m.call_type
+        FROM transcriptions AS t
+        JOIN metrics AS m
+        USING (call_id)
+        WHERE m.call_time >= %s AND m.call_time < %s
+        AND m.call_type IN ('inbound', 'outbound')
+        {"AND " + PENDING_FLAGS_SQL if only_pending else ""}
+        ORDER BY m.call_time
+        """,
+        (lo, hi),
+        name="batch_transcriptions",
+    )
+
+def _path(job_id):
+    return BATCH_DIR / f"{job_id}.json"
+
+def save_job(job):
+    BATCH_DIR.mkdir(parents=True, exist_ok=True)
+    tmp = _path(job["id"]).with_suffix(".tmp")
+    tmp.write_text(json.dumps(job, indent=1, default=str))
+    tmp.replace(_path(job["id"]))
+
+def load_job(job_id):
+    return json.loads(_path(job_id).read_text())
+
+def list_jobs():
+    if not BATCH_DIR.exists():
+        return []
+    return [json.loads(p.read_text()) for p in sorted(BATCH_DIR.glob("*.json"))]
+
+def create_job(start: date, end: date, only_pending=True):
+    job = {
+        "id": f"flags-{start:%Y%m%d}-{end:%Y%m%d}-{datetime.utcnow():%Y%m%d%H%M%S}",
+        "start": start.isoformat(),
+        "end": end.isoformat(),
+        "only_pending": only_pending,
+        "status": "created",
+        "calls": {},
+        "skipped": {},
+        "phases": {},
+    }
+    rows = pd.DataFrame(get_transcriptions_in_range(start, end, only_pending))
+    if not rows.empty:
+        skipped, rows = split_skipped(rows)
+        job["skipped"] = {
+            r["call_id"]: {**{f: bool(r[f]) for f in FLAGS}, "transcript_md5": r["transcript_md5"]}
+            for _, r in skipped.iterrows()
+        }
+        for _, r in rows.iterrows():
+            job["calls"][r["call_id"]] = {
+                "call_type": r["call_type"],
+                "transcript_md5": r["transcript_md5"],
+                "is_voicemail": False,
+                "is_proactive": False,
+                "is_new_patient": False,
+                "is_dropped": None,
+                "is_booked": False,
+            }
+    save_job(job)
+    logger.info("batch job created", extra=fields("batch", job=job["id"], calls=len(job["calls"]), skipped=len(job["skipped"])))
+    return job
+
+def _texts(job):
+    rows = query_all(
+        "SELECT call_id, transcript FROM transcriptions WHERE call_id = ANY(%s)",
+        (list(job["calls"]),),
+        name="batch_texts",
+    )
+    return {r["call_id"]: (r["transcript"] or {}).get("raw", "") for r in rows if not is_skipped_transcript(r["transcript"])}
+
+def _phase_requests(job, phase):
+    # [(call_id, classifier)] this phase has to decide
+    wanted = []
+    for call_id, c in job["calls"].items():
+        if phase == 1:
+            if c["call_type"] == "outbound":
+                wanted.append((call_id, "voicemail"))
+            else:
+                wanted.append((call_id, "new_patient"))
+            wanted.append((call_id, "dropped"))
+        else:
+            if c["call_type"] == "outbound" and not c["is_voicemail"]:
+                wanted.append((call_id, "proactive"))
+            if not c["is_voicemail"] and not c["is_dropped"]:
+                wanted.append((call_id, "booked"))
+    return wanted
+
+def submit_phase(job, phase):
+    texts = _texts(job)
+    lines = []
+    decided = 0
+    for call_id, classifier in _phase_requests(job, phase):
+        text = texts.get(call_id, "")
+        verdict = rule_verdict(classifier, text)
+        if verdict is not None:
+            job["calls"][call_id][f"is_{classifier}"] = verdict
+            decided += 1
+            continue
+        lines.append(json.dumps({
+            "custom_id": f"{call_id}:{classifier}",
+            "method": "POST",
+            "url": "/v1/chat/completions",
+            "body": chat_request(PROMPTS[classifier](text)),
+        }, ensure_ascii=False))
+
+    state = {"requests": len(lines), "decided_by_rules": decided, "batch_id": None, "status": "completed"}
+    job["phases"][str(phase)] = state
+    if not lines:
+        # nothing left for the API (no calls, or the rules decided all of them)
+        job["status"] = f"phase{phase}_done"
+        save_job(job)
+        logger.info("batch phase decided without a batch", extra=fields("batch", job=job["id"], phase=phase, **state))
+        return
+
+    # the request file and the rule verdicts are on disk before anything is sent, so a restart
+    # in phaseN_submitting only has to create the batch
+    BATCH_DIR.mkdir(parents=True, exist_ok=True)
+    _input_path(job, phase).write_bytes(("\n".join(lines) + "\n").encode("utf-8"))
+    state["status"] = "submitting"
+    job["status"] = f"phase{phase}_submitting"
+    save_job(job)
+    create_batch(job, phase)
+
+def _find_batch(client, job, phase):
+    # a batch created before the process died but never written to the job file (recent, so
+    # on the first page)
+    for batch in client.batches.list(limit=100).data:
+        metadata = batch.metadata or {}
+        if metadata.get("job") == job["id"] and metadata.get("phase") == str(phase):
+            return batch
+    return None
+
+def create_batch(job, phase):
+    state = job["phases"][str(phase)]
+    client = get_openai_client()
+    batch = _find_batch(client, job, phase)
+    if batch is None:
+        if not state.get("input_file_id"):
+            payload = _input_path(job, phase).read_bytes()
+            uploaded = client.files.create(file=(_input_path(job, phase).name, io.BytesIO(payload)), purpose="batch")
+            state["input_file_id"] = uploaded.id
+            save_job(job)
+        batch = client.batches.create(
+            input_file_id=state["input_file_id"],
+            endpoint="/v1/chat/completions",
+            completion_window="24h",
+            metadata={"job": job["id"], "phase": str(phase)},
+        )
+    else:
+        logger.info("batch already created, resuming it", extra=fields("batch", job=job["id"], phase=phase, batch_id=batch.id))
+        state["input_file_id"] = batch.input_file_id
+    state.update({"batch_id": batch.id, "status": batch.status})
+    job["status"] = f"phase{phase}_submitted"
+    save_job(job)
+    logger.info("batch phase submitted", extra=fields("batch", job=job["id"], phase=phase, **state))
+
+def _apply_results(job, phase, output_text):
+    answered = set()
+    for line in output_text.splitlines():
+        if not line.strip():
+            continue
+        item = json.loads(line)
+        response = item.get("response") or {}
+        if item.get("error") or response.get("status_code") != 200:
+            continue
+        call_id, classifier = item["custom_id"].rsplit(":", 1)
+        body = response["body"]
+        record_usage(classifier, body.get("usage"))
+        job["calls"][call_id][f"is_{classifier}"] = parse_verdict(classifier, body["choices"][0]["message"]["content"])
+        answered.add((call_id, classifier))
+    return answered
+
+def collect_phase(job, phase):
+    # returns True once the phase is fully resolved
+    state = job["phases"][str(phase)]
+    if state["batch_id"] is None:
+        # jobs saved by an older version left an empty phase in phaseN_submitted
+        job["status"] = f"phase{phase}_done"
+        save_job(job)
+        return True
+
+    client = get_openai_client()
+    batch = client.batches.retrieve(state["batch_id"])
+    state["status"] = batch.status
+    if batch.status not in TERMINAL:
+        save_job(job)
+        return False
+
+    answered = set()
+    if batch.output_file_id:
+        answered = _apply_results(job, phase, client.files.content(batch.output_file_id).text)
+
+    # anything the batch did not answer (errors, expiry) is classified synchronously
+    missing = [tuple(cid.rsplit(":", 1)) for cid in _requested_ids(job, phase)]
+    missing = [m for m in missing if m not in answered]
+    if missing:
+        logger.warning("batch results missing, classifying synchronously", extra=fields("batch", job=job["id"], phase=phase, missing=len(missing), status=batch.status))
+        texts = _texts(job)
+        for call_id, classifier in missing:
+            job["calls"][call_id][f"is_{classifier}"] = classify(classifier, texts.get(call_id, ""))
+
+    job["status"] = f"phase{phase}_done"
+    save_job(job)
+    return True
+
+def _input_path(job, phase):
+    return BATCH_DIR / f"{job['id']}-phase{phase}.jsonl"
+
+def _requested_ids(job, phase):
+    path = _input_path(job, phase)
+    if not path.exists():
+        return set()
+    return {json.loads(line)["custom_id"] for line in path.read_text().splitlines() if line.strip()}
+
+def apply_job(job):
+    rows = [{"call_id": call_id, "transcript_md5": c.get("transcript_md5"), **{f: c[f] for f in FLAGS}} for call_id, c in job["calls"].items()]
+    rows += [{"call_id": call_id, **flags} for call_id, flags in job["skipped"].items()]
+    update_metrics_with_flags(pd.DataFrame(rows, columns=["call_id", "transcript_md5"] + FLAGS))
+
+    d, end = date.fromisoformat(job["start"]), date.fromisoformat(job["end"])
+    while d <= end:
+        fill_unrecorded_on_date(d)
+        d += timedelta(days=1)
+
+    job["status"] = "applied"
+    save_job(job)
+    logger.info("batch job applied", extra=fields("batch", job=job["id"], calls=len(rows)))
+
+def step(job):
+    # advances the job by one transition without waiting; returns True when applied
+    status = job["status"]
+    if status == "created":
+        submit_phase(job, 1)
+    elif status == "phase1_submitting":
+        create_batch(job, 1)
+    elif status == "phase1_submitted":
+        collect_phase(job, 1)
+    elif status == "phase1_done":
+        submit_phase(job, 2)
+    elif status == "phase2_submitting":
+        create_batch(job, 2)
+    elif status == "phase2_submitted":
+        collect_phase(job, 2)
+    elif status == "phase2_done":
+        apply_job(job)
+    elif status != "applied":
+        raise ValueError(f"unknown job status {status!r}")
+    return job["status"] == "applied"
+
+def run(job, wait=True):
+    # only an unfinished batch is waited on; every other state moves straight on
+    while not step(job):
+        if job["status"].endswith("_submitted"):
+            if not wait:
+                return job
+            time.sleep(BATCH_POLL_SEC)
+    return job
+
+def main():
+    parser = argparse.ArgumentParser(description="Batch-API flag backfill")
+    sub = parser.add_subparsers(dest="cmd", required=True)
+
+    p_run = sub.add_parser("run", help="create a job for a date range and drive it")
+    p_run.add_argument("--start", required=True)
+    p_run.add_argument("--end")
+    p_run.add_argument("--all", action="store_true", help="re-flag every transcript, not only NULL flags")
+    p_run.add_argument("--no-wait", action="store_true", help="submit and exit; continue later with resume")
+
+    p_resume = sub.add_parser("resume", help="continue an existing job")
+    p_resume.add_argument("job_id")
+    p_resume.add_argument("--no-wait", action="store_true")
+
+    sub.add_parser("status", help="list jobs")
+    args = parser.parse_args()
+
+    if args.cmd == "status":
+        for job in list_jobs():
+            phases = {k: v.get("status") for k, v in job["phases"].items()}
+            print(f"{job['id']}  {job['status']:<18} calls={len(job['calls'])} phases={phases}")
+        return
+
+    if args.cmd == "run":
+        start = date.fromisoformat(args.start)
+        job = create_job(start, date.fromisoformat(args.end) if args.end else start, only_pending=not args.all)
+    else:
+        job = load_job(args.job_id)
+
+    job = run(job, wait=not args.no_wait)
+    print(f"{job['id']}: {job['status']}")
+
+if __name__ == "__main__":
+    main()
@@ -1,36 +1,76 @@
-import os
+import os, re
 import psycopg2
 from psycopg2.errors import UniqueViolation, ForeignKeyViolation
 from psycopg2.extras import execute_values, RealDictCursor
-import pandas as pd
+from metrics_utils import DB_QUERY_SECONDS
+from log_utils import get_logger, fields
 
 # from dotenv import load_dotenv
 # load_dotenv()
 
+# raw_report is partitioned on call_time, so its (call_id, call_time) key cannot stop the same
+# call_id arriving again with another call_time (a re-export in a different timezone, say).
+# insert_raw_report_df checks call_id itself under this transaction lock; metrics rows are only
+# built from raw_report rows, and the flag updates and transcription joins rely on call_id alone.
+RAW_REPORT_LOCK_KEY = 720_361_002
+
+logger = get_logger(__name__)
+
 def get_db_config():
-    return {
+    config = {
         "host": os.getenv("POSTGRESQL_HOST"),
         "database": os.getenv("POSTGRESQL_DATABASE"),
         "user": os.getenv("POSTGRESQL_USER"),
         "password": os.getenv("POSTGRESQL_PASSWORD"),
         "port": os.getenv("POSTGRESQL_PORT", 5432),
-        "sslmode": "require",
-        "options": f"endpoint={os.getenv('POSTGRESQL_ENDPOINT')}"
+        # local Postgres (load tests) usually runs without SSL
+        "sslmode": os.getenv("POSTGRESQL_SSLMODE", "require"),
     }
+    if os.getenv("POSTGRESQL_ENDPOINT"):
+        config["options"] = f"endpoint={os.getenv('POSTGRESQL_ENDPOINT')}"
+    return config
 
 def get_conn():
     return psycopg2.connect(**get_db_config())
 
-def insert_raw_report_df(df: pd.DataFrame):
+# digit groups joined by one separator (a space, a dash or a bracket with an optional space):
+# "0161 234 5678", "+44 (0)161 234 5678", "(07700900123)". A longer gap such as " - " or ") ("
+# ends the number, and digits touching a colon are a time ("02:15"), not part of one.
+# PHONE_SQL_RE is the same pattern for Postgres (migrations.py).
+PHONE_RE = re.compile(r"(?<![\d:])\d+(?:(?:[ -]|\) ?| ?\()\d+)*(?![\d:])")
+PHONE_SQL_RE = r"(?<![0-9:])[0-9]+(?:(?:[ -]|\) ?| ?\()[0-9]+)*(?![0-9:])"
+PHONE_SUFFIX_DIGITS = 7
+PHONE_KEY_MIN_DIGITS = 6
+
+def phone_suffixes(*texts):
+    # last 7 and last 6 digits of every phone-like number, as stored in raw_report_phones.suffix.
+    # transcriptions.phone_key is the last 7 digits of the number in the filename, or all of it
+    # when shorter (6-digit local numbers), so either length finds its raw row by equality.
+    out = set()
+    for text in texts:
+        for m in PHONE_RE.finditer(text or ""):
+            digits = re.sub(r"\D", "", m.group(0))
+            for n in range(PHONE_KEY_MIN_DIGITS, PHONE_SUFFIX_DIGITS + 1):
+                if len(digits) >= n:
+                    out.add(int(digits[-n:]))
+    return out
+
+@DB_QUERY_SECONDS.labels("insert_raw_report_df").time()
+def insert_raw_report_df(df: "pd.DataFrame"):
+    import pandas as pd
     COLUMNS = ['Call ID', 'Call Time', 'From', 'Is Voicemail', 'Is Dropped', 'Is Redirected', 'Is Recalled', 'Recall Id', 'Phone Key', 'Duration', 'Cost', 'Direction', 'Status', 'Call Activity Details']
     REQUIRED = ['Call ID', 'Call Time','From', 'Is Voicemail', 'Is Dropped', 'Is Redirected', 'Is Recalled', 'Recall Id', 'Phone Key', 'Duration', 'Direction','Status']  # NOT NULLs in your table
 
-    df = df[COLUMNS].copy()
+    # back to object columns holding None, whatever dtypes process_csv used
+    df = df[COLUMNS].astype(object)
+    df = df.where(df.notna(), None)
 
     # Normalize/trim strings (avoids '  id  ' and empty -> None)
     for col in ['Call ID', 'From', 'Is Voicemail', 'Is Dropped', 'Is Redirected', 'Is Recalled', 'Recall Id', 'Phone Key', 'Direction', 'Duration', 'Status', 'Call Activity Details']:
         if col in df.columns:
-            df[col] = df[col].astype(str).str.strip()
+            # map(str), not astype(str): on pandas 3 astype(str) keeps None as NaN and the row
+            # would be dropped as NULL below; pandas 2 wrote "None"
+            df[col] = df[col].map(str).str.strip()
     df.replace({'': None}, inplace=True)
 
     # Types
@@ -47,21 +87,44 @@ def insert_raw_report_df(df: pd.DataFrame):
         return 0
 
     rows = list(df.itertuples(index=False, name=None))
+    phones = [
+        (call_id, call_time, suffix)
+        for call_id, call_time, call_from, details in df[['Call ID', 'Call Time', 'From', 'Call Activity Details']].itertuples(index=False, name=None)
+        for suffix in phone_suffixes(call_from, details)
+    ]
 
     sql = """
         INSERT INTO raw_report
           (call_id, call_time, call_from, is_voicemail, is_dropped, is_redirected, is_recalled, recall_id, phone_key, call_duration, call_cost, call_direction, call_status, call_activity_details)
         VALUES %s
-        ON CONFLICT (call_id) DO NOTHING
+        ON CONFLICT (call_id, call_time) DO NOTHING
     """
     with get_conn() as conn:
         with conn.cursor() as cur:
+            cur.execute("SELECT pg_advisory_xact_lock(%s)", (RAW_REPORT_LOCK_KEY,))
+            cur.execute(
+                "SELECT call_id, call_time FROM raw_report WHERE call_id = ANY(%s)",
+                ([r[0] for r in rows],)
+            )
+            stored = dict(cur.fetchall())
+            moved = {r[0] for r in rows if r[0] in stored and stored[r[0]] != r[1]}
+            if moved:
+                logger.warning("raw_report call_id already stored with another call_time, skipped", extra=fields("db", calls=len(moved), sample=sorted(moved)[:5]))
+                rows = [r for r in rows if r[0] not in moved]
+                phones = [p for p in phones if p[0] not in moved]
             execute_values(cur, sql, rows, page_size=1000)
+            execute_values(
+                cur,
+                "INSERT INTO raw_report_phones (call_id, call_time, suffix) VALUES %s ON CONFLICT DO NOTHING",
+                phones, page_size=1000
+            )
     return len(rows)
 
-def run_query(query, params=None, fetch_one=False, fetch_all=False):
+# name labels db_query_seconds per call site; the generic helpers would otherwise put every
+# query under one label
+def run_query(query, params=None, fetch_one=False, fetch_all=False, name="run_query"):
     try:
-        with get_conn() as conn:
+        with DB_QUERY_SECONDS.labels(name).time(), get_conn() as conn:
             with conn.cursor() as cur:
                 cur.execute(query, params or ())
 
@@ -87,12 +150,13 @@ def run_query(query, params=None, fetch_one=False, fetch_all=False):
         raise RuntimeError(f"Failed to insert: {str(e)}")
 
 
-def query_all(sql, params=None):
-    with get_conn() as conn:
+def query_all(sql, params=None, name="query_all"):
+    with DB_QUERY_SECONDS.labels(name).time(), get_conn() as conn:
         with conn.cursor(cursor_factory=RealDictCursor) as cur:
             cur.execute(sql, params or ())
             return [dict(r) for r in cur.fetchall()]
 
+@DB_QUERY_SECONDS.labels("update_transcriptions_with_matches").time()
 def update_transcriptions_with_matches(matches_df):
     rows = matches_df.dropna(subset=["raw_report_id"])
     if rows.empty:
@@ -114,7 +178,9 @@ def update_transcriptions_with_matches(matches_df):
             )
         conn.commit()
 
-def insert_metrics_core(df: pd.DataFrame, page_size=1000):
+@DB_QUERY_SECONDS.labels("insert_metrics_core").time()
+def insert_metrics_core(df: "pd.DataFrame", page_size=1000, update=False):
+    import pandas as pd
     if df.empty:
         return 0
 
@@ -123,13 +189,18 @@ def insert_metrics_core(df: pd.DataFrame, page_size=1000):
     if missing:
         raise ValueError(f"metrics DF missing required cols: {missing}")
 
+    # astype(object) turns nullable / categorical values back into Python scalars psycopg2 can adapt
     rows = [tuple(None if pd.isna(v) else v for v in rec)
-            for rec in df[cols].itertuples(index=False, name=None)]
+            for rec in df[cols].astype(object).itertuples(index=False, name=None)]
 
-    query = """
+    # update=True refreshes the core columns of existing rows, flags are left alone
+    on_conflict = "DO NOTHING"
+    if update:
+        on_conflict = "DO UPDATE SET " + ", ".join(f"{c} = EXCLUDED.{c}" for c in cols if c not in ("call_id", "call_time"))
+    query = f"""
         INSERT INTO metrics (call_id, call_type, is_answered, practice, duration_sec, call_time)
         VALUES %s
-        ON CONFLICT (call_id) DO NOTHING
+        ON CONFLICT (call_id, call_time) {on_conflict}
     """
 
     with get_conn() as conn:
@@ -137,7 +208,9 @@ def insert_metrics_core(df: pd.DataFrame, page_size=1000):
             psycopg2.extras.execute_values(cur, query, rows, page_size=page_size)
         conn.commit()
 
+@DB_QUERY_SECONDS.labels("update_metrics_with_flags").time()
 def update_metrics_with_flags(flags_df):
+    import pandas as pd
     rows = flags_df.dropna(subset=["call_id"])
     if rows.empty:
         return
@@ -151,6 +224,7 @@ def update_metrics_with_flags(flags_df):
             r.get("is_proactive", False),
             r.get("is_dropped", False),
             r.get("is_booked", False),
+            None if pd.isna(r.get("transcript_md5")) else r.get("transcript_md5"),
         )
         for _, r in rows.iterrows()
     ]
@@ -162,9 +236,10 @@ def update_metrics_with_flags(flags_df):
             is_voicemail   = data.is_voicemail,
             is_proactive   = data.is_proactive,
             is_dropped     = data.is_dropped,
-            is_booked      = data.is_booked
+            is_booked      = data.is_booked,
+            flags_transcript_md5 = data.transcript_md5
         FROM (VALUES %s) AS data(
-            call_id, is_new_patient, is_voicemail, is_proactive, is_dropped, is_booked
+            call_id, is_new_patient, is_voicemail, is_proactive, is_dropped, is_booked, transcript_md5
         )
         WHERE m.call_id = data.call_id;
     """
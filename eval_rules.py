@@ -0,0 +1,102 @@
+import argparse
+from datetime import date, datetime, timedelta
+import pandas as pd
+from db_utils import query_all
+from ai_utils import is_skipped_transcript
+from rules_utils import RULES, RULE_MIN_CONFIDENCE, evaluate_rules
+
+# Measures how often each local rule agrees with the labels already stored in
+# metrics (produced by the LLM), per classifier and per rule.
+#   python eval_rules.py --start 2025-08-01 --end 2025-08-31
+
+# which stored rows each classifier actually ran on in generate_flags_from_transcripts
+APPLIES = {
+    "voicemail": lambda df: df["call_type"] == "outbound",
+    "proactive": lambda df: (df["call_type"] == "outbound") & ~df["is_voicemail"].astype(bool),
+    "new_patient": lambda df: df["call_type"] == "inbound",
+    "dropped": lambda df: df["call_type"].isin(["inbound", "outbound"]),
+    "booked": lambda df: df["call_type"].isin(["inbound", "outbound"]) & ~df["is_voicemail"].astype(bool) & ~df["is_dropped"].astype(bool),
+}
+
+def load_labelled(start, end):
+    rows = query_all(
+        """
+        SELECT
+            t.transcript,
+            m.call_type,
+            m.is_voicemail,
+            m.is_proactive,
+            m.is_new_patient,
+            m.is_dropped,
+            m.is_booked
+        FROM transcriptions AS t
+        JOIN metrics AS m USING (call_id)
+        WHERE m.call_time >= %s AND m.call_time < %s
+        AND m.is_proactive IS NOT NULL
+        """,
+        (start, end),
+        name="eval_labelled",
+    )
+    df = pd.DataFrame(rows)
+    if df.empty:
+        return df
+    df = df[~df["transcript"].apply(is_skipped_transcript)].copy()
+    df["text"] = df["transcript"].apply(lambda di: (di or {}).get("raw", ""))
+    return df
+
+def evaluate(df):
+    report = []
+    for classifier in RULES:
+        sub = df[APPLIES[classifier](df)]
+        label = sub[f"is_{classifier}"].astype(bool)
+        results = sub["text"].apply(lambda t: evaluate_rules(classifier, t))
+        verdicts = results.apply(lambda r: r[0])
+        confidence = results.apply(lambda r: r[1])
+        rules = results.apply(lambda r: r[2])
+
+        for rule in [r[0] for r in RULES[classifier]]:
+            hit = rules == rule
+            n = int(hit.sum())
+            agree = int((verdicts[hit].astype(bool) == label[hit]).sum()) if n else 0
+            report.append({
+                "classifier": classifier,
+                "rule": rule,
+                "rows": len(sub),
+                "hits": n,
+                "coverage": round(n / len(sub), 3) if len(sub) else 0.0,
+                "agreement": round(agree / n, 3) if n else None,
+                "confidence": next(c for r, _, _, c in RULES[classifier] if r == rule),
+            })
+
+        decided = rules.notna() & (confidence >= RULE_MIN_CONFIDENCE)
+        n = int(decided.sum())
+        agree = int((verdicts[decided].astype(bool) == label[decided]).sum()) if n else 0
+        report.append({
+            "classifier": classifier,
+            "rule": "(all confident)",
+            "rows": len(sub),
+            "hits": n,
+            "coverage": round(n / len(sub), 3) if len(sub) else 0.0,
+            "agreement": round(agree / n, 3) if n else None,
+            "confidence": RULE_MIN_CONFIDENCE,
+        })
+    return pd.DataFrame(report)
+
+def main():
+    parser = argparse.ArgumentParser(description="Agreement of the rule tier with stored LLM labels")
+    parser.add_argument("--start", required=True, help="YYYY-MM-DD, inclusive")
+    parser.add_argument("--end", help="YYYY-MM-DD, inclusive (default: start)")
+    args = parser.parse_args()
+
+    start = datetime.combine(date.fromisoformat(args.start), datetime.min.time())
+    end = datetime.combine(date.fromisoformat(args.end or args.start), datetime.min.time()) + timedelta(days=1)
+
+    df = load_labelled(start, end)
+    if df.empty:
+        print("no flagged transcripts in range")
+        return
+    print(f"{len(df)} flagged transcripts")
+    print(evaluate(df).to_string(index=False))
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,57 @@
+import asyncio, os, random
+from fastapi import FastAPI, Request
+from fastapi.responses import JSONResponse, RedirectResponse
+
+# Local stand-in for the Google Apps Script web app (gas.js).
+# Run with: uvicorn fake_gas:app --port 9100
+# and start the app with GAS_URL=http://localhost:9100/exec
+
+LATENCY_MS = float(os.getenv("FAKE_GAS_LATENCY_MS", 3000))
+ERROR_RATE = float(os.getenv("FAKE_GAS_ERROR_RATE", 0.0))
+SCRIPT_ERROR_RATE = float(os.getenv("FAKE_GAS_SCRIPT_ERROR_RATE", 0.0))
+
+app = FastAPI()
+stats = {"requests": 0, "errors": 0, "script_errors": 0, "docs": 0}
+results = {}
+# answers for the next /exec calls, queued through POST /fail: {"status": 503, "count": 2, "retry_after": 1}
+failures = []
+
+@app.post("/exec")
+async def exec_script(request: Request):
+    body = await request.json()
+    stats["requests"] += 1
+    key = str(stats["requests"])
+    await asyncio.sleep(LATENCY_MS / 1000)
+
+    if failures:
+        status, retry_after = failures.pop(0)
+        stats["errors"] += 1
+        headers = {"Retry-After": str(retry_after)} if retry_after is not None else None
+        return JSONResponse(status_code=status, content={"error": f"HTTP {status}"}, headers=headers)
+
+    roll = random.random()
+    if roll < ERROR_RATE:
+        stats["errors"] += 1
+        return JSONResponse(status_code=503, content={"error": "Service unavailable"})
+    if roll < ERROR_RATE + SCRIPT_ERROR_RATE or "report" not in body or "filename" not in body:
+        stats["script_errors"] += 1
+        results[key] = {"error": "Failed to create document: simulated", "doc_url": None}
+    else:
+        stats["docs"] += 1
+        results[key] = {"doc_url": f"https://docs.google.com/spreadsheets/d/fake-{body['filename']}"}
+    # like Apps Script, the answer is served from a redirect target
+    return RedirectResponse(f"/echo/{key}", status_code=302)
+
+@app.get("/echo/{key}")
+async def echo(key: str):
+    return results.pop(key, {"error": "expired", "doc_url": None})
+
+@app.post("/fail")
+async def queue_failure(request: Request):
+    body = await request.json()
+    failures.extend([(int(body.get("status", 503)), body.get("retry_after"))] * int(body.get("count", 1)))
+    return {"queued": len(failures)}
+
+@app.get("/stats")
+async def get_stats():
+    return stats
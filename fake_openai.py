@@ -0,0 +1,224 @@
+import asyncio, json, os, random, time, uuid
+from collections import deque
+from fastapi import FastAPI, HTTPException, Request
+from fastapi.responses import JSONResponse, PlainTextResponse
+
+# Local stand-in for the OpenAI transcription and chat-completions endpoints.
+# Run with: uvicorn fake_openai:app --port 9000
+# and start the app with OPENAI_BASE_URL=http://localhost:9000/v1
+
+LATENCY_MS = float(os.getenv("FAKE_OPENAI_LATENCY_MS", 800))
+JITTER_MS = float(os.getenv("FAKE_OPENAI_JITTER_MS", 300))
+ERROR_RATE = float(os.getenv("FAKE_OPENAI_ERROR_RATE", 0.0))
+RATE_LIMIT_RATE = float(os.getenv("FAKE_OPENAI_429_RATE", 0.0))
+RETRY_AFTER_SEC = float(os.getenv("FAKE_OPENAI_RETRY_AFTER_SEC", 1))
+TRUE_RATE = float(os.getenv("FAKE_OPENAI_TRUE_RATE", 0.3))
+# transcription latency grows with upload size, like the real endpoint
+LATENCY_MS_PER_MB = float(os.getenv("FAKE_OPENAI_LATENCY_MS_PER_MB", 400))
+BATCH_DELAY_SEC = float(os.getenv("FAKE_OPENAI_BATCH_DELAY_SEC", 5))
+# enforce a real requests-per-minute window per endpoint and send x-ratelimit-* headers (0 = off)
+RPM = int(os.getenv("FAKE_OPENAI_RPM", 0))
+
+SAMPLE_LINES = [
+    "Hello, you're through to the opticians, how can I help?",
+    "Hi, I'd like to book an eye test please.",
+    "We have Wednesday at 1:45, does that work?",
+    "Yes, that's fine.",
+    "Lovely, I'll book that in for you. Thank you, bye.",
+]
+
+app = FastAPI()
+stats = {"transcriptions": 0, "chat_completions": 0, "errors": 0, "rate_limited": 0, "batch_requests": 0}
+files = {}
+batches = {}
+windows = {"transcriptions": deque(), "chat": deque()}
+
+def _window(name):
+    # returns (response headers, seconds until a slot frees up or None)
+    if not RPM:
+        return {}, None
+    q, now = windows[name], time.monotonic()
+    while q and now - q[0] >= 60:
+        q.popleft()
+    reset = 60 - (now - q[0]) if q else 0
+    if len(q) >= RPM:
+        return {"x-ratelimit-limit-requests": str(RPM), "x-ratelimit-remaining-requests": "0",
+                "x-ratelimit-reset-requests": f"{reset:.3f}s"}, reset
+    q.append(now)
+    return {"x-ratelimit-limit-requests": str(RPM), "x-ratelimit-remaining-requests": str(RPM - len(q)),
+            "x-ratelimit-reset-requests": f"{reset:.3f}s"}, None
+
+def _limited(headers, reset):
+    stats["rate_limited"] += 1
+    return JSONResponse(
+        status_code=429,
+        content={"error": {"message": "Rate limit reached", "type": "requests", "code": "rate_limit_exceeded"}},
+        headers={**headers, "retry-after": f"{reset:.3f}"},
+    )
+
+async def _simulate(extra_ms: float = 0.0):
+    delay = LATENCY_MS + extra_ms + random.uniform(-JITTER_MS, JITTER_MS)
+    await asyncio.sleep(max(delay, 0) / 1000)
+
+    roll = random.random()
+    if roll < RATE_LIMIT_RATE:
+        stats["rate_limited"] += 1
+        return JSONResponse(
+            status_code=429,
+            content={"error": {"message": "Rate limit reached", "type": "requests", "code": "rate_limit_exceeded"}},
+            headers={
+                "retry-after": str(RETRY_AFTER_SEC),
+                "x-ratelimit-remaining-requests": "0",
+                "x-ratelimit-reset-requests": f"{RETRY_AFTER_SEC}s",
+            },
+        )
+    if roll < RATE_LIMIT_RATE + ERROR_RATE:
+        stats["errors"] += 1
+        return JSONResponse(
+            status_code=500,
+            content={"error": {"message": "Simulated server error", "type": "server_error"}},
+        )
+    return None
+
+@app.post("/v1/audio/transcriptions")
+async def transcriptions(request: Request):
+    form = await request.form()
+    upload = form.get("file")
+    data = await upload.read() if upload is not None else b""
+    headers, reset = _window("transcriptions")
+    if reset is not None:
+        return _limited(headers, reset)
+
+    failure = await _simulate(LATENCY_MS_PER_MB * len(data) / (1024 * 1024))
+    if failure is not None:
+        return failure
+
+    stats["transcriptions"] += 1
+    # roughly one line per 10s of 8 kHz 16-bit mono audio
+    n_lines = max(1, len(data) // 160_000)
+    text = " ".join(SAMPLE_LINES[i % len(SAMPLE_LINES)] for i in range(n_lines))
+
+    if form.get("response_format", "json") == "text":
+        return PlainTextResponse(text, headers=headers)
+    return JSONResponse({"text": text}, headers=headers)
+
+def _completion(body):
+    prompt_chars = sum(len(m.get("content") or "") for m in body.get("messages", []))
+    answer = "TRUE" if random.random() < TRUE_RATE else "FALSE"
+    return {
+        "id": f"chatcmpl-fake-{uuid.uuid4().hex[:12]}",
+        "object": "chat.completion",
+        "created": int(time.time()),
+        "model": body.get("model", "gpt-4o-mini"),
+        "choices": [{
+            "index": 0,
+            "message": {"role": "assistant", "content": answer},
+            "finish_reason": "stop",
+        }],
+        "usage": {
+            "prompt_tokens": prompt_chars // 4,
+            "completion_tokens": 1,
+            "total_tokens": prompt_chars // 4 + 1,
+        },
+    }
+
+@app.post("/v1/chat/completions")
+async def chat_completions(request: Request):
+    body = await request.json()
+    headers, reset = _window("chat")
+    if reset is not None:
+        return _limited(headers, reset)
+
+    failure = await _simulate()
+    if failure is not None:
+        return failure
+
+    stats["chat_completions"] += 1
+    return JSONResponse(_completion(body), headers=headers)
+
+def _file_object(file_id):
+    f = files[file_id]
+    return {"id": file_id, "object": "file", "bytes": len(f["data"]), "created_at": f["created_at"],
+            "filename": f["filename"], "purpose": f["purpose"]}
+
+@app.post("/v1/files")
+async def create_file(request: Request):
+    form = await request.form()
+    upload = form.get("file")
+    file_id = f"file-fake-{uuid.uuid4().hex[:12]}"
+    files[file_id] = {
+        "data": await upload.read(), "filename": upload.filename,
+        "purpose": form.get("purpose", "batch"), "created_at": int(time.time()),
+    }
+    return _file_object(file_id)
+
+@app.get("/v1/files/{file_id}/content")
+async def file_content(file_id: str):
+    if file_id not in files:
+        raise HTTPException(status_code=404, detail="No such file")
+    return PlainTextResponse(files[file_id]["data"].decode("utf-8"))
+
+def _batch_object(batch_id):
+    b = batches[batch_id]
+    return {
+        "id": batch_id, "object": "batch", "endpoint": b["endpoint"], "input_file_id": b["input_file_id"],
+        "completion_window": "24h", "status": b["status"], "created_at": b["created_at"],
+        "output_file_id": b.get("output_file_id"), "error_file_id": None, "metadata": b.get("metadata"),
+        "request_counts": b["request_counts"],
+    }
+
+async def _run_batch(batch_id):
+    b = batches[batch_id]
+    await asyncio.sleep(BATCH_DELAY_SEC)
+    lines = files[b["input_file_id"]]["data"].decode("utf-8").splitlines()
+    out = []
+    for line in lines:
+        if not line.strip():
+            continue
+        req = json.loads(line)
+        stats["batch_requests"] += 1
+        if random.random() < ERROR_RATE:
+            out.append({"id": f"batch_req_{uuid.uuid4().hex[:8]}", "custom_id": req["custom_id"], "response": None,
+                        "error": {"code": "server_error", "message": "Simulated error"}})
+            b["request_counts"]["failed"] += 1
+            continue
+        out.append({"id": f"batch_req_{uuid.uuid4().hex[:8]}", "custom_id": req["custom_id"],
+                    "response": {"status_code": 200, "request_id": uuid.uuid4().hex, "body": _completion(req["body"])},
+                    "error": None})
+        b["request_counts"]["completed"] += 1
+    output_id = f"file-fake-{uuid.uuid4().hex[:12]}"
+    files[output_id] = {"data": ("\n".join(json.dumps(o) for o in out) + "\n").encode("utf-8"),
+                        "filename": f"{batch_id}_output.jsonl", "purpose": "batch_output", "created_at": int(time.time())}
+    b["output_file_id"] = output_id
+    b["status"] = "completed"
+
+@app.post("/v1/batches")
+async def create_batch(request: Request):
+    body = await request.json()
+    if body.get("input_file_id") not in files:
+        raise HTTPException(status_code=400, detail="Unknown input_file_id")
+    batch_id = f"batch_fake_{uuid.uuid4().hex[:12]}"
+    total = sum(1 for line in files[body["input_file_id"]]["data"].splitlines() if line.strip())
+    batches[batch_id] = {
+        "endpoint": body.get("endpoint"), "input_file_id": body["input_file_id"], "status": "in_progress",
+        "created_at": int(time.time()), "metadata": body.get("metadata"),
+        "request_counts": {"total": total, "completed": 0, "failed": 0},
+    }
+    asyncio.create_task(_run_batch(batch_id))
+    return _batch_object(batch_id)
+
+@app.get("/v1/batches")
+async def list_batches(limit: int = 20):
+    data = [_batch_object(batch_id) for batch_id in reversed(list(batches))][:limit]
+    return {"object": "list", "data": data, "has_more": False,
+            "first_id": data[0]["id"] if data else None, "last_id": data[-1]["id"] if data else None}
+
+@app.get("/v1/batches/{batch_id}")
+async def get_batch(batch_id: str):
+    if batch_id not in batches:
+        raise HTTPException(status_code=404, detail="No such batch")
+    return _batch_object(batch_id)
+
+@app.get("/stats")
+async def get_stats():
+    return stats
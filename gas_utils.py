@@ -0,0 +1,176 @@
+import asyncio, os, random, time, uuid
+from metrics_utils import GAS_SECONDS, GAS_DELIVERIES, GAS_ATTEMPTS
+from db_utils import run_query, query_all
+from log_utils import get_logger, fields
+
+# Delivery of practice reports to the Google Apps Script web app (gas.js). One pooled
+# AsyncClient for the process. gas.js creates a spreadsheet per POST, so a delivery is only
+# retried (with exponential backoff) when the script cannot have run: the request never left
+# (connect errors and timeouts, no pooled connection) or Google turned it away (429, 503).
+# A read timeout or a 500/502/504 may come after the spreadsheet was made and is not retried.
+# Apps Script answers 200 with doc_url=null when the script itself failed, also not retried.
+GAS_URL = os.getenv("GAS_URL")
+GAS_TIMEOUT_SEC = float(os.getenv("GAS_TIMEOUT_SEC", 90))
+GAS_CONNECT_TIMEOUT_SEC = float(os.getenv("GAS_CONNECT_TIMEOUT_SEC", 5))
+GAS_RETRIES = int(os.getenv("GAS_RETRIES", 3))
+GAS_BACKOFF_SEC = float(os.getenv("GAS_BACKOFF_SEC", 1))
+GAS_MAX_CONNECTIONS = int(os.getenv("GAS_MAX_CONNECTIONS", 4))
+# Fire-and-poll state is in the gas_deliveries table, so a poll can reach any machine, also
+# after the one running the delivery restarted. Finished rows are kept GAS_DELIVERY_TTL_SEC;
+# a delivery still unfinished after GAS_DELIVERY_STALE_SEC died with its machine.
+GAS_DELIVERY_TTL_SEC = float(os.getenv("GAS_DELIVERY_TTL_SEC", 3600))
+GAS_DELIVERY_STALE_SEC = float(os.getenv("GAS_DELIVERY_STALE_SEC", 900))
+
+RETRY_STATUS = {429, 503}
+
+logger = get_logger(__name__)
+
+class GasError(Exception):
+    pass
+
+class GasResponseError(GasError):
+    pass
+
+_client = None
+_tasks = {}  # delivery id -> asyncio task, for deliveries running in this process
+
+def get_client():
+    import httpx
+    global _client
+    if _client is None or _client.is_closed:
+        _client = httpx.AsyncClient(
+            timeout=httpx.Timeout(GAS_TIMEOUT_SEC, connect=GAS_CONNECT_TIMEOUT_SEC),
+            limits=httpx.Limits(max_connections=GAS_MAX_CONNECTIONS, max_keepalive_connections=GAS_MAX_CONNECTIONS),
+            # Apps Script answers the POST with a redirect to script.googleusercontent.com
+            follow_redirects=True,
+        )
+    return _client
+
+async def close_client():
+    global _client
+    if _client is not None:
+        await _client.aclose()
+        _client = None
+
+def _backoff(attempt, response=None):
+    retry_after = response.headers.get("retry-after") if response is not None else None
+    if retry_after:
+        try:
+            return float(retry_after)
+        except ValueError:
+            pass
+    return GAS_BACKOFF_SEC * 2 ** attempt * random.uniform(0.5, 1.5)
+
+async def deliver(report, filename):
+    import httpx
+    if not GAS_URL:
+        raise GasError("GAS_URL is not set")
+
+    client = get_client()
+    start = time.perf_counter()
+    for attempt in range(GAS_RETRIES + 1):
+        response = None
+        try:
+            response = await client.post(GAS_URL, json={"report": report, "filename": filename})
+        except (httpx.ConnectError, httpx.ConnectTimeout, httpx.PoolTimeout) as e:
+            GAS_ATTEMPTS.labels("transport_error").inc()
+            error = e
+        except httpx.TransportError as e:
+            GAS_ATTEMPTS.labels("transport_error").inc()
+            GAS_DELIVERIES.labels("error").inc()
+            raise GasError(f"Error communicating with Google Apps Script: {e!r}")
+        else:
+            if response.status_code not in RETRY_STATUS:
+                GAS_ATTEMPTS.labels(str(response.status_code)).inc()
+                break
+            GAS_ATTEMPTS.labels(str(response.status_code)).inc()
+            error = GasError(f"HTTP {response.status_code}")
+
+        if attempt == GAS_RETRIES:
+            GAS_DELIVERIES.labels("error").inc()
+            raise GasError(f"Error communicating with Google Apps Script: {error!r}")
+        delay = _backoff(attempt, response)
+        logger.warning("gas retry", extra=fields("gas", filename=filename, attempt=attempt + 1, delay=round(delay, 2), error=repr(error)))
+        await asyncio.sleep(delay)
+
+    try:
+        response.raise_for_status()
+        body = response.json()
+    except (httpx.HTTPStatusError, ValueError) as e:
+        GAS_DELIVERIES.labels("error").inc()
+        raise GasResponseError(f"Invalid response from Google Apps Script: {e}")
+    if not body.get("doc_url"):
+        GAS_DELIVERIES.labels("error").inc()
+        raise GasResponseError(f"Google Apps Script response did not contain 'doc_url': {body.get('error', '')}")
+
+    GAS_SECONDS.observe(time.perf_counter() - start)
+    GAS_DELIVERIES.labels("ok").inc()
+    logger.info("gas delivered", extra=fields("gas", filename=filename, attempts=attempt + 1, seconds=round(time.perf_counter() - start, 3)))
+    return body["doc_url"]
+
+def _insert_delivery(delivery_id, filename):
+    run_query(
+        "DELETE FROM gas_deliveries WHERE finished_at < now() - make_interval(secs => %s)",
+        (GAS_DELIVERY_TTL_SEC,),
+        name="gas_delivery_prune",
+    )
+    run_query(
+        "INSERT INTO gas_deliveries (id, filename, status) VALUES (%s, %s, 'pending')",
+        (delivery_id, filename),
+        name="gas_delivery_insert",
+    )
+
+def _update_delivery(delivery_id, status, doc_url=None, error=None):
+    run_query(
+        f"""
+        UPDATE gas_deliveries SET status = %s, doc_url = %s, error = %s
+        {", finished_at = now()" if status in ("done", "failed") else ""}
+        WHERE id = %s
+        """,
+        (status, doc_url, error, delivery_id),
+        name="gas_delivery_update",
+    )
+
+def _select_delivery(delivery_id):
+    rows = query_all(
+        """
+        SELECT id, filename, status, doc_url, error,
+               extract(epoch FROM created_at)::float AS created_at,
+               extract(epoch FROM finished_at)::float AS finished_at,
+               finished_at IS NULL AND created_at < now() - make_interval(secs => %s) AS stale
+        FROM gas_deliveries WHERE id = %s
+        """,
+        (GAS_DELIVERY_STALE_SEC, delivery_id),
+        name="gas_delivery_select",
+    )
+    return rows[0] if rows else None
+
+async def _run_delivery(delivery_id, build_report, filename):
+    try:
+        report = await build_report()
+        await asyncio.to_thread(_update_delivery, delivery_id, "delivering")
+        doc_url = await deliver(report, filename)
+    except Exception as e:
+        logger.error("gas delivery failed", extra=fields("gas", delivery_id=delivery_id, filename=filename, error=repr(e)))
+        await asyncio.to_thread(_update_delivery, delivery_id, "failed", error=str(e))
+    else:
+        await asyncio.to_thread(_update_delivery, delivery_id, "done", doc_url=doc_url)
+    finally:
+        _tasks.pop(delivery_id, None)
+
+async def start_delivery(build_report, filename):
+    # fire-and-poll: build_report is an async callable producing the report rows; the
+    # returned id is polled through get_delivery until status is done or failed
+    delivery_id = uuid.uuid4().hex
+    await asyncio.to_thread(_insert_delivery, delivery_id, filename)
+    _tasks[delivery_id] = asyncio.create_task(_run_delivery(delivery_id, build_report, filename))
+    return delivery_id
+
+async def get_delivery(delivery_id):
+    state = await asyncio.to_thread(_select_delivery, delivery_id)
+    if state is None:
+        return None
+    if state.pop("stale"):
+        # the machine running it stopped mid-delivery; the spreadsheet may or may not exist
+        state.update(status="failed", error="delivery did not finish (app restarted); check Drive before retrying")
+    return state
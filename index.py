@@ -1,17 +1,61 @@
-from fastapi import FastAPI, UploadFile, Form, File, HTTPException, Response
-from fastapi.responses import HTMLResponse, StreamingResponse
-import re, os, json, requests
-from datetime import datetime
-import pandas as pd
+from fastapi import FastAPI, UploadFile, Form, File, HTTPException, Response, Request
+from fastapi.responses import HTMLResponse, StreamingResponse, FileResponse, JSONResponse
+import asyncio, re, os, json, shutil, time
+from datetime import datetime, date
+from pathlib import Path
+from typing import List
 from io import BytesIO
 from db_utils import insert_raw_report_df
-from zip_utils import save_zip, get_wav_names_zip, get_existing_calls, extract_selected_wavs, schedule_transcription_job
-from report_utils import get_raw_on_date, build_practice_report, check_report_complete
-
-GAS_URL = os.getenv("GAS_URL")
+from zip_utils import (
+    save_zip, save_wavs, get_wav_names_zip, get_existing_calls, get_missing_calls, extract_selected_wavs, schedule_transcription_job,
+    boost_date, queue_status,
+)
+from report_utils import get_raw_on_date, build_practice_report, check_report_complete, get_completeness, COMPLETENESS_MAX_DAYS
+from metrics_utils import PIPELINE_STAGE_SECONDS, render_metrics
+from profile_utils import profile_session, mark_stage, routes_enabled, jobs_enabled, list_profiles, profile_path
+from log_utils import get_logger, fields, log_payload
+from gas_utils import GasError, deliver, start_delivery, get_delivery, close_client
+from upload_utils import UploadError, UploadElsewhere, create_session, get_status, write_chunk, finalize
+from schema_utils import apply_schema, RAW_REPORT
+from replay_utils import recorder
+
+logger = get_logger(__name__)
+
+PROFILED_ROUTES = {"/upload_csv", "/report_by_date", "/report_by_date_gas"}
+MANIFEST_MAX_FILES = int(os.getenv("MANIFEST_MAX_FILES", 20000))
 
 app = FastAPI()
 
+# pandas, numpy, openai and openpyxl are imported where they are used, so a machine scaled
+# from zero answers /healthz before they load; they are warmed in a thread after startup
+WARM_IMPORTS = os.getenv("WARM_IMPORTS", "1").strip().lower() not in ("0", "false", "no", "off")
+
+def _warm_imports():
+    import pandas, openpyxl, ai_utils, audio_utils, join_utils, transcript_utils, report_utils  # noqa: F401
+
+@app.on_event("startup")
+async def warm_imports():
+    if WARM_IMPORTS:
+        asyncio.get_running_loop().run_in_executor(None, _warm_imports)
+
+@app.on_event("shutdown")
+async def close_gas_client():
+    await close_client()
+
+@app.get("/healthz")
+async def healthz():
+    # liveness for the Fly check: no pandas, no DB
+    return {"status": "ok"}
+
+@app.middleware("http")
+async def profile_routes(request: Request, call_next):
+    if request.url.path not in PROFILED_ROUTES or not routes_enabled(request):
+        return await call_next(request)
+    with profile_session(request.url.path.strip("/")) as session:
+        response = await call_next(request)
+    response.headers["X-Profile-Id"] = session.id
+    return response
+
 @app.get("/", response_class=HTMLResponse)
 async def upload_form():
     return """
@@ -25,9 +69,9 @@ async def upload_form():
     </form>
     <hr>
 
-    <h3>2. Upload audio ZIP</h3>
+    <h3>2. Upload audio (ZIP or WAV files)</h3>
     <form id="zipForm">
-      <input type="file" name="zip_file" accept=".zip" required>
+      <input type="file" name="zip_file" accept=".zip,.wav" multiple required>
       <button type="submit">Process audio</button>
     </form>
     <pre id="zipOut" style="white-space:pre-wrap;"></pre>
@@ -63,27 +107,177 @@ async def upload_form():
       document.getElementById('csvForm')
         .addEventListener('submit', (e) => { e.preventDefault(); postAndDownload(e.target, '/upload_csv'); });
 
+      // Only recordings the server does not have yet are sent: the ZIP's central directory is
+      // read in the browser, /upload_manifest answers which names are missing, and those entries
+      // are extracted and posted to /upload_wavs in batches. ZIPs that cannot be read here
+      // (zip64, unsupported compression) are sent whole with the resumable upload below.
+      const UPLOAD_BATCH = 20;
+
+      async function zipEntries(file) {
+        const tailLen = Math.min(file.size, 65557);
+        const tail = new DataView(await file.slice(file.size - tailLen).arrayBuffer());
+        let eocd = -1;
+        for (let i = tailLen - 22; i >= 0; i--) {
+          if (tail.getUint32(i, true) === 0x06054b50) { eocd = i; break; }
+        }
+        if (eocd < 0) return null;
+        const count = tail.getUint16(eocd + 10, true);
+        const cdSize = tail.getUint32(eocd + 12, true);
+        const cdOffset = tail.getUint32(eocd + 16, true);
+        if (count === 0xffff || cdOffset === 0xffffffff) return null;
+
+        const cd = new DataView(await file.slice(cdOffset, cdOffset + cdSize).arrayBuffer());
+        const decoder = new TextDecoder();
+        const entries = [];
+        let p = 0;
+        for (let n = 0; n < count; n++) {
+          if (cd.getUint32(p, true) !== 0x02014b50) return null;
+          const method = cd.getUint16(p + 10, true);
+          const csize = cd.getUint32(p + 20, true);
+          const size = cd.getUint32(p + 24, true);
+          const nameLen = cd.getUint16(p + 28, true);
+          const skip = nameLen + cd.getUint16(p + 30, true) + cd.getUint16(p + 32, true);
+          const offset = cd.getUint32(p + 42, true);
+          const path = decoder.decode(new Uint8Array(cd.buffer, cd.byteOffset + p + 46, nameLen));
+          const name = path.split('/').pop();
+          if (name.toLowerCase().endsWith('.wav')) {
+            if (method !== 0 && method !== 8) return null;
+            entries.push({ name, size, csize, method, offset });
+          }
+          p += 46 + skip;
+        }
+        return entries;
+      }
+
+      async function readEntry(file, e) {
+        const head = new DataView(await file.slice(e.offset, e.offset + 30).arrayBuffer());
+        const start = e.offset + 30 + head.getUint16(26, true) + head.getUint16(28, true);
+        const data = file.slice(start, start + e.csize);
+        if (e.method === 0) return new File([data], e.name);
+        const stream = data.stream().pipeThrough(new DecompressionStream('deflate-raw'));
+        return new File([await new Response(stream).blob()], e.name);
+      }
+
+      // Resumable upload (/uploads): fixed-size chunks sent by CHUNK_PARALLEL workers, each retried
+      // on network errors and 5xx. The session id is remembered per file, so submitting the same
+      // file again after a dropped connection or a reload only sends the missing chunks.
+      const CHUNK_PARALLEL = 4;
+
+      async function sha256Hex(buf) {
+        const digest = await crypto.subtle.digest('SHA-256', buf);
+        return [...new Uint8Array(digest)].map(b => b.toString(16).padStart(2, '0')).join('');
+      }
+
+      // a session lives on the machine that created it (its id ends in that machine's id)
+      function pinned(id, headers = {}) {
+        const machine = id.split('-')[1];
+        return machine ? { ...headers, 'fly-force-instance-id': machine } : headers;
+      }
+
+      async function resumableUpload(file, kind, onProgress) {
+        const key = `upload:${kind}:${file.name}:${file.size}:${file.lastModified}`;
+        let session = null;
+        const saved = localStorage.getItem(key);
+        if (saved) {
+          const res = await fetch(`/uploads/${saved}`, { headers: pinned(saved) });
+          if (res.ok) session = await res.json();
+        }
+        if (!session || session.state !== 'open') {
+          const res = await fetch('/uploads', {
+            method: 'POST',
+            headers: { 'Content-Type': 'application/json' },
+            body: JSON.stringify({ kind, filename: file.name, size: file.size }),
+          });
+          if (!res.ok) throw new Error(await res.text().catch(() => res.statusText));
+          session = await res.json();
+          localStorage.setItem(key, session.id);
+        }
+
+        const queue = [...session.missing_offsets];
+        let done = session.received_bytes;
+        async function worker() {
+          while (queue.length) {
+            const offset = queue.shift();
+            const buf = await file.slice(offset, offset + session.chunk_size).arrayBuffer();
+            const headers = crypto.subtle ? { 'X-Chunk-Sha256': await sha256Hex(buf) } : {};
+            for (let attempt = 0; ; attempt++) {
+              let res = null;
+              try {
+                res = await fetch(`/uploads/${session.id}?offset=${offset}`, { method: 'PUT', body: buf, headers: pinned(session.id, headers) });
+              } catch (err) {
+                if (attempt >= 4) throw err;
+              }
+              if (res && res.ok) break;
+              if (res && res.status < 500) throw new Error(await res.text().catch(() => res.statusText));
+              if (attempt >= 4) throw new Error(`chunk at ${offset} failed`);
+              await new Promise(r => setTimeout(r, 1000 * 2 ** attempt));
+            }
+            done += buf.byteLength;
+            onProgress(done, file.size);
+          }
+        }
+        await Promise.all(Array.from({ length: CHUNK_PARALLEL }, worker));
+
+        const res = await fetch(`/uploads/${session.id}/finalize`, { method: 'POST', headers: pinned(session.id) });
+        if (!res.ok) throw new Error(await res.text().catch(() => res.statusText));
+        localStorage.removeItem(key);
+        return res;
+      }
+
+      async function uploadWholeZip(file, out) {
+        const res = await resumableUpload(file, 'zip', (done, total) => {
+          out.textContent = `Uploading ${file.name}: ${Math.round(100 * done / total)}%`;
+        });
+        return (await res.json()).to_process_count || 0;
+      }
+
       document.getElementById('zipForm')
         .addEventListener('submit', async (e) => {
           e.preventDefault();
           const out = document.getElementById('zipOut');
-          out.textContent = 'Processing…';
+          out.textContent = 'Checking…';
+          let queued = 0;
 
-          const data = new FormData(e.target);
-          const res = await fetch('/upload_zip', { method: 'POST', body: data });
-
-          if (!res.ok) {
-            out.textContent = await res.text().catch(() => res.statusText);
-            return;
-          }
+          try {
+            const entries = new Map();
+            for (const f of e.target.zip_file.files) {
+              if (f.name.toLowerCase().endsWith('.wav')) {
+                if (!entries.has(f.name)) entries.set(f.name, { size: f.size, read: async () => f });
+                continue;
+              }
+              const listed = typeof DecompressionStream === 'undefined' ? null : await zipEntries(f).catch(() => null);
+              if (!listed) {
+                queued += await uploadWholeZip(f, out);
+                continue;
+              }
+              for (const z of listed) {
+                if (!entries.has(z.name)) entries.set(z.name, { size: z.size, read: () => readEntry(f, z) });
+              }
+            }
 
-          const ct = res.headers.get('Content-Type') || '';
-          if (ct.includes('application/json')) {
-            const payload = await res.json();
-            const { to_process_count = 0 } = payload || {};
-            out.textContent = `Files to process: ${to_process_count}`;
-          } else {
-            await postAndDownload(e.target, '/upload_zip');
+            if (entries.size) {
+              const res = await fetch('/upload_manifest', {
+                method: 'POST',
+                headers: { 'Content-Type': 'application/json' },
+                body: JSON.stringify({ files: [...entries].map(([name, x]) => ({ name, size: x.size })) }),
+              });
+              if (!res.ok) throw new Error(await res.text().catch(() => res.statusText));
+              const { missing } = await res.json();
+
+              for (let i = 0; i < missing.length; i += UPLOAD_BATCH) {
+                out.textContent = `${entries.size} recordings, ${missing.length} new. Uploading ${i + 1}-${Math.min(i + UPLOAD_BATCH, missing.length)}…`;
+                const data = new FormData();
+                for (const name of missing.slice(i, i + UPLOAD_BATCH)) {
+                  data.append('wav_files', await entries.get(name).read(), name);
+                }
+                const up = await fetch('/upload_wavs', { method: 'POST', body: data });
+                if (!up.ok) throw new Error(await up.text().catch(() => up.statusText));
+                queued += (await up.json()).to_process_count || 0;
+              }
+            }
+            out.textContent = `Files to process: ${queued}`;
+          } catch (err) {
+            out.textContent = `Error: ${err.message}. Files queued so far: ${queued}`;
           }
         });
 
@@ -179,6 +373,7 @@ async def upload_form():
     """
 
 def extract_mmss_from_filename(name: str):
+    import pandas as pd
     if not isinstance(name, str):
         return pd.NA, pd.NA, pd.NA
     m = re.search(r"_(\d{14})", name)
@@ -200,17 +395,25 @@ async def handle_upload(
     if not csv_files:
         raise HTTPException(status_code=400, detail="At least one CSV is required")
 
-    print("Start processing report")
-
-    dfs = []
+    files = []
     for f in csv_files:
-        data = await f.read()
+        files.append((f.filename, await f.read()))
         await f.close()
+    return process_csv(files)
+
+def process_csv(files: list[tuple[str, bytes]]):
+    import pandas as pd
+    logger.info("processing report", extra=fields("csv", files=len(files)))
+    recorder.save_csv(files)
+
+    t0 = time.perf_counter()
+    dfs = []
+    for filename, data in files:
         try:
             df = pd.read_csv(BytesIO(data), low_memory=False)
             dfs.append(df)
         except Exception as e:
-            raise HTTPException(status_code=400, detail=f"{f.filename}: {e}")
+            raise HTTPException(status_code=400, detail=f"{filename}: {e}")
 
     combined = pd.concat(dfs, ignore_index=True).drop_duplicates()
 
@@ -227,6 +430,8 @@ async def handle_upload(
 
     combined["_ts"] = pd.to_datetime(combined["Call Time"], errors="coerce")
     combined = combined.sort_values(["Call ID", "_ts"], kind="mergesort")  # stable order
+    PIPELINE_STAGE_SECONDS.labels("csv_parse").observe(time.perf_counter() - t0)
+    mark_stage("csv_parse")
 
     def join_series(s: pd.Series) -> str:
         vals = [str(x) for x in s.dropna().astype(str)]
@@ -254,7 +459,7 @@ async def handle_upload(
         if match:
             number = match.group(1)
             return number[-7:]
-        return 0
+        return "0"
     
     def extract_is_voicemail(val: str) -> bool:
       if isinstance(val, str) and "voicemail" in val.lower():
@@ -276,6 +481,7 @@ async def handle_upload(
         "Call Activity Details": join_series
     }
 
+    t0 = time.perf_counter()
     per_call_df = combined.groupby("Call ID", as_index=False).agg(agg)
     per_call_df["Duration"] = combined.groupby("Call ID").apply(extract_duration).reset_index(drop=True)
     per_call_df["Phone Key"] = per_call_df.apply(extract_phone_key, axis=1)
@@ -284,13 +490,18 @@ async def handle_upload(
         per_call_df["Is Voicemail"] | (per_call_df["Duration"] < 10)
     )
     per_call_df["Is Redirected"] = per_call_df["Status"].apply(extract_is_redirected)
+    PIPELINE_STAGE_SECONDS.labels("csv_aggregate").observe(time.perf_counter() - t0)
+    mark_stage("csv_aggregate")
 
     # find recalls
+    t0 = time.perf_counter()
     per_call_df["Is Recalled"] = False
     per_call_df["Recall Id"] = None
 
     # make sure Call Time is datetime
     per_call_df["Call Time"] = pd.to_datetime(per_call_df["Call Time"], errors="coerce")
+    # string / categorical / boolean columns keep the masks below off Python objects
+    apply_schema(per_call_df, RAW_REPORT)
 
     for idx, row in per_call_df.iterrows():
         if (row["Is Voicemail"] or row.get("Is Dropped", False)):
@@ -317,12 +528,16 @@ async def handle_upload(
 
                 
         per_call_df = per_call_df.drop(columns=["_ts"], errors="ignore")
+    PIPELINE_STAGE_SECONDS.labels("recall").observe(time.perf_counter() - t0)
+    mark_stage("recall")
 
     # serialize to CSV
     report_df = pd.DataFrame(per_call_df)
-    print(report_df)
+    logger.info("report processed", extra=fields("csv", calls=len(report_df)))
+    log_payload(logger, "csv", "report_df", lambda: report_df.head(20).to_string())
 
     insert_raw_report_df(report_df)
+    mark_stage("insert_raw_report")
     
     csv_bytes = report_df.to_csv(index=False).encode("utf-8")
     fname = f'report_{datetime.utcnow().strftime("%Y%m%d-%H%M%S")}.csv'
@@ -333,15 +548,24 @@ async def handle_upload(
         headers={"Content-Disposition": f'attachment; filename="{fname}"'}
     )
 
-@app.post("/upload_zip")
-async def upload_zip(zip_file: UploadFile = File(...)):
-    if not zip_file.filename.lower().endswith(".zip"):
-        raise HTTPException(status_code=400, detail="ZIP must be .zip")
+@app.get("/metrics")
+async def metrics():
+    content, content_type = render_metrics()
+    return Response(content=content, media_type=content_type)
 
-    zip_path = await save_zip(zip_file)
-    if not zip_path:
-        return {"to_process_count": 0}
-    
+@app.get("/profiles")
+async def get_profiles():
+    return {"profiles": list_profiles()}
+
+@app.get("/profiles/{name}")
+async def download_profile(name: str):
+    path = profile_path(name)
+    if path is None:
+        raise HTTPException(status_code=404, detail="Profile not found")
+    return FileResponse(path, filename=name)
+
+def process_zip(zip_path: str, profile: bool = False):
+    # takes ownership of zip_path: it is removed here or by the transcription job
     try:
         wav_names = get_wav_names_zip(zip_path)
         if not wav_names:
@@ -349,8 +573,7 @@ async def upload_zip(zip_file: UploadFile = File(...)):
             except Exception: pass
             return {"to_process_count": 0}
 
-        existing = get_existing_calls(wav_names)
-        to_process = [n for n in wav_names if n not in existing]
+        to_process = get_missing_calls(wav_names)
 
         if not to_process:
             try: os.remove(zip_path)
@@ -359,7 +582,7 @@ async def upload_zip(zip_file: UploadFile = File(...)):
         
         tmpdir, name_to_path = extract_selected_wavs(zip_path, to_process)
 
-        schedule_transcription_job(name_to_path, to_process, zip_path, tmpdir)
+        schedule_transcription_job(name_to_path, to_process, zip_path, tmpdir, profile=profile)
 
         return {"to_process_count": len(to_process)}
     
@@ -368,13 +591,128 @@ async def upload_zip(zip_file: UploadFile = File(...)):
         except Exception: pass
         return {"to_process_count": 0}
 
+@app.post("/upload_zip")
+async def upload_zip(request: Request, zip_file: UploadFile = File(...)):
+    if not zip_file.filename.lower().endswith(".zip"):
+        raise HTTPException(status_code=400, detail="ZIP must be .zip")
+
+    zip_path = await save_zip(zip_file)
+    if not zip_path:
+        return {"to_process_count": 0}
+    return process_zip(zip_path, profile=routes_enabled(request) or jobs_enabled())
+
+def _upload_error(e: UploadError):
+    # a session on another Fly machine: the proxy replays the request there
+    headers = {"fly-replay": f"instance={e.machine}"} if isinstance(e, UploadElsewhere) else None
+    return HTTPException(status_code=e.status_code, detail=str(e), headers=headers)
+
+@app.post("/uploads")
+async def create_upload(request: Request):
+    try:
+        body = await request.json()
+        return create_session(body.get("kind"), body.get("filename"), body.get("size"), body.get("sha256"), body.get("chunk_size"))
+    except UploadError as e:
+        raise _upload_error(e)
+    except (ValueError, AttributeError):
+        raise HTTPException(status_code=400, detail='expected {"kind", "filename", "size", "sha256"?, "chunk_size"?}')
+
+@app.get("/uploads/{upload_id}")
+async def upload_status(upload_id: str):
+    try:
+        return get_status(upload_id)
+    except UploadError as e:
+        raise _upload_error(e)
+
+@app.put("/uploads/{upload_id}")
+async def upload_chunk(upload_id: str, offset: int, request: Request):
+    data = await request.body()
+    try:
+        return await write_chunk(upload_id, offset, data, request.headers.get("x-chunk-sha256"))
+    except UploadError as e:
+        raise _upload_error(e)
+
+@app.post("/uploads/{upload_id}/finalize")
+async def finalize_upload(upload_id: str, request: Request):
+    try:
+        path, meta = await finalize(upload_id)
+    except UploadError as e:
+        raise _upload_error(e)
+
+    if meta["kind"] == "zip":
+        return {**process_zip(path, profile=routes_enabled(request) or jobs_enabled()), "sha256": meta["sha256"]}
+    try:
+        data = await asyncio.to_thread(Path(path).read_bytes)
+    finally:
+        os.remove(path)
+    return process_csv([(meta["filename"], data)])
+
+@app.post("/upload_manifest")
+async def upload_manifest(request: Request):
+    # {"files": ["a.wav", {"name": "b.wav", "size": 123}, ...]} -> the recordings the server still needs
+    try:
+        body = await request.json()
+        entries = [e if isinstance(e, dict) else {"name": e} for e in body["files"]]
+        names = [Path(str(e["name"])).name for e in entries]
+    except Exception:
+        raise HTTPException(status_code=400, detail='expected {"files": [name | {"name", "size"}]}')
+    if len(names) > MANIFEST_MAX_FILES:
+        raise HTTPException(status_code=400, detail=f"at most {MANIFEST_MAX_FILES} files per manifest")
+
+    sizes = {}
+    for name, e in zip(names, entries):
+        try:
+            sizes.setdefault(name, int(e.get("size") or 0))
+        except (TypeError, ValueError):
+            raise HTTPException(status_code=400, detail=f"size of {name} must be a number of bytes")
+
+    wav_names = [n for n in names if n.lower().endswith(".wav")]
+    existing = await asyncio.to_thread(get_existing_calls, wav_names)
+    missing = get_missing_calls(wav_names, existing)
+    return {
+        "files": len(set(wav_names)),
+        "missing": missing,
+        "missing_bytes": sum(sizes[n] for n in missing),
+    }
+
+@app.post("/upload_wavs")
+async def upload_wavs(request: Request, wav_files: List[UploadFile] = File(...)):
+    tmpdir, name_to_path = await save_wavs(wav_files)
+    existing = await asyncio.to_thread(get_existing_calls, list(name_to_path))
+    to_process = get_missing_calls(list(name_to_path), existing)
+    if not to_process:
+        shutil.rmtree(tmpdir, ignore_errors=True)
+        return {"to_process_count": 0}
+
+    schedule_transcription_job(name_to_path, to_process, None, tmpdir, profile=routes_enabled(request) or jobs_enabled())
+    return {"to_process_count": len(to_process)}
+
+@app.post("/transcription/boost")
+async def transcription_boost(report_date: str = Form(...)):
+    # move a date's queued files ahead of everything else, e.g. when a report is needed now
+    try:
+        d = date.fromisoformat(report_date)
+    except ValueError:
+        raise HTTPException(status_code=400, detail="report_date must be YYYY-MM-DD")
+    status = boost_date(d)
+    if status is None:
+        raise HTTPException(status_code=404, detail=f"no files queued for {d}")
+    return status
+
+@app.get("/transcription/queue")
+async def transcription_queue():
+    return queue_status()
+
 @app.post("/report_by_date")
-async def report_by_date(report_date: str = Form(...)):
+async def report_by_date(report_date: str = Form(...), include_transcripts: bool = Form(True)):
+    import pandas as pd
     # Convert date string to datetime.date
     dt = datetime.strptime(report_date, "%Y-%m-%d").date()
 
-    raw_df = get_raw_on_date(dt)
+    # include_transcripts=false leaves the transcript bodies out of the "raw data" sheet
+    raw_df = get_raw_on_date(dt, include_transcripts=include_transcripts)
+    mark_stage("get_raw_on_date")
     report_df = build_practice_report(raw_df)
+    mark_stage("build_practice_report")
     
     # Write to in-memory XLSX with two sheets
     output = BytesIO()
@@ -382,6 +720,7 @@ async def report_by_date(report_date: str = Form(...)):
         report_df.to_excel(writer, index=False, sheet_name="report")
         raw_df.to_excel(writer, index=False, sheet_name="raw data")
     output.seek(0)
+    mark_stage("write_xlsx")
 
     filename = f"calls-{dt}.xlsx"
 
@@ -391,32 +730,40 @@ async def report_by_date(report_date: str = Form(...)):
         headers={"Content-Disposition": f'attachment; filename="{filename}"'}
     )
 
-@app.post("/report_by_date_gas")
-async def report_by_date_gas(report_date: str = Form(...)):
-    dt = datetime.strptime(report_date, "%Y-%m-%d").date()
-
+def build_gas_report(dt):
     raw_df = get_raw_on_date(dt)
     report_df = build_practice_report(raw_df)
     report_df = report_df.fillna('')
-    json_data = report_df.to_dict(orient='records')
+    return report_df.to_dict(orient='records')
+
+@app.post("/report_by_date_gas")
+async def report_by_date_gas(report_date: str = Form(...), wait: bool = Form(True)):
+    dt = datetime.strptime(report_date, "%Y-%m-%d").date()
+    filename = f"calls-{dt}"
+
+    async def build():
+        json_data = await asyncio.to_thread(build_gas_report, dt)
+        log_payload(logger, "gas", "gas payload", lambda: json.dumps(json_data, default=str), report_date=str(dt))
+        return json_data
+
+    if not wait:
+        # fire-and-poll: GET /report_by_date_gas/{delivery_id} until status is done
+        delivery_id = await start_delivery(build, filename)
+        return JSONResponse(status_code=202, content={"delivery_id": delivery_id, "status": "pending"})
 
+    json_data = await build()
+    mark_stage("build_practice_report")
     try:
-        print(json_data)
-        response = requests.post(GAS_URL, json={"report": json_data, "filename": f"calls-{dt}"})
-        response.raise_for_status()
-        gas_response = response.json()
-        
-        if "doc_url" in gas_response:
-            report_document_url = gas_response["doc_url"]
-        else:
-            raise ValueError("Google Apps Script response did not contain 'doc_url'")
-            
-        return {"doc_url": report_document_url}
-        
-    except requests.exceptions.RequestException as e:
-        raise HTTPException(status_code=500, detail=f"Error communicating with Google Apps Script: {e}")
-    except ValueError as e:
-        raise HTTPException(status_code=500, detail=f"Invalid response from Google Apps Script: {e}")
+        return {"doc_url": await deliver(json_data, filename)}
+    except GasError as e:
+        raise HTTPException(status_code=500, detail=str(e))
+
+@app.get("/report_by_date_gas/{delivery_id}")
+async def report_by_date_gas_status(delivery_id: str):
+    state = await get_delivery(delivery_id)
+    if state is None:
+        raise HTTPException(status_code=404, detail="Unknown delivery id")
+    return state
 
 @app.post("/check_date")
 async def check_date_route(report_date: str = Form(...)):
@@ -429,4 +776,16 @@ async def check_date_route(report_date: str = Form(...)):
             "complete": count > 0
         }
     except Exception as e:
-        raise HTTPException(status_code=500, detail=str(e))
\ No newline at end of file
+        raise HTTPException(status_code=500, detail=str(e))
+
+@app.get("/completeness")
+async def completeness_route(start: str, end: str):
+    try:
+        start_d, end_d = date.fromisoformat(start), date.fromisoformat(end)
+    except ValueError:
+        raise HTTPException(status_code=400, detail="start and end must be YYYY-MM-DD")
+    if end_d < start_d or (end_d - start_d).days >= COMPLETENESS_MAX_DAYS:
+        raise HTTPException(status_code=400, detail=f"range must be 1..{COMPLETENESS_MAX_DAYS} days")
+
+    days = await asyncio.to_thread(get_completeness, start_d, end_d)
+    return {"start": start, "end": end, "days": days}
@@ -0,0 +1,200 @@
+import argparse, asyncio, csv, io, os, random, time, uuid, wave, zipfile
+from datetime import date, datetime, timedelta
+import httpx
+import numpy as np
+from db_utils import query_all
+
+# Load-test driver. Uploads synthetic call CSVs and WAV ZIPs concurrently against a
+# running app (pointed at fake_openai.py and a local Postgres) and reports throughput,
+# per-stage latency percentiles and event-loop lag.
+#
+#   uvicorn fake_openai:app --port 9000
+#   OPENAI_BASE_URL=http://localhost:9000/v1 POSTGRESQL_SSLMODE=disable ... uvicorn index:app --port 8080
+#   POSTGRESQL_SSLMODE=disable ... python loadtest.py --zips 4 --files-per-zip 50
+
+SITES = ["Cheadle", "Heald Green", "Middleton", "Heckmondwike", "Winsford"]
+SAMPLE_RATE = 8000
+
+def synth_wav(duration_sec: float) -> bytes:
+    # speech-like: gliding pitch, formant-weighted harmonics, syllable envelope,
+    # so the local silence/ringing pre-filter lets it through
+    n = int(duration_sec * SAMPLE_RATE)
+    t = np.arange(n) / SAMPLE_RATE
+    f0 = 120 + 40 * np.sin(2 * np.pi * 0.7 * t) + 20 * np.sin(2 * np.pi * 3.1 * t)
+    phase = 2 * np.pi * np.cumsum(f0) / SAMPLE_RATE
+    voice = np.zeros(n)
+    for k in range(2, 28):
+        fk = k * f0
+        weight = sum(np.exp(-((fk - formant) / 150) ** 2) for formant in (700, 1200, 2500)) * (fk < 3400)
+        voice += weight * np.sin(k * phase)
+    envelope = (0.5 * (1 + np.sin(2 * np.pi * 4 * t))) ** 2
+    signal = 0.1 * voice * envelope + 0.003 * np.random.randn(n)
+    pcm = (np.clip(signal, -1, 1) * 32767).astype("<i2")
+    buf = io.BytesIO()
+    with wave.open(buf, "wb") as wf:
+        wf.setnchannels(1)
+        wf.setsampwidth(2)
+        wf.setframerate(SAMPLE_RATE)
+        wf.writeframes(pcm.tobytes())
+    return buf.getvalue()
+
+def synth_calls(d: date, n: int, run_id: str):
+    calls = []
+    start = datetime.combine(d, datetime.min.time()) + timedelta(hours=9)
+    for i in range(n):
+        site = random.choice(SITES)
+        phone = "07" + "".join(random.choice("0123456789") for _ in range(9))
+        call_time = start + timedelta(seconds=random.randint(0, 8 * 3600))
+        calls.append({
+            "call_id": f"lt-{run_id}-{i}",
+            "site": site,
+            "phone": phone,
+            "call_time": call_time,
+            "direction": random.choice(["Inbound", "Outbound"]),
+            "duration": random.randint(5, 180),
+            "filename": f"{site.replace(' ', '')}-{phone}_{call_time.strftime('%Y%m%d%H%M%S')}.wav",
+        })
+    return calls
+
+def build_csv(calls) -> bytes:
+    buf = io.StringIO()
+    writer = csv.writer(buf)
+    writer.writerow(["Call Time", "Call ID", "From", "Cost", "Direction", "Status", "Call Activity Details", "Talking"])
+    for c in calls:
+        talking = f"{c['duration'] // 3600:02d}:{c['duration'] // 60 % 60:02d}:{c['duration'] % 60:02d}"
+        writer.writerow([
+            c["call_time"].strftime("%Y-%m-%d %H:%M:%S"), c["call_id"], c["phone"], "0.01",
+            c["direction"], "Answered", f"{c['site']} ({c['phone']})", talking,
+        ])
+    return buf.getvalue().encode("utf-8")
+
+def build_zip(calls) -> bytes:
+    buf = io.BytesIO()
+    with zipfile.ZipFile(buf, "w", zipfile.ZIP_DEFLATED) as zf:
+        for c in calls:
+            zf.writestr(c["filename"], synth_wav(c["duration"]))
+    return buf.getvalue()
+
+def percentiles(values):
+    if not values:
+        return "n/a"
+    p50, p95, p99 = np.percentile(values, [50, 95, 99])
+    return f"n={len(values):<5} p50={p50:8.3f}s p95={p95:8.3f}s p99={p99:8.3f}s max={max(values):8.3f}s"
+
+async def upload(client, url, field, name, payload, content_type, timings):
+    t0 = time.perf_counter()
+    res = await client.post(url, files={field: (name, payload, content_type)})
+    timings.append(time.perf_counter() - t0)
+    res.raise_for_status()
+    return res
+
+async def ping_loop(client, url, lags, stop: asyncio.Event, interval: float):
+    # request latency of a trivial route approximates the server's event-loop lag
+    while not stop.is_set():
+        t0 = time.perf_counter()
+        try:
+            await client.get(url)
+            lags.append(time.perf_counter() - t0)
+        except httpx.HTTPError:
+            lags.append(float("inf"))
+        try:
+            await asyncio.wait_for(stop.wait(), timeout=interval)
+        except asyncio.TimeoutError:
+            pass
+
+def seen_filenames(filenames, flagged: bool):
+    if flagged:
+        rows = query_all(
+            """
+            SELECT t.filename
+            FROM transcriptions AS t
+            JOIN metrics AS m USING (call_id)
+            WHERE t.filename = ANY(%s) AND m.is_proactive IS NOT NULL
+            """,
+            (list(filenames),),
+            name="loadtest_flagged",
+        )
+    else:
+        rows = query_all("SELECT filename FROM transcriptions WHERE filename = ANY(%s)", (list(filenames),), name="loadtest_seen")
+    return {r["filename"] for r in rows}
+
+async def run(args):
+    run_id = uuid.uuid4().hex[:8]
+    d = date.fromisoformat(args.date) if args.date else date.today()
+    total = args.zips * args.files_per_zip
+    calls = synth_calls(d, total, run_id)
+    filenames = [c["filename"] for c in calls]
+
+    print(f"run {run_id}: {total} calls on {d}, building payloads…")
+    csv_chunks = [calls[i::args.csvs] for i in range(args.csvs)]
+    zip_chunks = [calls[i * args.files_per_zip:(i + 1) * args.files_per_zip] for i in range(args.zips)]
+    csv_payloads = [build_csv(c) for c in csv_chunks]
+    zip_payloads = await asyncio.get_running_loop().run_in_executor(None, lambda: [build_zip(c) for c in zip_chunks])
+    print(f"zip bytes: {sum(len(z) for z in zip_payloads) / 1e6:.1f} MB")
+
+    timings = {"upload_csv": [], "upload_zip": [], "transcribed": [], "flagged": []}
+    lags = []
+    stop = asyncio.Event()
+    limits = httpx.Limits(max_connections=args.concurrency + 1)
+    async with httpx.AsyncClient(base_url=args.base_url, timeout=args.request_timeout, limits=limits) as client:
+        pinger = asyncio.create_task(ping_loop(client, args.ping_path, lags, stop, args.ping_interval))
+        sem = asyncio.Semaphore(args.concurrency)
+
+        async def limited(coro):
+            async with sem:
+                return await coro
+
+        await asyncio.gather(*[
+            limited(upload(client, "/upload_csv", "csv_files", f"calls-{i}.csv", p, "text/csv", timings["upload_csv"]))
+            for i, p in enumerate(csv_payloads)
+        ])
+        t_start = time.perf_counter()
+        await asyncio.gather(*[
+            limited(upload(client, "/upload_zip", "zip_file", f"audio-{i}.zip", p, "application/zip", timings["upload_zip"]))
+            for i, p in enumerate(zip_payloads)
+        ])
+
+        pending = {"transcribed": set(filenames), "flagged": set(filenames)}
+        deadline = t_start + args.timeout
+        while any(pending.values()) and time.perf_counter() < deadline:
+            await asyncio.sleep(args.poll_interval)
+            now = time.perf_counter() - t_start
+            for stage, flagged in (("transcribed", False), ("flagged", True)):
+                if not pending[stage]:
+                    continue
+                done = await asyncio.to_thread(seen_filenames, pending[stage], flagged)
+                timings[stage].extend([now] * len(done))
+                pending[stage] -= done
+            print(f"  t={now:6.1f}s transcribed={total - len(pending['transcribed'])}/{total} flagged={total - len(pending['flagged'])}/{total}")
+
+        elapsed = time.perf_counter() - t_start
+        stop.set()
+        await pinger
+
+    print()
+    transcribed = len(timings["transcribed"])
+    print(f"files/minute (transcribed): {transcribed / (elapsed / 60):.1f}")
+    for stage, values in timings.items():
+        print(f"{stage:<12} {percentiles(values)}")
+    finite_lags = [x for x in lags if x != float("inf")]
+    print(f"{'loop lag':<12} {percentiles(finite_lags)} failed_pings={len(lags) - len(finite_lags)}")
+    if pending["flagged"]:
+        print(f"timed out with {len(pending['flagged'])} files not flagged")
+
+def main():
+    parser = argparse.ArgumentParser(description="Concurrent upload load test")
+    parser.add_argument("--base-url", default=os.getenv("LOADTEST_BASE_URL", "http://localhost:8080"))
+    parser.add_argument("--date", help="call date YYYY-MM-DD (default: today)")
+    parser.add_argument("--zips", type=int, default=2)
+    parser.add_argument("--files-per-zip", type=int, default=20)
+    parser.add_argument("--csvs", type=int, default=1)
+    parser.add_argument("--concurrency", type=int, default=4)
+    parser.add_argument("--timeout", type=float, default=900, help="seconds to wait for the pipeline")
+    parser.add_argument("--request-timeout", type=float, default=600)
+    parser.add_argument("--poll-interval", type=float, default=2.0)
+    parser.add_argument("--ping-path", default="/")
+    parser.add_argument("--ping-interval", type=float, default=0.25)
+    asyncio.run(run(parser.parse_args()))
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,106 @@
+import atexit, copy, json, logging, os, queue, random, sys
+from datetime import datetime, timezone
+from logging.handlers import QueueHandler, QueueListener
+
+# Structured logging. Records are handed to a queue on the calling thread and
+# formatted/written by a background listener, so stdout I/O never blocks the event
+# loop or a worker thread. Large payloads (transcripts, DataFrames, GAS bodies) go
+# through log_payload, which samples per stage and truncates.
+LOG_LEVEL = os.getenv("LOG_LEVEL", "INFO").upper()
+LOG_MAX_CHARS = int(os.getenv("LOG_MAX_CHARS", 500))
+LOG_SAMPLE_RATE = float(os.getenv("LOG_SAMPLE_RATE", 0.05))
+# per-stage overrides, e.g. "transcription=0.2,classifier=0"
+LOG_SAMPLE_RATES = {
+    k.strip(): float(v)
+    for k, v in (p.split("=", 1) for p in os.getenv("LOG_SAMPLE_RATES", "").split(",") if "=" in p)
+}
+LOG_QUEUE_SIZE = int(os.getenv("LOG_QUEUE_SIZE", 10000))
+
+ROOT = "callreport"
+
+
+class JsonFormatter(logging.Formatter):
+    def format(self, record):
+        entry = {
+            "ts": datetime.fromtimestamp(record.created, tz=timezone.utc).isoformat(timespec="milliseconds"),
+            "level": record.levelname.lower(),
+            "logger": record.name,
+            "msg": record.getMessage(),
+        }
+        stage = getattr(record, "stage", None)
+        if stage:
+            entry["stage"] = stage
+        entry.update(getattr(record, "fields", None) or {})
+        if record.exc_info:
+            entry["exc"] = self.formatException(record.exc_info)
+        elif record.exc_text:
+            entry["exc"] = record.exc_text
+        return json.dumps(entry, ensure_ascii=False, default=str)
+
+
+_plain = logging.Formatter()
+
+class _DroppingQueueHandler(QueueHandler):
+    # never block the caller: under a log storm, drop instead of waiting on stdout
+    def enqueue(self, record):
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            pass
+
+    # QueueHandler.prepare formats the record, appending the traceback to msg; keep it in exc_text
+    # so the listener's JsonFormatter writes it as "exc". The traceback object is dropped, since it
+    # holds the caller's frames alive until the listener gets to the record.
+    def prepare(self, record):
+        record = copy.copy(record)
+        record.message = record.getMessage()
+        record.msg, record.args = record.message, None
+        if record.exc_info:
+            record.exc_text = _plain.formatException(record.exc_info)
+        record.exc_info = None
+        return record
+
+
+def _setup():
+    logger = logging.getLogger(ROOT)
+    if logger.handlers:
+        return logger
+    logger.setLevel(LOG_LEVEL)
+    logger.propagate = False
+
+    out = logging.StreamHandler(sys.stdout)
+    out.setFormatter(JsonFormatter())
+    log_queue = queue.Queue(maxsize=LOG_QUEUE_SIZE)
+    listener = QueueListener(log_queue, out, respect_handler_level=True)
+    listener.start()
+    atexit.register(listener.stop)
+
+    logger.addHandler(_DroppingQueueHandler(log_queue))
+    return logger
+
+_root = _setup()
+
+def get_logger(name):
+    return _root.getChild(name)
+
+def fields(stage=None, **kwargs):
+    return {"stage": stage, "fields": kwargs}
+
+def truncate(value, limit=None):
+    limit = LOG_MAX_CHARS if limit is None else limit
+    text = value if isinstance(value, str) else str(value)
+    if len(text) <= limit:
+        return text
+    return f"{text[:limit]}…(+{len(text) - limit} chars)"
+
+def should_sample(stage):
+    rate = LOG_SAMPLE_RATES.get(stage, LOG_SAMPLE_RATE)
+    return rate >= 1 or (rate > 0 and random.random() < rate)
+
+def log_payload(logger, stage, name, payload, level=logging.DEBUG, **kwargs):
+    # payload may be a callable so expensive reprs are only built when sampled
+    if not logger.isEnabledFor(level) or not should_sample(stage):
+        return
+    if callable(payload):
+        payload = payload()
+    logger.log(level, name, extra=fields(stage, payload=truncate(payload), **kwargs))
@@ -0,0 +1,92 @@
+from prometheus_client import Counter, Gauge, Histogram, generate_latest, CONTENT_TYPE_LATEST
+
+STAGE_BUCKETS = (0.01, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300)
+API_BUCKETS = (0.25, 0.5, 1, 2, 4, 8, 15, 30, 60, 120)
+DB_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+BYTE_BUCKETS = (64e3, 256e3, 512e3, 1e6, 2e6, 5e6, 10e6, 25e6)
+
+# csv_parse, csv_aggregate, recall, join_match, join_metrics, flags
+PIPELINE_STAGE_SECONDS = Histogram(
+    "pipeline_stage_seconds", "Wall time per pipeline stage", ["stage"], buckets=STAGE_BUCKETS
+)
+
+TRANSCRIPTION_SECONDS = Histogram(
+    "transcription_seconds", "Latency of one transcription API call", buckets=API_BUCKETS
+)
+TRANSCRIPTION_BYTES = Histogram(
+    "transcription_bytes", "Audio bytes uploaded per transcription", buckets=BYTE_BUCKETS
+)
+# wall time to transcript for one recording; mode="split" when it went out as parallel chunks
+RECORDING_TRANSCRIBE_SECONDS = Histogram(
+    "recording_transcribe_seconds", "Wall time to transcribe one recording", ["mode"], buckets=API_BUCKETS
+)
+RECORDING_AUDIO_SECONDS = Counter(
+    "recording_audio_seconds_total", "Audio seconds transcribed", ["mode"]
+)
+TRANSCRIPTIONS_TOTAL = Counter(
+    "transcriptions_total", "Transcription API calls", ["status"]
+)
+
+LLM_SECONDS = Histogram(
+    "llm_seconds", "Latency of one classifier chat completion", ["classifier"], buckets=API_BUCKETS
+)
+LLM_CALLS = Counter(
+    "llm_calls_total", "Classifier chat completions", ["classifier", "status"]
+)
+LLM_TOKENS = Counter(
+    "llm_tokens_total", "Tokens used by classifier chat completions", ["classifier", "kind"]
+)
+
+# process-wide OpenAI budgets (ratelimit_utils), api="transcription"|"chat"
+OPENAI_RATE_BUDGET = Gauge(
+    "openai_rate_budget", "Requests/tokens left in the limiter bucket", ["api", "kind"]
+)
+OPENAI_RATE_WAIT_SECONDS = Histogram(
+    "openai_rate_wait_seconds", "Time a call waited for the rate limiter", ["api"], buckets=STAGE_BUCKETS
+)
+OPENAI_RETRIES_TOTAL = Counter(
+    "openai_retries_total", "OpenAI calls retried after a 429 or server/connection error", ["api", "reason"]
+)
+
+RULE_HITS = Counter(
+    "classifier_rule_hits_total", "Classifier decisions by local rule (rule=\"llm\" when none was confident)",
+    ["classifier", "rule"]
+)
+
+DB_QUERY_SECONDS = Histogram(
+    "db_query_seconds", "Time spent in each db_utils helper, or per named query for run_query/query_all", ["helper"], buckets=DB_BUCKETS
+)
+
+AUDIO_PREPROCESS_SECONDS = Histogram(
+    "audio_preprocess_seconds", "Time to downmix/resample/trim/encode one WAV", buckets=STAGE_BUCKETS
+)
+AUDIO_PREPROCESS_BYTES = Counter(
+    "audio_preprocess_bytes_total", "Audio bytes before and after pre-processing", ["kind"]
+)
+
+VAD_SKIPPED = Counter(
+    "vad_skipped_total", "Recordings classified empty locally and not sent to the API", ["reason"]
+)
+
+TRANSCRIPTION_QUEUE_DEPTH = Gauge(
+    "transcription_queue_depth", "Files waiting for transcription across all jobs"
+)
+TRANSCRIPTIONS_IN_FLIGHT = Gauge(
+    "transcriptions_in_flight", "Transcription API calls currently running"
+)
+TRANSCRIPTION_JOBS_ACTIVE = Gauge(
+    "transcription_jobs_active", "ZIP transcription jobs currently running"
+)
+
+GAS_SECONDS = Histogram(
+    "gas_delivery_seconds", "Time to deliver one report to Google Apps Script, retries included", buckets=API_BUCKETS
+)
+GAS_DELIVERIES = Counter(
+    "gas_deliveries_total", "Report deliveries to Google Apps Script", ["status"]
+)
+GAS_ATTEMPTS = Counter(
+    "gas_attempts_total", "HTTP attempts against Google Apps Script", ["outcome"]
+)
+
+def render_metrics():
+    return generate_latest(), CONTENT_TYPE_LATEST
@@ -0,0 +1,417 @@
+import argparse, json, os, sys
+import psycopg2
+from datetime import date, datetime, timedelta
+from db_utils import get_conn, PHONE_SQL_RE
+from log_utils import get_logger, fields
+
+# Versioned schema migrations. Each migration runs in its own transaction and is
+# recorded in schema_migrations; a session advisory lock keeps two deploys from
+# migrating at once.
+#
+#   python migrations.py up        apply pending migrations, create upcoming partitions
+#   python migrations.py status
+#   python migrations.py explain --date 2025-08-14
+#
+# raw_report and metrics are range-partitioned by month on call_time, so their primary
+# key is (call_id, call_time). Rows outside every monthly partition land in <table>_default;
+# ensure_partitions moves them out when their month's partition is created. call_id stays
+# unique through insert_raw_report_df (db_utils.RAW_REPORT_LOCK_KEY), not through a constraint.
+
+MONTHS_AHEAD = int(os.getenv("MIGRATIONS_MONTHS_AHEAD", 3))
+LOCK_KEY = 720_361_001
+PARTITIONED = ["raw_report", "metrics"]
+
+logger = get_logger(__name__)
+
+def _baseline(cur):
+    cur.execute("""
+        CREATE TABLE IF NOT EXISTS transcriptions (
+            filename TEXT PRIMARY KEY,
+            site VARCHAR(25) NOT NULL,
+            phone_key  BIGINT NOT NULL,
+            transcript JSONB NOT NULL,
+            call_time TIMESTAMP NOT NULL,
+            duration_sec INT,
+            call_type  VARCHAR(25),
+            score FLOAT,
+            comment TEXT,
+            call_id  VARCHAR(255)
+        );
+
+        CREATE TABLE IF NOT EXISTS raw_report (
+            call_id VARCHAR(255) PRIMARY KEY,
+            call_time TIMESTAMP NOT NULL,
+            call_from VARCHAR(255) NOT NULL,
+            is_voicemail BOOLEAN,
+            is_dropped BOOLEAN,
+            is_redirected BOOLEAN,
+            is_recalled BOOLEAN,
+            recall_id VARCHAR(255),
+            phone_key BIGINT,
+            call_duration INT NOT NULL,
+            call_cost FLOAT,
+            call_direction VARCHAR(255) NOT NULL,
+            call_status VARCHAR(255) NOT NULL,
+            call_activity_details TEXT NOT NULL
+        );
+
+        CREATE TABLE IF NOT EXISTS metrics (
+            call_id VARCHAR(255) PRIMARY KEY,
+            call_time TIMESTAMP NOT NULL,
+            call_type VARCHAR(25),
+            status VARCHAR(25),
+            practice VARCHAR(25),
+            duration_sec INT,
+            is_dropped BOOLEAN,
+            is_proactive BOOLEAN,
+            is_booked BOOLEAN,
+            is_new_patient BOOLEAN,
+            is_voicemail BOOLEAN,
+            is_redirected BOOLEAN,
+            is_answered BOOLEAN
+        );
+    """)
+
+def _flags_transcript_md5(cur):
+    cur.execute("ALTER TABLE metrics ADD COLUMN IF NOT EXISTS flags_transcript_md5 TEXT")
+
+def _month_start(d):
+    return date(d.year, d.month, 1)
+
+def _next_month(d):
+    return date(d.year + d.month // 12, d.month % 12 + 1, 1)
+
+def _partition_name(table, month):
+    return f"{table}_{month:%Y_%m}"
+
+def _exists(cur, name):
+    cur.execute("SELECT to_regclass(%s) IS NOT NULL", (name,))
+    return cur.fetchone()[0]
+
+def create_month_partition(cur, table, month):
+    # rows already sitting in the default partition for this month are moved across,
+    # otherwise ATTACH would refuse the new range
+    name = _partition_name(table, month)
+    if _exists(cur, name):
+        return False
+    lo, hi = month, _next_month(month)
+    cur.execute(f"CREATE TABLE {name} (LIKE {table} INCLUDING DEFAULTS)")
+    cur.execute(
+        f"""
+        WITH moved AS (
+            DELETE FROM {table}_default WHERE call_time >= %s AND call_time < %s RETURNING *
+        )
+        INSERT INTO {name} SELECT * FROM moved
+        """,
+        (lo, hi)
+    )
+    cur.execute(f"ALTER TABLE {table} ATTACH PARTITION {name} FOR VALUES FROM (%s) TO (%s)", (lo, hi))
+    return True
+
+def ensure_partitions(cur, table, start=None, months_ahead=MONTHS_AHEAD):
+    month = _month_start(start or date.today())
+    last = _month_start(date.today())
+    for _ in range(months_ahead):
+        last = _next_month(last)
+    created = []
+    while month <= last:
+        if create_month_partition(cur, table, month):
+            created.append(_partition_name(table, month))
+        month = _next_month(month)
+    return created
+
+def _partition_by_month(table):
+    def migrate(cur):
+        old = f"{table}_unpartitioned"
+        cur.execute(f"ALTER TABLE {table} RENAME TO {old}")
+        cur.execute(f"ALTER INDEX IF EXISTS {table}_pkey RENAME TO {old}_pkey")
+        cur.execute(f"CREATE TABLE {table} (LIKE {old} INCLUDING DEFAULTS) PARTITION BY RANGE (call_time)")
+        cur.execute(f"ALTER TABLE {table} ADD PRIMARY KEY (call_id, call_time)")
+        cur.execute(f"CREATE INDEX {table}_call_time_idx ON {table} (call_time)")
+        cur.execute(f"CREATE TABLE {table}_default PARTITION OF {table} DEFAULT")
+
+        cur.execute(f"SELECT min(call_time) FROM {old}")
+        first = cur.fetchone()[0]
+        ensure_partitions(cur, table, first.date() if first else None)
+
+        cur.execute(f"INSERT INTO {table} SELECT * FROM {old}")
+        cur.execute(f"DROP TABLE {old}")
+    return migrate
+
+def _transcription_indexes(cur):
+    # filename is the primary key already (get_existing_calls)
+    cur.execute("CREATE INDEX IF NOT EXISTS transcriptions_call_time_idx ON transcriptions (call_time)")
+    cur.execute("CREATE INDEX IF NOT EXISTS transcriptions_call_id_idx ON transcriptions (call_id)")
+    cur.execute("CREATE INDEX IF NOT EXISTS transcriptions_unmatched_idx ON transcriptions (call_time) WHERE call_id IS NULL")
+
+def _raw_report_phones(cur):
+    # phone suffixes per raw row for the SQL join in join_utils.match_calls_on_date;
+    # the backfill mirrors db_utils.phone_suffixes
+    cur.execute("""
+        CREATE TABLE IF NOT EXISTS raw_report_phones (
+            call_id VARCHAR(255) NOT NULL,
+            call_time TIMESTAMP NOT NULL,
+            suffix BIGINT NOT NULL,
+            PRIMARY KEY (call_id, suffix)
+        )
+    """)
+    cur.execute("CREATE INDEX IF NOT EXISTS raw_report_phones_suffix_time_idx ON raw_report_phones (suffix, call_time)")
+    cur.execute("""
+        INSERT INTO raw_report_phones (call_id, call_time, suffix)
+        SELECT DISTINCT r.call_id, r.call_time, right(n.digits, 7)::bigint
+        FROM raw_report r
+        CROSS JOIN LATERAL (
+            SELECT regexp_replace(m[1], '[^0-9]', '', 'g') AS digits
+            FROM regexp_matches(
+                coalesce(r.call_from, '') || ' | ' || coalesce(r.call_activity_details, ''),
+                '([0-9][0-9[:space:]()-]{4,}[0-9])', 'g'
+            ) AS m
+        ) AS n
+        WHERE length(n.digits) >= 6
+        ON CONFLICT DO NOTHING
+    """)
+
+def _sites(cur):
+    # registry for site_utils when SITES_SOURCE=db; lower priority wins
+    from site_utils import DEFAULT_SITES
+    cur.execute("""
+        CREATE TABLE IF NOT EXISTS sites (
+            name VARCHAR(25) PRIMARY KEY,
+            aliases TEXT[] NOT NULL DEFAULT '{}',
+            priority INT NOT NULL DEFAULT 100,
+            active BOOLEAN NOT NULL DEFAULT TRUE
+        )
+    """)
+    for priority, (name, aliases) in enumerate(DEFAULT_SITES):
+        cur.execute(
+            "INSERT INTO sites (name, aliases, priority) VALUES (%s, %s, %s) ON CONFLICT (name) DO NOTHING",
+            (name, aliases, priority)
+        )
+
+def _transcript_storage(cur):
+    # Transcript bodies live out of line in the TOAST table, compressed: report scans over
+    # transcriptions then read narrow heap rows and only detoast when a body is selected.
+    # New and updated rows pick this up; existing values are recompressed on VACUUM FULL.
+    cur.execute("ALTER TABLE transcriptions SET (toast_tuple_target = 128)")
+    cur.execute("SHOW server_version_num")
+    if int(cur.fetchone()[0]) < 140000:
+        return
+    cur.execute("SAVEPOINT lz4")
+    try:
+        cur.execute("ALTER TABLE transcriptions ALTER COLUMN transcript SET COMPRESSION lz4")
+    except psycopg2.Error:
+        # server built without lz4: keep the default pglz
+        cur.execute("ROLLBACK TO SAVEPOINT lz4")
+    else:
+        cur.execute("RELEASE SAVEPOINT lz4")
+
+def _rebuild_raw_report_phones(cur):
+    # migration 6 read runs like "07700900123 - 01612345678" as one number; refill with the
+    # pattern phone_suffixes uses now. Transcriptions already matched keep their call_id.
+    cur.execute("TRUNCATE raw_report_phones")
+    cur.execute("""
+        INSERT INTO raw_report_phones (call_id, call_time, suffix)
+        SELECT DISTINCT r.call_id, r.call_time, right(n.digits, 7)::bigint
+        FROM raw_report r
+        CROSS JOIN LATERAL (
+            SELECT regexp_replace(m[1], '[^0-9]', '', 'g') AS digits
+            FROM regexp_matches(
+                coalesce(r.call_from, '') || ' | ' || coalesce(r.call_activity_details, ''),
+                %s, 'g'
+            ) AS m
+        ) AS n
+        WHERE length(n.digits) >= 6
+        ON CONFLICT DO NOTHING
+    """, (f"({PHONE_SQL_RE})",))
+
+def _dedupe_call_ids(cur):
+    # between migrations 3/4 and the call_id check in insert_raw_report_df a call could be
+    # stored twice under different call_times; keep the earliest
+    for table in ("metrics", "raw_report"):
+        cur.execute(f"""
+            DELETE FROM {table} t USING {table} e
+            WHERE e.call_id = t.call_id AND e.call_time < t.call_time
+        """)
+        if cur.rowcount:
+            logger.warning("duplicate call_ids removed", extra=fields("migrations", table=table, rows=cur.rowcount))
+    # raw_report_phones is keyed on (call_id, suffix) and may have kept the removed call_time
+    cur.execute("""
+        UPDATE raw_report_phones p SET call_time = r.call_time
+        FROM raw_report r
+        WHERE r.call_id = p.call_id AND r.call_time <> p.call_time
+    """)
+
+def _gas_deliveries(cur):
+    # fire-and-poll GAS delivery state (gas_utils), readable from every machine
+    cur.execute("""
+        CREATE TABLE IF NOT EXISTS gas_deliveries (
+            id VARCHAR(32) PRIMARY KEY,
+            filename TEXT NOT NULL,
+            status VARCHAR(16) NOT NULL,
+            doc_url TEXT,
+            error TEXT,
+            created_at TIMESTAMPTZ NOT NULL DEFAULT now(),
+            finished_at TIMESTAMPTZ
+        )
+    """)
+    cur.execute("CREATE INDEX IF NOT EXISTS gas_deliveries_finished_at_idx ON gas_deliveries (finished_at)")
+
+def _short_phone_suffixes(cur):
+    # transcriptions named after a 6-digit local number have a 6-digit phone_key; store the last
+    # 6 digits next to the last 7 (db_utils.phone_suffixes) so the join finds them by equality
+    cur.execute("""
+        INSERT INTO raw_report_phones (call_id, call_time, suffix)
+        SELECT call_id, call_time, suffix % 1000000 FROM raw_report_phones
+        ON CONFLICT DO NOTHING
+    """)
+
+# (version, name, fn(cursor)); append only, never renumber
+MIGRATIONS = [
+    (1, "baseline", _baseline),
+    (2, "metrics_flags_transcript_md5", _flags_transcript_md5),
+    (3, "partition_raw_report", _partition_by_month("raw_report")),
+    (4, "partition_metrics", _partition_by_month("metrics")),
+    (5, "transcription_indexes", _transcription_indexes),
+    (6, "raw_report_phones", _raw_report_phones),
+    (7, "sites", _sites),
+    (8, "transcript_storage", _transcript_storage),
+    (9, "raw_report_phones_rebuild", _rebuild_raw_report_phones),
+    (10, "dedupe_call_ids", _dedupe_call_ids),
+    (11, "gas_deliveries", _gas_deliveries),
+    (12, "raw_report_phones_short", _short_phone_suffixes),
+]
+
+def _ensure_table(conn):
+    with conn.cursor() as cur:
+        cur.execute("""
+            CREATE TABLE IF NOT EXISTS schema_migrations (
+                version INT PRIMARY KEY,
+                name TEXT NOT NULL,
+                applied_at TIMESTAMP NOT NULL DEFAULT now()
+            )
+        """)
+    conn.commit()
+
+def applied_versions(conn):
+    with conn.cursor() as cur:
+        cur.execute("SELECT version FROM schema_migrations")
+        return {r[0] for r in cur.fetchall()}
+
+def migrate_up():
+    conn = get_conn()
+    try:
+        with conn.cursor() as cur:
+            cur.execute("SELECT pg_advisory_lock(%s)", (LOCK_KEY,))
+        _ensure_table(conn)
+        done = applied_versions(conn)
+        applied = []
+        for version, name, fn in MIGRATIONS:
+            if version in done:
+                continue
+            with conn:
+                with conn.cursor() as cur:
+                    fn(cur)
+                    cur.execute("INSERT INTO schema_migrations (version, name) VALUES (%s, %s)", (version, name))
+            logger.info("migration applied", extra=fields("migrations", version=version, name=name))
+            applied.append(version)
+
+        created = []
+        with conn:
+            with conn.cursor() as cur:
+                for table in PARTITIONED:
+                    created += ensure_partitions(cur, table)
+        if created:
+            logger.info("partitions created", extra=fields("migrations", partitions=created))
+        return applied, created
+    finally:
+        conn.close()
+
+def status():
+    conn = get_conn()
+    try:
+        _ensure_table(conn)
+        done = applied_versions(conn)
+        return [(version, name, version in done) for version, name, _ in MIGRATIONS]
+    finally:
+        conn.close()
+
+# Plan checks for the hot queries: the SQL the modules run, with the parameters they pass
+# (names into the params of explain_checks). Sequential scans are disabled for the session so
+# the check is about whether an index or pruning is *usable*, not about what the planner prefers
+# on a small table. The modules are imported here, not at the top, to keep `up` light.
+def explain_queries():
+    from join_utils import JOINED_SQL, PENDING_METRICS_SQL, MATCH_CALLS_SQL
+    from report_utils import REPORT_COMPLETE_SQL, REPORT_RAW_SQL, TRANSCRIPTS_BY_ID_SQL
+    from transcript_utils import TRANSCRIPTIONS_SQL, PENDING_FLAGS_SQL, UNRECORDED_SQL
+    from zip_utils import EXISTING_CALLS_SQL
+    return [
+        ("report_raw_on_date", "metrics", REPORT_RAW_SQL, ("lo", "hi", "lo", "hi")),
+        ("report_transcripts", None, TRANSCRIPTS_BY_ID_SQL, ("ids",)),
+        ("check_report_complete", "metrics", REPORT_COMPLETE_SQL, ("lo", "hi")),
+        ("join_pending_metrics", "raw_report", JOINED_SQL.format(pending=PENDING_METRICS_SQL), ("lo", "hi", "ids")),
+        ("join_match_phones", None, MATCH_CALLS_SQL, ("lo", "hi", "lo", "hi")),
+        ("flags_pending", "metrics", TRANSCRIPTIONS_SQL.format(pending="AND " + PENDING_FLAGS_SQL), ("lo", "hi")),
+        ("flags_unrecorded", "metrics", UNRECORDED_SQL, ("lo", "hi", "lo", "hi")),
+        ("existing_calls", None, EXISTING_CALLS_SQL, ("names",)),
+    ]
+
+def _nodes(plan):
+    yield plan
+    for child in plan.get("Plans", []):
+        yield from _nodes(child)
+
+def _partitions(cur, table):
+    cur.execute("SELECT inhrelid::regclass::text FROM pg_inherits WHERE inhparent = %s::regclass", (table,))
+    return {r[0] for r in cur.fetchall()}
+
+def explain_checks(d, checks=None):
+    lo = datetime.combine(d, datetime.min.time())
+    params = {"lo": lo, "hi": lo + timedelta(days=1), "names": ["a.wav", "b.wav"], "ids": ["1", "2"]}
+    results = []
+    conn = get_conn()
+    try:
+        with conn.cursor() as cur:
+            cur.execute("SET enable_seqscan = off")
+            partitions = {t: _partitions(cur, t) for t in PARTITIONED}
+            for name, pruned_table, sql, args in checks or explain_queries():
+                cur.execute("EXPLAIN (FORMAT JSON) " + sql, [params[a] for a in args])
+                plan = cur.fetchone()[0]
+                plan = (json.loads(plan) if isinstance(plan, str) else plan)[0]["Plan"]
+                nodes = list(_nodes(plan))
+                seq = sorted({n.get("Relation Name") for n in nodes if n["Node Type"] == "Seq Scan"})
+                problems = [f"seq scan on {r}" for r in seq]
+                if pruned_table:
+                    scanned = {n.get("Relation Name") for n in nodes} & partitions[pruned_table]
+                    if not partitions[pruned_table]:
+                        problems.append(f"{pruned_table} is not partitioned")
+                    elif len(scanned) >= len(partitions[pruned_table]):
+                        problems.append(f"no partition pruning on {pruned_table} ({len(scanned)} partitions)")
+                results.append((name, problems))
+    finally:
+        conn.close()
+    return results
+
+def main():
+    parser = argparse.ArgumentParser(description="Schema migrations")
+    sub = parser.add_subparsers(dest="cmd", required=True)
+    sub.add_parser("up", help="apply pending migrations and create upcoming partitions")
+    sub.add_parser("status", help="list migrations")
+    p_explain = sub.add_parser("explain", help="check the hot queries use indexes / partition pruning")
+    p_explain.add_argument("--date", default=None, help="YYYY-MM-DD (default: today)")
+    args = parser.parse_args()
+
+    if args.cmd == "up":
+        applied, created = migrate_up()
+        print(f"applied: {applied or 'none'}; partitions created: {len(created)}")
+    elif args.cmd == "status":
+        for version, name, done in status():
+            print(f"{version:>4}  {'applied' if done else 'pending':<8} {name}")
+    else:
+        failed = 0
+        for name, problems in explain_checks(date.fromisoformat(args.date) if args.date else date.today()):
+            print(f"{'ok  ' if not problems else 'FAIL'} {name}{': ' + '; '.join(problems) if problems else ''}")
+            failed += bool(problems)
+        sys.exit(1 if failed else 0)
+
+if __name__ == "__main__":
+    main()
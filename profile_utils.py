@@ -0,0 +1,202 @@
+import contextvars, cProfile, io, os, pstats, re, sys, threading, time, tracemalloc
+from collections import Counter
+from contextlib import contextmanager
+from datetime import datetime
+from pathlib import Path
+
+# Opt-in profiling. Enabled per request with an "X-Profile: 1" header or "?profile=1",
+# or globally with PROFILE_ROUTES=1 (routes) / PROFILE_JOBS=1 (transcription jobs).
+PROFILE_DIR = Path(os.getenv("PROFILE_DIR", "/tmp/profiles"))
+PROFILE_MODE = os.getenv("PROFILE_MODE", "sample")  # "sample" (all threads) or "cprofile" (calling thread)
+PROFILE_SAMPLE_INTERVAL = float(os.getenv("PROFILE_SAMPLE_INTERVAL_MS", 5)) / 1000
+PROFILE_TOP_N = int(os.getenv("PROFILE_TOP_N", 40))
+
+_TRUTHY = {"1", "true", "yes", "on"}
+_current = contextvars.ContextVar("profile_session", default=None)
+_tracemalloc_lock = threading.Lock()
+_tracemalloc_users = 0
+# cProfile hooks the thread it starts on, which for routes and jobs is the event loop, and a
+# second profiler on that thread would replace the first. One cProfile session at a time;
+# sessions that overlap it are sampled instead.
+_cprofile_lock = threading.Lock()
+
+def _env_flag(name):
+    return os.getenv(name, "").strip().lower() in _TRUTHY
+
+def routes_enabled(request=None):
+    if _env_flag("PROFILE_ROUTES"):
+        return True
+    if request is None:
+        return False
+    return (
+        request.headers.get("x-profile", "").lower() in _TRUTHY
+        or request.query_params.get("profile", "").lower() in _TRUTHY
+    )
+
+def jobs_enabled():
+    return _env_flag("PROFILE_JOBS")
+
+
+class _Sampler(threading.Thread):
+    # Samples the stacks of every thread, so executor work (transcriptions, DB calls)
+    # shows up alongside the event loop.
+    def __init__(self, interval):
+        super().__init__(daemon=True)
+        self.interval = interval
+        self.stacks = Counter()
+        self.samples = 0
+        self._halt = threading.Event()
+
+    def run(self):
+        own = threading.get_ident()
+        while not self._halt.wait(self.interval):
+            for ident, frame in sys._current_frames().items():
+                if ident == own:
+                    continue
+                stack = []
+                while frame is not None:
+                    code = frame.f_code
+                    stack.append(f"{Path(code.co_filename).name}:{code.co_name}:{frame.f_lineno}")
+                    frame = frame.f_back
+                self.stacks[";".join(reversed(stack))] += 1
+            self.samples += 1
+
+    def stop(self):
+        self._halt.set()
+        self.join()
+
+    def summary(self):
+        own, total = Counter(), Counter()
+        for stack, n in self.stacks.items():
+            frames = [f.rsplit(":", 1)[0] for f in stack.split(";")]
+            own[frames[-1]] += n
+            for f in set(frames):
+                total[f] += n
+        lines = [f"{self.samples} samples every {self.interval * 1000:.1f} ms", "", "top self:"]
+        lines += [f"  {n:7d}  {f}" for f, n in own.most_common(PROFILE_TOP_N)]
+        lines += ["", "top cumulative:"]
+        lines += [f"  {n:7d}  {f}" for f, n in total.most_common(PROFILE_TOP_N)]
+        return "\n".join(lines)
+
+    def folded(self):
+        return "\n".join(f"{stack} {n}" for stack, n in self.stacks.most_common())
+
+
+class _Session:
+    def __init__(self, name):
+        self.name = name
+        self.id = f"{datetime.utcnow().strftime('%Y%m%d-%H%M%S-%f')}-{re.sub(r'[^A-Za-z0-9_.-]', '_', name)}"
+        self.started = time.perf_counter()
+        self.stages = []
+        self._last_snapshot = None
+
+    def mark(self, stage):
+        elapsed = time.perf_counter() - self.started
+        if not tracemalloc.is_tracing():
+            self.stages.append((stage, elapsed, None, None, []))
+            return
+        current, peak = tracemalloc.get_traced_memory()
+        snapshot = tracemalloc.take_snapshot().filter_traces((
+            tracemalloc.Filter(False, tracemalloc.__file__),
+            tracemalloc.Filter(False, "<frozen importlib._bootstrap>"),
+        ))
+        if self._last_snapshot is None:
+            top = snapshot.statistics("lineno")[:10]
+        else:
+            top = snapshot.compare_to(self._last_snapshot, "lineno")[:10]
+        self._last_snapshot = snapshot
+        self.stages.append((stage, elapsed, current, peak, [str(s) for s in top]))
+
+    def allocation_summary(self):
+        lines = []
+        for stage, elapsed, current, peak, top in self.stages:
+            if current is None:
+                lines.append(f"[{elapsed:8.3f}s] {stage}")
+                continue
+            lines.append(f"[{elapsed:8.3f}s] {stage}: current={current / 1e6:.1f} MB peak={peak / 1e6:.1f} MB")
+            lines += [f"    {s}" for s in top]
+        return "\n".join(lines)
+
+
+def _start_tracemalloc():
+    global _tracemalloc_users
+    with _tracemalloc_lock:
+        if _tracemalloc_users == 0 and not tracemalloc.is_tracing():
+            tracemalloc.start(int(os.getenv("PROFILE_TRACEMALLOC_FRAMES", 1)))
+        _tracemalloc_users += 1
+
+def _stop_tracemalloc():
+    global _tracemalloc_users
+    with _tracemalloc_lock:
+        _tracemalloc_users -= 1
+        if _tracemalloc_users == 0 and tracemalloc.is_tracing():
+            tracemalloc.stop()
+
+@contextmanager
+def profile_session(name, enabled=True):
+    if not enabled:
+        yield None
+        return
+
+    session = _Session(name)
+    PROFILE_DIR.mkdir(parents=True, exist_ok=True)
+    _start_tracemalloc()
+    token = _current.set(session)
+
+    cprofiling = PROFILE_MODE == "cprofile" and _cprofile_lock.acquire(blocking=False)
+    if cprofiling:
+        profiler = cProfile.Profile()
+        profiler.enable()
+    else:
+        profiler = _Sampler(PROFILE_SAMPLE_INTERVAL)
+        profiler.start()
+
+    session.mark("start")
+    try:
+        yield session
+    finally:
+        session.mark("end")
+        _current.reset(token)
+        if cprofiling:
+            profiler.disable()
+            _cprofile_lock.release()
+            profiler.dump_stats(PROFILE_DIR / f"{session.id}.prof")
+            out = io.StringIO()
+            pstats.Stats(profiler, stream=out).sort_stats("cumulative").print_stats(PROFILE_TOP_N)
+            summary = out.getvalue()
+        else:
+            profiler.stop()
+            (PROFILE_DIR / f"{session.id}.folded").write_text(profiler.folded())
+            summary = profiler.summary()
+            if PROFILE_MODE == "cprofile":
+                summary = f"cProfile was busy with another session, sampled instead\n{summary}"
+        _stop_tracemalloc()
+
+        elapsed = time.perf_counter() - session.started
+        (PROFILE_DIR / f"{session.id}.txt").write_text(
+            f"{name}: {elapsed:.3f}s\n\n== stages ==\n{session.allocation_summary()}\n\n== profile ==\n{summary}\n"
+        )
+
+def mark_stage(stage):
+    session = _current.get()
+    if session is not None:
+        session.mark(stage)
+
+async def profile_job(name, coro, enabled=False):
+    with profile_session(name, enabled=enabled or jobs_enabled()):
+        return await coro
+
+def list_profiles():
+    if not PROFILE_DIR.exists():
+        return []
+    files = sorted(PROFILE_DIR.iterdir(), key=lambda p: p.stat().st_mtime, reverse=True)
+    return [
+        {"name": p.name, "bytes": p.stat().st_size, "modified": datetime.utcfromtimestamp(p.stat().st_mtime).isoformat()}
+        for p in files if p.is_file()
+    ]
+
+def profile_path(name):
+    path = PROFILE_DIR / Path(name).name
+    if path.name != name or not path.is_file():
+        return None
+    return path
@@ -0,0 +1,175 @@
+import os, re, threading, time
+import openai
+from metrics_utils import OPENAI_RATE_BUDGET, OPENAI_RATE_WAIT_SECONDS, OPENAI_RETRIES_TOTAL
+from log_utils import get_logger, fields
+
+# Process-wide budgets for OpenAI traffic, one limiter for transcription and one for chat,
+# shared by every job and thread. Each holds two token buckets refilled continuously:
+# requests per minute and tokens per minute (0 = no limit). Callers block in acquire()
+# until both buckets have room. The x-ratelimit-* response headers pull the buckets down
+# to what the API reports as left. A 429 pauses every caller of that limiter for
+# Retry-After (or the reset time) before the request is retried.
+TRANSCRIBE_RPM = float(os.getenv("TRANSCRIBE_RPM", 500))
+TRANSCRIBE_TPM = float(os.getenv("TRANSCRIBE_TPM", 0))
+CHAT_RPM = float(os.getenv("CHAT_RPM", 500))
+CHAT_TPM = float(os.getenv("CHAT_TPM", 200000))
+OPENAI_RETRIES = int(os.getenv("OPENAI_RETRIES", 5))
+OPENAI_BACKOFF_SEC = float(os.getenv("OPENAI_BACKOFF_SEC", 1))
+
+logger = get_logger(__name__)
+
+def parse_reset(value):
+    # "20ms", "1s", "6m0s", "1h2m3.5s"
+    if not value:
+        return None
+    units = {"ms": 0.001, "s": 1, "m": 60, "h": 3600}
+    parts = re.findall(r"(\d+(?:\.\d+)?)(ms|s|m|h)", value)
+    if not parts:
+        try:
+            return float(value)
+        except ValueError:
+            return None
+    return sum(float(n) * units[u] for n, u in parts)
+
+def _number(value):
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        return None
+
+class _Bucket:
+    def __init__(self, per_minute):
+        self.configured = per_minute
+        self.capacity = per_minute
+        self.level = per_minute
+        self.updated = time.monotonic()
+
+    def refill(self, now):
+        if self.capacity:
+            self.level = min(self.capacity, self.level + (now - self.updated) * self.capacity / 60)
+        self.updated = now
+
+    def wait_for(self, amount):
+        if not self.capacity:
+            return 0.0
+        # a request bigger than the whole budget waits for a full bucket
+        amount = min(amount, self.capacity)
+        return max(0.0, (amount - self.level) * 60 / self.capacity)
+
+    def take(self, amount):
+        if self.capacity:
+            self.level = min(self.capacity, self.level - amount)
+
+    def observe(self, limit, remaining):
+        # the configured budget stays a ceiling; the API may only lower it (or set one where none is configured)
+        if limit:
+            self.capacity = min(limit, self.configured) if self.configured else limit
+        if remaining is not None and self.capacity:
+            self.level = min(self.level, remaining)
+
+class RateLimiter:
+    def __init__(self, name, rpm, tpm):
+        self.name = name
+        self.requests = _Bucket(rpm)
+        self.tokens = _Bucket(tpm)
+        self.paused_until = 0.0
+        self._lock = threading.Lock()
+
+    def _export(self):
+        OPENAI_RATE_BUDGET.labels(self.name, "requests").set(self.requests.level)
+        OPENAI_RATE_BUDGET.labels(self.name, "tokens").set(self.tokens.level)
+
+    def acquire(self, tokens=0):
+        start = time.monotonic()
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                self.requests.refill(now)
+                self.tokens.refill(now)
+                wait = max(self.paused_until - now, self.requests.wait_for(1), self.tokens.wait_for(tokens))
+                if wait <= 0:
+                    self.requests.take(1)
+                    self.tokens.take(tokens)
+                    self._export()
+                    break
+            time.sleep(min(wait, 1.0))
+        waited = time.monotonic() - start
+        OPENAI_RATE_WAIT_SECONDS.labels(self.name).observe(waited)
+        return waited
+
+    def settle(self, estimated, actual):
+        # charge the real token count once the response reports usage
+        with self._lock:
+            self.tokens.take(actual - estimated)
+            self._export()
+
+    def pause(self, seconds):
+        with self._lock:
+            self.paused_until = max(self.paused_until, time.monotonic() + seconds)
+
+    def observe_headers(self, headers):
+        if headers is None:
+            return
+        with self._lock:
+            now = time.monotonic()
+            for kind, bucket in (("requests", self.requests), ("tokens", self.tokens)):
+                bucket.refill(now)
+                remaining = _number(headers.get(f"x-ratelimit-remaining-{kind}"))
+                bucket.observe(_number(headers.get(f"x-ratelimit-limit-{kind}")), remaining)
+                if remaining is not None and remaining < 1:
+                    reset = parse_reset(headers.get(f"x-ratelimit-reset-{kind}"))
+                    if reset:
+                        self.paused_until = max(self.paused_until, now + reset)
+            self._export()
+
+    def snapshot(self):
+        with self._lock:
+            now = time.monotonic()
+            self.requests.refill(now)
+            self.tokens.refill(now)
+            return {
+                "requests": round(self.requests.level, 1), "requests_per_min": self.requests.capacity,
+                "tokens": round(self.tokens.level, 1), "tokens_per_min": self.tokens.capacity,
+                "paused_sec": round(max(self.paused_until - now, 0.0), 3),
+            }
+
+TRANSCRIBE_LIMITER = RateLimiter("transcription", TRANSCRIBE_RPM, TRANSCRIBE_TPM)
+CHAT_LIMITER = RateLimiter("chat", CHAT_RPM, CHAT_TPM)
+
+def _retry_delay(attempt, headers=None):
+    if headers is not None:
+        retry_after_ms = _number(headers.get("retry-after-ms"))
+        if retry_after_ms:
+            return retry_after_ms / 1000
+        retry_after = _number(headers.get("retry-after"))
+        if retry_after:
+            return retry_after
+    return OPENAI_BACKOFF_SEC * 2 ** attempt
+
+def call_limited(limiter, send, tokens=0):
+    # send() makes one request through `.with_raw_response` and returns the raw response;
+    # the SDK's own retries are off (see ai_utils.get_api_client) so every attempt is budgeted
+    for attempt in range(OPENAI_RETRIES + 1):
+        limiter.acquire(tokens)
+        try:
+            raw = send()
+        except openai.RateLimitError as e:
+            if e.code == "insufficient_quota" or attempt == OPENAI_RETRIES:
+                raise
+            headers = e.response.headers
+            limiter.observe_headers(headers)
+            delay = _retry_delay(attempt, headers)
+            limiter.pause(delay)
+            OPENAI_RETRIES_TOTAL.labels(limiter.name, "rate_limited").inc()
+            logger.warning("openai rate limited", extra=fields(limiter.name, attempt=attempt + 1, delay=round(delay, 2)))
+            continue
+        except (openai.APIConnectionError, openai.InternalServerError) as e:
+            if attempt == OPENAI_RETRIES:
+                raise
+            delay = _retry_delay(attempt)
+            OPENAI_RETRIES_TOTAL.labels(limiter.name, "server_error").inc()
+            logger.warning("openai retry", extra=fields(limiter.name, attempt=attempt + 1, delay=round(delay, 2), error=repr(e)))
+            time.sleep(delay)
+            continue
+        limiter.observe_headers(raw.headers)
+        return raw
@@ -0,0 +1,296 @@
+import argparse, json, os, shutil, sys, time
+from datetime import date, datetime, timedelta
+from pathlib import Path
+
+# Record-and-replay of one production day, for profiling and regression-testing pipeline changes
+# without Postgres production data or OpenAI spend.
+#
+#   capture   reads a day from the (production) DB into a bundle directory:
+#               csv/                 the phone-system CSV exports of the day (--csv, or captured uploads)
+#               transcriptions.jsonl the day's transcriptions rows
+#               ai.jsonl             recorded detect_* / transcribe_one exchanges for those transcripts
+#               report.json          build_practice_report of the day, as the app produces it now
+#               metrics.jsonl        the day's metrics rows (type, practice, flags)
+#               sites.json           the practice registry in use
+#   run       replays the bundle against a local Postgres: migrations, the day's rows reset, the
+#             transcriptions seeded unmatched, then the CSV upload (handle_upload), join_calls_at_date,
+#             generate_flags_from_transcripts and build_practice_report, with OpenAI answered from
+#             ai.jsonl. Prints per-stage timings and the differences to the recorded report and flags.
+#
+# The exchanges come from a running app with CAPTURE_DIR set (see replay_utils), which also keeps
+# each uploaded CSV.
+#
+#   CAPTURE_DIR=captures uvicorn index:app ...                          # record while the day is processed
+#   python replay.py capture --date 2025-08-14 --bundle bundles/2025-08-14 --capture-dir captures
+#   POSTGRESQL_HOST=localhost POSTGRESQL_SSLMODE=disable ... python replay.py run --bundle bundles/2025-08-14
+#   python replay.py run --bundle bundles/2025-08-14 --profile --json result.json
+
+LOCAL_HOSTS = {None, "", "localhost", "127.0.0.1", "::1"}
+FLAG_COLUMNS = ["call_type", "practice", "is_answered", "is_proactive", "is_booked", "is_new_patient",
+                "is_voicemail", "is_dropped", "is_redirected"]
+
+def day_bounds(d):
+    start = datetime.combine(d, datetime.min.time())
+    return start, start + timedelta(days=1)
+
+def _jsonable(value):
+    if isinstance(value, (datetime, date)):
+        return value.isoformat()
+    return value
+
+def write_jsonl(path, rows):
+    with open(path, "w") as f:
+        for row in rows:
+            f.write(json.dumps({k: _jsonable(v) for k, v in row.items()}, ensure_ascii=False) + "\n")
+
+def read_jsonl(path):
+    if not Path(path).exists():
+        return []
+    with open(path) as f:
+        return [json.loads(line) for line in f if line.strip()]
+
+def report_records(report_df):
+    # cells as strings, so a recorded report and a replayed one compare regardless of dtypes
+    df = report_df.fillna("").astype(str)
+    return {"columns": [str(c) for c in df.columns], "rows": df.values.tolist()}
+
+def _csv_dates(data):
+    import pandas as pd
+    from io import BytesIO
+    try:
+        times = pd.read_csv(BytesIO(data), usecols=["Call Time"])["Call Time"]
+    except (ValueError, KeyError):
+        return set()
+    return set(pd.to_datetime(times, errors="coerce").dropna().dt.date)
+
+def _day_exchanges(capture_dir, transcripts):
+    # the recorded exchanges for this day: chat requests are rebuilt from the day's transcripts
+    # and looked up by key; transcription responses are kept when their text is part of one
+    from ai_utils import PROMPTS, chat_request
+    from replay_utils import chat_key, read_exchanges
+    exchanges = read_exchanges(Path(capture_dir) / "ai.jsonl") if capture_dir else []
+    texts = [t for t in transcripts if t]
+    keys = {chat_key(chat_request(prompt(t))) for t in texts for prompt in PROMPTS.values()}
+    joined = "\n".join(texts)
+    return [
+        e for e in exchanges
+        if (e["kind"] == "chat" and e["key"] in keys)
+        or (e["kind"] == "transcription" and e["response"] and e["response"].strip() in joined)
+    ]
+
+def capture(args):
+    from db_utils import query_all
+    from report_utils import get_raw_on_date, build_practice_report
+    from site_utils import get_sites
+
+    d = date.fromisoformat(args.date)
+    start, end = day_bounds(d)
+    bundle = Path(args.bundle)
+    if bundle.exists() and any(bundle.iterdir()):
+        sys.exit(f"{bundle} is not empty")
+    (bundle / "csv").mkdir(parents=True, exist_ok=True)
+
+    sources = [Path(p) for p in args.csv or []]
+    if not sources and args.capture_dir:
+        sources = [p for p in sorted((Path(args.capture_dir) / "csv").glob("*.csv")) if d in _csv_dates(p.read_bytes())]
+    if not sources:
+        sys.exit(f"no CSV export for {d}: pass --csv or --capture-dir with captured uploads")
+    for p in sources:
+        shutil.copyfile(p, bundle / "csv" / p.name)
+
+    transcriptions = query_all(
+        """
+        SELECT filename, site, phone_key, transcript, call_time, duration_sec, call_type, score, comment
+        FROM transcriptions
+        WHERE call_time >= %s AND call_time < %s
+        ORDER BY call_time, filename
+        """,
+        (start, end),
+        name="replay_transcriptions",
+    )
+    write_jsonl(bundle / "transcriptions.jsonl", transcriptions)
+
+    exchanges = _day_exchanges(args.capture_dir, [(t["transcript"] or {}).get("raw") for t in transcriptions])
+    write_jsonl(bundle / "ai.jsonl", exchanges)
+
+    metrics = query_all(
+        f"SELECT call_id, {', '.join(FLAG_COLUMNS)} FROM metrics WHERE call_time >= %s AND call_time < %s ORDER BY call_id",
+        (start, end),
+        name="replay_flags",
+    )
+    write_jsonl(bundle / "metrics.jsonl", metrics)
+
+    report = report_records(build_practice_report(get_raw_on_date(d)))
+    (bundle / "report.json").write_text(json.dumps(report, indent=1))
+    (bundle / "sites.json").write_text(json.dumps([{"name": n, "aliases": a} for n, a in get_sites()], indent=1))
+
+    manifest = {
+        "date": d.isoformat(),
+        "captured_at": datetime.utcnow().isoformat(),
+        "csv": [p.name for p in sources],
+        "transcriptions": len(transcriptions),
+        "metrics": len(metrics),
+        "ai": {kind: sum(e["kind"] == kind for e in exchanges) for kind in ("chat", "transcription")},
+    }
+    (bundle / "manifest.json").write_text(json.dumps(manifest, indent=1))
+    print(json.dumps(manifest, indent=1))
+
+def _check_local_db(allow_remote):
+    from db_utils import get_db_config
+    host = get_db_config()["host"]
+    if not allow_remote and host not in LOCAL_HOSTS and not str(host).startswith("/"):
+        sys.exit(f"replay resets the day's rows; refusing POSTGRESQL_HOST={host} (use --allow-remote-db for a scratch DB)")
+
+def reset_day(d, transcriptions):
+    from psycopg2.extras import execute_values
+    from db_utils import get_conn
+    start, end = day_bounds(d)
+    with get_conn() as conn:
+        with conn.cursor() as cur:
+            for table in ("metrics", "raw_report_phones", "raw_report", "transcriptions"):
+                cur.execute(f"DELETE FROM {table} WHERE call_time >= %s AND call_time < %s", (start, end))
+            # seeded unmatched: the join stage claims them again
+            rows = [
+                (t["filename"], t["site"], t["phone_key"], json.dumps(t["transcript"], ensure_ascii=False),
+                 t["call_time"], t["duration_sec"], t["call_type"], t["score"], t["comment"])
+                for t in transcriptions
+            ]
+            if rows:
+                execute_values(cur, """
+                    INSERT INTO transcriptions (filename, site, phone_key, transcript, call_time, duration_sec, call_type, score, comment)
+                    VALUES %s
+                    ON CONFLICT (filename) DO UPDATE SET call_id = NULL, transcript = EXCLUDED.transcript, call_time = EXCLUDED.call_time
+                """, rows, page_size=1000)
+        conn.commit()
+
+def diff_report(recorded, replayed):
+    out = []
+    if recorded["columns"] != replayed["columns"]:
+        out.append({"row": "(columns)", "recorded": recorded["columns"], "replayed": replayed["columns"]})
+        return out
+    rec = {row[0]: row for row in recorded["rows"] if row[0]}
+    rep = {row[0]: row for row in replayed["rows"] if row[0]}
+    for label in list(rec) + [l for l in rep if l not in rec]:
+        a, b = rec.get(label), rep.get(label)
+        if a is None or b is None:
+            out.append({"row": label, "recorded": a, "replayed": b})
+            continue
+        for col, x, y in zip(recorded["columns"][1:], a[1:], b[1:]):
+            if x != y:
+                out.append({"row": label, "column": col, "recorded": x, "replayed": y})
+    return out
+
+def diff_flags(recorded, replayed):
+    rec = {r["call_id"]: r for r in recorded}
+    rep = {r["call_id"]: r for r in replayed}
+    counts = {"missing": len(rec.keys() - rep.keys()), "extra": len(rep.keys() - rec.keys())}
+    examples = []
+    for call_id in sorted(rec.keys() & rep.keys()):
+        for col in FLAG_COLUMNS:
+            if rec[call_id].get(col) != rep[call_id].get(col):
+                counts[col] = counts.get(col, 0) + 1
+                if len(examples) < 20:
+                    examples.append({"call_id": call_id, "column": col, "recorded": rec[call_id].get(col), "replayed": rep[call_id].get(col)})
+    return {k: v for k, v in counts.items() if v}, examples
+
+def run(args):
+    bundle = Path(args.bundle)
+    manifest = json.loads((bundle / "manifest.json").read_text())
+    d = date.fromisoformat(manifest["date"])
+    # before the pipeline modules load: the practice registry of the recorded day
+    os.environ["SITES_FILE"] = str(bundle / "sites.json")
+    _check_local_db(args.allow_remote_db)
+
+    from db_utils import query_all
+    from migrations import migrate_up
+    from replay_utils import recorder, read_exchanges, ReplayMiss
+    from profile_utils import profile_session, mark_stage
+    from index import process_csv
+    from join_utils import join_calls_at_date
+    from transcript_utils import generate_flags_from_transcripts
+    from report_utils import get_raw_on_date, build_practice_report
+
+    migrate_up()
+    reset_day(d, read_jsonl(bundle / "transcriptions.jsonl"))
+    recorder.load(read_exchanges(bundle / "ai.jsonl"), strict=args.strict)
+    files = [(p.name, p.read_bytes()) for p in sorted((bundle / "csv").glob("*.csv"))]
+
+    timings = {}
+    def stage(name, fn):
+        start = time.perf_counter()
+        out = fn()
+        timings[name] = time.perf_counter() - start
+        mark_stage(name)
+        print(f"{name:<8}{timings[name]:8.3f}s", file=sys.stderr)
+        return out
+
+    try:
+        with profile_session(f"replay-{d}", enabled=args.profile):
+            stage("csv", lambda: process_csv(files))
+            stage("join", lambda: join_calls_at_date(d))
+            stage("flags", lambda: generate_flags_from_transcripts(d))
+            report = stage("report", lambda: build_practice_report(get_raw_on_date(d)))
+    except ReplayMiss as e:
+        sys.exit(f"replay stopped (--strict): {e}")
+
+    start, end = day_bounds(d)
+    flags = query_all(
+        f"SELECT call_id, {', '.join(FLAG_COLUMNS)} FROM metrics WHERE call_time >= %s AND call_time < %s ORDER BY call_id",
+        (start, end),
+        name="replay_flags",
+    )
+    report_diff = diff_report(json.loads((bundle / "report.json").read_text()), report_records(report))
+    flag_counts, flag_examples = diff_flags(read_jsonl(bundle / "metrics.jsonl"), flags)
+    result = {
+        "date": d.isoformat(),
+        "stages": {k: round(v, 4) for k, v in timings.items()},
+        "total_sec": round(sum(timings.values()), 4),
+        "ai": {"replayed": recorder.hits, "missing": recorder.misses},
+        "report_diff": report_diff,
+        "flag_diff": flag_counts,
+        "flag_examples": flag_examples,
+    }
+
+    print(f"{'total':<8}{result['total_sec']:8.3f}s   ai replayed {recorder.hits}, missing {recorder.misses}")
+    if report_diff:
+        print(f"report: {len(report_diff)} differences")
+        for diff in report_diff:
+            where = f"{diff['row']} / {diff['column']}" if "column" in diff else diff["row"]
+            print(f"  {where}: {diff['recorded']} -> {diff['replayed']}")
+    else:
+        print("report: identical")
+    if flag_counts:
+        print("flags: " + ", ".join(f"{k}={v}" for k, v in flag_counts.items()))
+        for e in flag_examples:
+            print(f"  {e['call_id']} {e['column']}: {e['recorded']} -> {e['replayed']}")
+    else:
+        print("flags: identical")
+    if args.json:
+        Path(args.json).write_text(json.dumps(result, indent=1, default=str))
+    sys.exit(1 if report_diff or flag_counts or (args.strict and recorder.misses) else 0)
+
+def main():
+    parser = argparse.ArgumentParser(description="Record a production day into a bundle and replay it offline")
+    sub = parser.add_subparsers(dest="cmd", required=True)
+
+    p_capture = sub.add_parser("capture", help="write a day's inputs, AI exchanges and report to a bundle")
+    p_capture.add_argument("--date", required=True)
+    p_capture.add_argument("--bundle", required=True)
+    p_capture.add_argument("--csv", action="append", help="CSV export of the day (repeatable)")
+    p_capture.add_argument("--capture-dir", default=os.getenv("CAPTURE_DIR"), help="CAPTURE_DIR of the recording app")
+
+    p_run = sub.add_parser("run", help="replay a bundle against a local Postgres")
+    p_run.add_argument("--bundle", required=True)
+    p_run.add_argument("--strict", action="store_true", help="fail on a request without a recorded response")
+    p_run.add_argument("--profile", action="store_true", help="write a profile of the replay to PROFILE_DIR")
+    p_run.add_argument("--json", help="also write the result here")
+    p_run.add_argument("--allow-remote-db", action="store_true")
+    args = parser.parse_args()
+
+    if args.cmd == "capture":
+        capture(args)
+    else:
+        run(args)
+
+if __name__ == "__main__":
+    main()
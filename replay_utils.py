@@ -0,0 +1,86 @@
+import hashlib, json, os, threading, time
+from datetime import datetime
+from pathlib import Path
+from log_utils import get_logger, fields
+
+# Recording and replay of OpenAI exchanges for replay.py.
+#   CAPTURE_DIR=captures   the app appends every transcribe_one / detect_* API exchange to
+#                          CAPTURE_DIR/ai.jsonl and keeps a copy of each uploaded CSV in CAPTURE_DIR/csv/
+# Exchanges are keyed by a hash of the request (the full chat request, or model + audio bytes),
+# so a replay answers the same request with the recorded response. Off by default.
+CAPTURE_DIR = os.getenv("CAPTURE_DIR")
+
+# answers for requests the bundle has no recording for (non-strict replay)
+MISS_RESPONSES = {"chat": "false", "transcription": ""}
+
+logger = get_logger(__name__)
+
+class ReplayMiss(Exception):
+    pass
+
+def chat_key(request):
+    return hashlib.sha256(json.dumps(request, sort_keys=True).encode()).hexdigest()
+
+def audio_key(model, raw):
+    return hashlib.sha256(model.encode() + b"\0" + raw).hexdigest()
+
+class Recorder:
+    def __init__(self, capture_dir=None):
+        self.capture_dir = Path(capture_dir) if capture_dir else None
+        self.responses = None  # key -> response while replaying
+        self.strict = False
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+
+    def load(self, exchanges, strict=False):
+        self.responses = {e["key"]: e["response"] for e in exchanges}
+        self.strict = strict
+        self.hits = self.misses = 0
+
+    def replay(self, kind, key):
+        # the recorded response while replaying, None otherwise (the caller goes to the API)
+        if self.responses is None:
+            return None
+        with self._lock:
+            response = self.responses.get(key)
+            if response is not None:
+                self.hits += 1
+                return response
+            self.misses += 1
+        if self.strict:
+            raise ReplayMiss(f"no recorded {kind} response for {key[:12]}")
+        return MISS_RESPONSES[kind]
+
+    def record(self, kind, key, request, response):
+        if self.capture_dir is None:
+            return
+        line = json.dumps({"ts": time.time(), "kind": kind, "key": key, "request": request, "response": response})
+        with self._lock:
+            self.capture_dir.mkdir(parents=True, exist_ok=True)
+            with open(self.capture_dir / "ai.jsonl", "a") as f:
+                f.write(line + "\n")
+
+    def save_csv(self, files):
+        if self.capture_dir is None:
+            return
+        d = self.capture_dir / "csv"
+        d.mkdir(parents=True, exist_ok=True)
+        stamp = datetime.utcnow().strftime("%Y%m%d-%H%M%S")
+        for filename, data in files:
+            name = f"{stamp}-{hashlib.sha256(data).hexdigest()[:8]}-{Path(filename or 'upload.csv').name}"
+            (d / name).write_bytes(data)
+        logger.info("csv captured", extra=fields("capture", files=len(files), dir=str(d)))
+
+recorder = Recorder(CAPTURE_DIR)
+
+def read_exchanges(path):
+    # later recordings of the same request win
+    exchanges = {}
+    if Path(path).exists():
+        with open(path) as f:
+            for line in f:
+                if line.strip():
+                    e = json.loads(line)
+                    exchanges[e["key"]] = e
+    return list(exchanges.values())
@@ -1,60 +1,138 @@
 from datetime import datetime, timedelta, date
-import pandas as pd
-import numpy as np
 from db_utils import run_query
+from schema_utils import apply_schema, REPORT_RAW, FLAGS
 
 def day_bounds(d):
     start = datetime.combine(d, datetime.min.time())
     end = start + timedelta(days=1)
     return start, end
 
+# The SQL constants here are also what `migrations.py explain` checks the plans of.
+REPORT_COMPLETE_SQL = """
+    SELECT COUNT(*)
+    FROM metrics
+    WHERE is_proactive IS NOT NULL
+    AND call_time >= %s AND call_time < %s;
+"""
+
 def check_report_complete(d):
     start, end = day_bounds(d)
-    return run_query(
-        """
-            SELECT COUNT(*)
+    return run_query(REPORT_COMPLETE_SQL, (start, end), fetch_one=True, name="report_complete")
+
+COMPLETENESS_FIELDS = ["raw", "transcriptions", "matched", "metrics", "flagged"]
+COMPLETENESS_MAX_DAYS = 93
+
+def _range_bounds(start, end):
+    lo, _ = day_bounds(start)
+    _, hi = day_bounds(end)
+    return lo, hi
+
+def get_completeness(start, end):
+    # per day and practice: raw calls, transcriptions, matched transcriptions, metrics rows,
+    # flagged metrics rows. One grouped query per table; all of them range-scan call_time.
+    lo, hi = _range_bounds(start, end)
+    queries = {
+        "raw": """
+            SELECT r.call_time::date AS day, COALESCE(m.practice, 'unknown') AS practice, COUNT(*) AS raw
+            FROM raw_report AS r
+            LEFT JOIN metrics AS m
+              ON m.call_id = r.call_id AND m.call_time >= %s AND m.call_time < %s
+            WHERE r.call_time >= %s AND r.call_time < %s
+            GROUP BY 1, 2
+        """,
+        "transcriptions": """
+            SELECT call_time::date AS day, COALESCE(NULLIF(site, ''), 'unknown') AS practice,
+                   COUNT(*) AS transcriptions, COUNT(call_id) AS matched
+            FROM transcriptions
+            WHERE call_time >= %s AND call_time < %s
+            GROUP BY 1, 2
+        """,
+        "metrics": """
+            SELECT call_time::date AS day, COALESCE(practice, 'unknown') AS practice,
+                   COUNT(*) AS metrics, COUNT(*) FILTER (WHERE is_proactive IS NOT NULL) AS flagged
             FROM metrics
-            WHERE is_proactive IS NOT NULL
-            AND call_time >= %s AND call_time < %s;
+            WHERE call_time >= %s AND call_time < %s
+            GROUP BY 1, 2
         """,
-        (start, end),
-        fetch_one=True
-    )
+    }
+    params = {"raw": (lo, hi, lo, hi), "transcriptions": (lo, hi), "metrics": (lo, hi)}
+
+    days = {}
+    d = start
+    while d <= end:
+        days[d] = {"date": d.isoformat(), "totals": dict.fromkeys(COMPLETENESS_FIELDS, 0), "practices": {}}
+        d += timedelta(days=1)
 
-def get_raw_on_date(d):
+    for name, query in queries.items():
+        for row in run_query(query, params[name], fetch_all=True, name=f"completeness_{name}") or []:
+            day = days.get(row.pop("day"))
+            if day is None:
+                continue
+            counts = day["practices"].setdefault(row.pop("practice"), dict.fromkeys(COMPLETENESS_FIELDS, 0))
+            for field, value in row.items():
+                counts[field] += value
+                day["totals"][field] += value
+
+    for day in days.values():
+        t = day["totals"]
+        day["complete"] = t["flagged"] > 0 and t["flagged"] == t["metrics"] and t["metrics"] >= t["raw"]
+    return list(days.values())
+
+# transcript bodies are only fetched for the XLSX raw sheet; the report itself needs
+# just whether a call was recorded, which Postgres answers without detoasting the body
+REPORT_RAW_SQL = """
+    SELECT
+        m.call_id,
+        r.phone_key,
+        r.call_duration AS duration_sec,
+        m.call_time,
+        t.transcript IS NOT NULL AS has_transcript,
+        m.call_type,
+        m.practice,
+        m.is_answered,
+        m.is_proactive,
+        m.is_booked,
+        m.is_new_patient,
+        m.is_voicemail,
+        m.is_dropped,
+        r.is_redirected,
+        r.is_recalled,
+        r.recall_id
+    FROM metrics AS m
+    LEFT JOIN transcriptions AS t USING (call_id)
+    LEFT JOIN raw_report AS r
+      ON r.call_id = m.call_id AND r.call_time >= %s AND r.call_time < %s
+    WHERE m.call_time >= %s AND m.call_time < %s
+    ORDER BY m.call_time
+"""
+
+TRANSCRIPTS_BY_ID_SQL = "SELECT call_id, transcript FROM transcriptions WHERE call_id = ANY(%s)"
+
+def get_raw_on_date(d, include_transcripts=False):
+    import pandas as pd
     start, end = day_bounds(d)
-    raw = run_query(
-        """
-        SELECT
-            m.call_id,
-            r.phone_key,
-            r.call_duration AS duration_sec,
-            m.call_time,
-            t.transcript,
-            m.call_type,
-            m.practice,
-            m.is_answered,
-            m.is_proactive,
-            m.is_booked,
-            m.is_new_patient,
-            m.is_voicemail,
-            m.is_dropped,
-            r.is_redirected,
-            r.is_recalled,
-            r.recall_id
-        FROM metrics AS m
-        LEFT JOIN transcriptions AS t USING (call_id)
-        LEFT JOIN raw_report AS r USING (call_id)
-        WHERE m.call_time >= %s AND m.call_time < %s
-        ORDER BY m.call_time
-        """,
-        (start, end),
-        fetch_all=True
-    )
-    return pd.DataFrame(raw)
+    raw = run_query(REPORT_RAW_SQL, (start, end, start, end), fetch_all=True, name="report_raw")
+    raw_df = apply_schema(pd.DataFrame(raw), REPORT_RAW)
+    if include_transcripts and not raw_df.empty:
+        attach_transcripts(raw_df)
+    return raw_df
+
+def attach_transcripts(raw_df):
+    # replaces has_transcript with the transcript bodies, in the same column position
+    ids = raw_df.loc[raw_df["has_transcript"], "call_id"].dropna().unique().tolist()
+    rows = run_query(TRANSCRIPTS_BY_ID_SQL, (ids,), fetch_all=True, name="report_transcripts") if ids else []
+    bodies = {r["call_id"]: r["transcript"] for r in rows or []}
+    pos = raw_df.columns.get_loc("has_transcript")
+    transcripts = raw_df["call_id"].map(bodies).where(raw_df["has_transcript"], None)
+    raw_df.drop(columns="has_transcript", inplace=True)
+    raw_df.insert(pos, "transcript", transcripts)
 
 def build_practice_report(raw_df):
-    practices = sorted(raw_df['practice'].unique())
+    import pandas as pd
+    # only the columns the report reads, so the per-practice filters below copy less
+    recorded = raw_df['has_transcript'] if 'has_transcript' in raw_df else raw_df['transcript'].notna()
+    raw_df = raw_df[['practice', 'call_type', 'duration_sec'] + FLAGS].assign(has_transcript=recorded.fillna(False).astype(bool))
+    practices = sorted(raw_df['practice'].dropna().unique())
     
     # Helper to aggregate counts
     def agg_counts(df, conditions):
@@ -152,7 +230,7 @@ def build_practice_report(raw_df):
     report_rows.append(['Dropped/Unanswered (outbound)'] + agg_counts(outbound, 'is_dropped'))
 
     report_rows.append(['']) # Spacer row
-    recorded_outbound = outbound[outbound['transcript'].notna()]
+    recorded_outbound = outbound[outbound['has_transcript']]
     report_rows.append(['Outbound Recorded Calls'] + agg_counts(recorded_outbound, 'True'))
     report_rows.append(['Answered Calls (outbound recorded)'] + agg_counts(recorded_outbound, '~is_dropped & ~is_voicemail'))
     report_rows.append(['Voicemail (outbound recorded)'] + agg_counts(recorded_outbound, 'is_voicemail'))
@@ -0,0 +1,85 @@
+import os, re
+from metrics_utils import RULE_HITS
+
+# Fast local rule tier in front of the LLM classifiers. Each rule returns a verdict
+# with a confidence; detect_* only calls the LLM when no rule reaches RULE_MIN_CONFIDENCE.
+RULE_MIN_CONFIDENCE = float(os.getenv("RULE_MIN_CONFIDENCE", 0.9))
+SHORT_WORDS = int(os.getenv("RULE_SHORT_WORDS", 8))
+
+MAILBOX = re.compile(
+    r"(?:please )?leave (?:a|your) (?:message|name and number) (?:after|at) the"
+    r"|please leave (?:a|your) message"
+    r"|after the (?:tone|beep)"
+    r"|voice ?mail (?:service|box)"
+    r"|(?:am|'m|is|are) (?:unable|not able) to take your call"
+    r"|(?:is not|isn't) available to take your call"
+    r"|the person you are calling"
+    r"|record your message"
+    r"|mailbox (?:is full|of)",
+    re.IGNORECASE,
+)
+CLOSING = re.compile(
+    r"\b(?:bye|goodbye|thank you|thanks|see you|take care|cheers|have a (?:good|nice|lovely))\b",
+    re.IGNORECASE,
+)
+
+def _words(text):
+    return len(text.split())
+
+def _empty(text):
+    return not text.strip()
+
+def _short(text):
+    return 0 < _words(text) < SHORT_WORDS
+
+def _short_no_closing(text):
+    return _short(text) and not CLOSING.search(text)
+
+def _mailbox(text):
+    return bool(MAILBOX.search(text))
+
+# (rule name, predicate, verdict, confidence), checked in order
+RULES = {
+    "voicemail": [
+        ("empty", _empty, False, 0.95),
+        ("mailbox_prompt", _mailbox, True, 0.95),
+    ],
+    "proactive": [
+        ("empty", _empty, False, 0.99),
+        ("short", _short, False, 0.9),
+        ("mailbox_prompt", _mailbox, False, 0.9),
+    ],
+    "new_patient": [
+        ("empty", _empty, False, 0.99),
+        ("short", _short, False, 0.9),
+        ("mailbox_prompt", _mailbox, False, 0.9),
+    ],
+    "dropped": [
+        # the old hard-coded short-circuit in detect_dropped
+        ("long_transcript", lambda t: len(t) > 300, False, 1.0),
+        ("empty", _empty, True, 0.99),
+        ("mailbox_prompt", _mailbox, True, 0.9),
+        ("short_no_closing", _short_no_closing, True, 0.9),
+    ],
+    "booked": [
+        ("empty", _empty, False, 0.99),
+        ("short", _short, False, 0.95),
+        ("mailbox_prompt", _mailbox, False, 0.95),
+    ],
+}
+
+def evaluate_rules(classifier, transcript):
+    # first matching rule as (verdict, confidence, rule); (None, 0.0, None) if none match
+    text = transcript or ""
+    for name, predicate, verdict, confidence in RULES.get(classifier, []):
+        if predicate(text):
+            return verdict, confidence, name
+    return None, 0.0, None
+
+def rule_verdict(classifier, transcript):
+    verdict, confidence, rule = evaluate_rules(classifier, transcript)
+    if rule is None or confidence < RULE_MIN_CONFIDENCE:
+        RULE_HITS.labels(classifier, "llm").inc()
+        return None
+    RULE_HITS.labels(classifier, rule).inc()
+    return verdict
@@ -0,0 +1,90 @@
+import asyncio, heapq, itertools, time
+from collections import defaultdict
+from datetime import date
+
+# Orders queued transcription files across every running ZIP job:
+#   1. boosted dates, most recently boosted first
+#   2. then the most recent date (today's upload overtakes a historical backfill)
+#   3. within a date, practices take turns (fewest files handed out so far goes next)
+#   4. shortest recording first within a practice and between practices on the same turn,
+#      so the day completes sooner
+# Files without a parsable date go last. A boost lasts until that date's queue drains; a date
+# with nothing queued cannot be boosted.
+
+class TranscriptionScheduler:
+    def __init__(self):
+        self._queues = defaultdict(dict)  # date -> practice -> heap of (duration, seq, item)
+        self._served = defaultdict(int)   # (date, practice) -> files handed out
+        self._boosts = {}                 # date -> time boosted
+        self._seq = itertools.count()
+        self._available = asyncio.Event()
+        self.size = 0
+
+    def add(self, d, practice, duration, item):
+        heapq.heappush(self._queues[d].setdefault(practice, []), (duration, next(self._seq), item))
+        self.size += 1
+        self._available.set()
+
+    def boost(self, d):
+        # False when nothing is queued for d
+        if d not in self._queues:
+            return False
+        self._boosts[d] = time.time()
+        return True
+
+    def _next_date(self):
+        boosted = [d for d in self._queues if d in self._boosts]
+        if boosted:
+            return max(boosted, key=self._boosts.get)
+        return max(self._queues, key=lambda d: (d is not None, d or date.min))
+
+    def pop(self):
+        if not self.size:
+            return None
+        d = self._next_date()
+        practices = self._queues[d]
+        practice = min(practices, key=lambda p: (self._served[(d, p)], practices[p][0][0], p))
+        _, _, item = heapq.heappop(practices[practice])
+        self._served[(d, practice)] += 1
+        self.size -= 1
+
+        if not practices[practice]:
+            del practices[practice]
+        if not practices:
+            # date drained: forget its turn counters and boost
+            del self._queues[d]
+            self._boosts.pop(d, None)
+            for key in [k for k in self._served if k[0] == d]:
+                del self._served[key]
+        return item
+
+    async def get(self):
+        while True:
+            item = self.pop()
+            if item is not None:
+                return item
+            self._available.clear()
+            await self._available.wait()
+
+    def snapshot(self):
+        dates = sorted(self._queues, key=lambda d: (d is not None, d or date.min), reverse=True)
+        return {
+            "queued": self.size,
+            "boosted": [
+                {
+                    "date": str(d) if d else None,
+                    "queued": sum(len(h) for h in self._queues[d].values()),
+                    "since": round(self._boosts[d], 3),
+                }
+                for d in sorted(self._boosts, key=self._boosts.get, reverse=True)
+            ],
+            "dates": [
+                {
+                    "date": str(d) if d else None,
+                    "boosted": d in self._boosts,
+                    "practices": {p or "unknown": len(h) for p, h in sorted(self._queues[d].items())},
+                    "seconds": sum(duration for h in self._queues[d].values() for duration, _, _ in h),
+                }
+                for d in dates
+            ],
+        }
@@ -0,0 +1,115 @@
+import argparse, random, statistics, time
+from datetime import datetime, timedelta
+import pandas as pd
+from loadtest import SITES
+from report_utils import build_practice_report
+from schema_utils import apply_schema, memory_bytes, FLAGS, RAW_REPORT, REPORT_RAW, STRING
+
+# Object-typed vs schema-typed frames (schema_utils) on synthetic data shaped like a real day:
+#   report   get_raw_on_date rows -> build_practice_report, a practice x call_type groupby, flag masks
+#   csv      the per-call CSV aggregate -> the Phone Key / Direction masks of the recall search
+# Prints memory per frame and the median time of each operation.
+#
+#   python schema_bench.py --rows 20000 --repeat 5
+#   python schema_bench.py --null-rate 0.05     # some flags still NULL (object baseline cannot ~ them)
+
+def report_rows(n, null_rate):
+    start = datetime(2025, 8, 14, 8)
+    rows = []
+    for i in range(n):
+        flag = lambda p: None if random.random() < null_rate else random.random() < p
+        rows.append({
+            "call_id": f"c{i}",
+            "phone_key": random.randint(1000000, 9999999),
+            "duration_sec": random.randint(0, 900),
+            "call_time": start + timedelta(seconds=i * 3),
+            "has_transcript": random.random() < 0.6,
+            "call_type": random.choice(["inbound", "outbound"]),
+            "practice": random.choice(SITES),
+            "is_answered": flag(0.8), "is_proactive": flag(0.3), "is_booked": flag(0.2),
+            "is_new_patient": flag(0.1), "is_voicemail": flag(0.1), "is_dropped": flag(0.2),
+            "is_redirected": flag(0.1), "is_recalled": flag(0.1), "recall_id": None,
+        })
+    return rows
+
+def csv_frame(n):
+    # as process_csv builds it: Phone Key mixes 7-digit strings and 0, flags are plain bools
+    keys = [f"{random.randint(0, 9999999):07d}" for _ in range(n // 3)]
+    return pd.DataFrame({
+        "Call ID": [f"c{i}" for i in range(n)],
+        "Direction": [random.choice(["Inbound", "Outbound", "Inbound, Internal", "Outbound, Internal"]) for _ in range(n)],
+        "Status": [random.choice(["Answered", "Unanswered", "Answered, Redirected"]) for _ in range(n)],
+        "Duration": [random.randint(0, 900) for _ in range(n)],
+        "Phone Key": [random.choice(keys) if random.random() < 0.95 else 0 for _ in range(n)],
+        "Is Voicemail": [random.random() < 0.1 for _ in range(n)],
+        "Is Recalled": False,
+        "Recall Id": None,
+    })
+
+def timed(fn, repeat):
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        fn()
+        times.append(time.perf_counter() - start)
+    return statistics.median(times)
+
+def report_ops(df):
+    practices = sorted(df["practice"].dropna().unique())
+    return {
+        "build_practice_report": lambda: build_practice_report(df),
+        "groupby practice x type": lambda: df.groupby(["practice", "call_type"], observed=True)[FLAGS].sum(),
+        "flag masks": lambda: [
+            ((df["practice"] == p) & (df["call_type"] == "inbound") & df["is_answered"] & ~df["is_dropped"]).sum()
+            for p in practices
+        ],
+    }
+
+def csv_ops(df, keys):
+    return {
+        "recall masks": lambda: [
+            ((df["Phone Key"] == pk) & (df["Direction"].str.contains("Outbound", case=False, na=False) | (df["Duration"] > 10))).sum()
+            for pk in keys
+        ],
+    }
+
+def compare(name, before, after, ops_before, ops_after, repeat):
+    mb, ma = memory_bytes(before), memory_bytes(after)
+    print(f"{name}: {len(before)} rows")
+    print(f"  memory                    {mb / 1e6:8.2f} MB -> {ma / 1e6:8.2f} MB   (-{(1 - ma / mb) * 100:.0f}%)")
+    for op in ops_before:
+        try:
+            tb = timed(ops_before[op], repeat)
+        except TypeError as e:
+            tb = None
+            print(f"  {op:<25} object baseline failed: {e}")
+        ta = timed(ops_after[op], repeat)
+        if tb is not None:
+            print(f"  {op:<25} {tb * 1000:8.1f} ms -> {ta * 1000:8.1f} ms   (x{tb / ta:.1f})")
+
+def main():
+    parser = argparse.ArgumentParser(description="Memory and speed of schema-typed pipeline frames vs object dtypes")
+    parser.add_argument("--rows", type=int, default=20000)
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--null-rate", type=float, default=0.0, help="share of NULL flags in the report rows")
+    parser.add_argument("--recall-lookups", type=int, default=500, help="dropped calls searched for a recall")
+    parser.add_argument("--seed", type=int, default=1)
+    args = parser.parse_args()
+    random.seed(args.seed)
+    print(f"pandas {pd.__version__}, strings {STRING}")
+
+    rows = report_rows(args.rows, args.null_rate)
+    before = pd.DataFrame(rows)
+    after = apply_schema(pd.DataFrame(rows), REPORT_RAW)
+    compare("report", before, after, report_ops(before), report_ops(after), args.repeat)
+    if not args.null_rate:
+        same = build_practice_report(before).astype(str).equals(build_practice_report(after).astype(str))
+        print(f"  report identical          {same}")
+
+    before = csv_frame(args.rows)
+    keys = random.sample(list(before["Phone Key"]), args.recall_lookups)
+    after = apply_schema(before.assign(**{"Phone Key": before["Phone Key"].astype(str)}), RAW_REPORT)
+    compare("csv", before, after, csv_ops(before, keys), csv_ops(after, [str(k) for k in keys]), args.repeat)
+
+if __name__ == "__main__":
+    main()
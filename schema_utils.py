@@ -0,0 +1,85 @@
+import importlib.util
+
+# Column dtypes for the pipeline DataFrames, applied where rows enter pandas (query results and
+# the per-call CSV aggregate) instead of leaving everything as object:
+#   category         low-cardinality text (practice, call type, direction, status, site)
+#   boolean / Int64  flags and counts that can be NULL; `~flag` is a boolean NOT and NA counts
+#                    as neither True nor False (on an object column `~True` is the int -2)
+#   STRING           other text, Arrow-backed when pyarrow is installed
+# Columns a frame does not have are skipped, so one schema covers partial SELECTs.
+
+STRING = "string[pyarrow]" if importlib.util.find_spec("pyarrow") else "string"
+CALL_TYPES = ["inbound", "outbound", "internal"]
+CALL_TYPE = "call_type"  # categorical with the fixed CALL_TYPES categories
+
+FLAGS = ["is_answered", "is_proactive", "is_booked", "is_new_patient", "is_voicemail", "is_dropped",
+         "is_redirected", "is_recalled"]
+
+# process_csv: one row per call, before the recall search
+RAW_REPORT = {
+    "Call ID": STRING,
+    "From": STRING,
+    "Direction": "category",
+    "Status": "category",
+    "Call Activity Details": STRING,
+    "Duration": "Int64",
+    "Phone Key": STRING,
+    "Is Voicemail": "boolean",
+    "Is Dropped": "boolean",
+    "Is Redirected": "boolean",
+    "Is Recalled": "boolean",
+    "Recall Id": STRING,
+}
+
+# join_utils.get_joined_on_date: raw_report.* + the matched transcription
+JOINED = {
+    "call_id": STRING,
+    "call_from": STRING,
+    "call_direction": "category",
+    "call_status": "category",
+    "call_activity_details": STRING,
+    "recall_id": STRING,
+    "phone_key": "Int64",
+    "call_duration": "Int64",
+    "duration_sec": "Int64",
+    "filename": STRING,
+    "site": "category",
+    **dict.fromkeys(FLAGS, "boolean"),
+}
+
+# join_utils.build_core_metrics output
+METRICS_CORE = {
+    "call_id": STRING,
+    "duration_sec": "Int64",
+    "call_type": CALL_TYPE,
+    "is_answered": "boolean",
+    "practice": "category",
+}
+
+# report_utils.get_raw_on_date: input of build_practice_report and the "raw data" sheet
+REPORT_RAW = {
+    "call_id": STRING,
+    "phone_key": "Int64",
+    "duration_sec": "Int64",
+    "has_transcript": "boolean",
+    "call_type": CALL_TYPE,
+    "practice": "category",
+    "recall_id": STRING,
+    **dict.fromkeys(FLAGS, "boolean"),
+}
+
+def _dtype(name):
+    import pandas as pd
+    if name == CALL_TYPE:
+        return pd.CategoricalDtype(CALL_TYPES)
+    return name
+
+def apply_schema(df, schema):
+    # converts in place and returns df
+    for col, dtype in schema.items():
+        if col in df.columns:
+            df[col] = df[col].astype(_dtype(dtype))
+    return df
+
+def memory_bytes(df):
+    return int(df.memory_usage(deep=True).sum())
@@ -0,0 +1,88 @@
+import json, os, re
+from functools import lru_cache
+from log_utils import get_logger, fields
+
+# Practice registry. Sources, first one configured wins:
+#   SITES_FILE=sites.json   {"Cheadle": ["cheadle hulme"], "Heald Green": ["hg"]} or [{"name": ..., "aliases": [...]}]
+#   SITES_SOURCE=db         the `sites` table (see migrations.py)
+#   otherwise DEFAULT_SITES
+# Entries are listed in priority order: when a text mentions several sites, the earliest
+# entry wins. Matching ignores case and spaces.
+SITES_FILE = os.getenv("SITES_FILE")
+SITES_SOURCE = os.getenv("SITES_SOURCE", "default")
+
+# ordered so that the result matches the old per-site overwrite loop in build_core_metrics
+DEFAULT_SITES = [
+    ("Winsford", []),
+    ("Heckmondwike", []),
+    ("Middleton", []),
+    ("Heald Green", []),
+    ("Cheadle", []),
+]
+
+logger = get_logger(__name__)
+
+def _normalise(text):
+    return str(text).lower().replace(" ", "")
+
+def _from_file(path):
+    with open(path) as f:
+        data = json.load(f)
+    if isinstance(data, dict):
+        return [(name, list(aliases or [])) for name, aliases in data.items()]
+    return [(e["name"], list(e.get("aliases") or [])) for e in data]
+
+def _from_db():
+    from db_utils import query_all
+    rows = query_all("SELECT name, aliases FROM sites WHERE active ORDER BY priority, name", name="sites")
+    return [(r["name"], list(r["aliases"] or [])) for r in rows]
+
+@lru_cache(maxsize=1)
+def get_sites():
+    try:
+        if SITES_FILE:
+            sites = _from_file(SITES_FILE)
+        elif SITES_SOURCE == "db":
+            sites = _from_db()
+        else:
+            sites = DEFAULT_SITES
+    except Exception as e:
+        logger.error("site registry unavailable, using defaults", extra=fields("sites", error=repr(e)))
+        sites = DEFAULT_SITES
+    return sites or DEFAULT_SITES
+
+@lru_cache(maxsize=1)
+def _engine():
+    # one alternation over every normalised name and alias, longest first so that
+    # "healdgreen" is preferred over a shorter alias it contains
+    rank, names = {}, {}
+    for i, (name, aliases) in enumerate(get_sites()):
+        for term in [name, *aliases]:
+            key = _normalise(term)
+            if key and key not in rank:
+                rank[key] = i
+                names[key] = name
+    pattern = re.compile("|".join(re.escape(k) for k in sorted(rank, key=len, reverse=True)))
+    return pattern, rank, names
+
+def reload_sites():
+    get_sites.cache_clear()
+    _engine.cache_clear()
+
+def detect_site(text):
+    pattern, rank, names = _engine()
+    matches = pattern.findall(_normalise(text or ""))
+    return names[min(matches, key=rank.__getitem__)] if matches else None
+
+def detect_sites(texts: "pd.Series") -> "pd.Series":
+    import numpy as np
+    import pandas as pd
+
+    # single scan per row: normalise, find every registry term, keep the highest-priority site
+    pattern, rank, names = _engine()
+    found = texts.astype(str).str.lower().str.replace(" ", "", regex=False).str.findall(pattern)
+    best = rank.__getitem__
+    return pd.Series(
+        np.array([names[min(m, key=best)] if m else None for m in found], dtype=object),
+        index=texts.index,
+    )
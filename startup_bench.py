@@ -0,0 +1,121 @@
+import argparse, json, os, socket, statistics, subprocess, sys, time, urllib.error, urllib.request
+
+# Cold-start benchmark. Each run starts a fresh interpreter, so nothing is cached between runs.
+# It reports:
+#   import   seconds to `import index`, and which heavy libraries that pulled in
+#   ready    seconds from spawning uvicorn until --ready-path (/healthz) answers 200
+#   first    latency of the first request to each --path on the fresh server
+#
+#   python startup_bench.py --runs 5
+#   python startup_bench.py --check --max-import-sec 0.5    # exit 1 on regression (CI)
+
+HEAVY = ("pandas", "numpy", "openai", "openpyxl", "httpx")
+
+IMPORT_PROBE = f"""
+import json, sys, time
+t = time.perf_counter()
+import index
+print(json.dumps({{"seconds": time.perf_counter() - t, "heavy": [m for m in {HEAVY!r} if m in sys.modules]}}))
+"""
+
+def _env(args):
+    env = {**os.environ, "WARM_IMPORTS": "1" if args.warm else "0", "LOG_LEVEL": os.getenv("LOG_LEVEL", "WARNING")}
+    env.setdefault("OPENAI_API_KEY", "bench")
+    return env
+
+def measure_import(args):
+    out = subprocess.run(
+        [sys.executable, "-c", IMPORT_PROBE], capture_output=True, text=True, env=_env(args), check=True
+    ).stdout
+    return json.loads(out.strip().splitlines()[-1])
+
+def _free_port():
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+def _get(url, timeout):
+    start = time.perf_counter()
+    with urllib.request.urlopen(url, timeout=timeout) as r:
+        r.read()
+        return r.status, time.perf_counter() - start
+
+def measure_server(args):
+    port = _free_port()
+    base = f"http://127.0.0.1:{port}"
+    start = time.perf_counter()
+    proc = subprocess.Popen(
+        [sys.executable, "-m", "uvicorn", "index:app", "--host", "127.0.0.1", "--port", str(port)],
+        env=_env(args), stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL,
+    )
+    try:
+        while True:
+            if proc.poll() is not None:
+                raise RuntimeError("uvicorn exited during startup")
+            if time.perf_counter() - start > args.timeout:
+                raise RuntimeError(f"not ready after {args.timeout}s")
+            try:
+                if _get(base + args.ready_path, 1)[0] == 200:
+                    break
+            except (urllib.error.URLError, ConnectionError, OSError):
+                time.sleep(0.01)
+        ready = time.perf_counter() - start
+        first = {}
+        for path in args.path:
+            try:
+                status, seconds = _get(base + path, args.timeout)
+            except urllib.error.HTTPError as e:
+                status, seconds = e.code, None
+            first[path] = {"status": status, "seconds": seconds}
+        return ready, first
+    finally:
+        proc.terminate()
+        proc.wait(10)
+
+def _ms(values):
+    values = [v for v in values if v is not None]
+    if not values:
+        return "n/a"
+    return f"median {statistics.median(values) * 1000:7.1f} ms   max {max(values) * 1000:7.1f} ms"
+
+def main():
+    parser = argparse.ArgumentParser(description="Cold-start benchmark: import time, time to ready, first-request latency")
+    parser.add_argument("--runs", type=int, default=3)
+    parser.add_argument("--path", action="append", help="first-request paths (default: /healthz, /, /metrics)")
+    parser.add_argument("--warm", action="store_true", help="keep the post-startup import warm-up on (WARM_IMPORTS=1)")
+    parser.add_argument("--ready-path", default="/healthz", help="readiness probe (use / against builds without /healthz)")
+    parser.add_argument("--timeout", type=float, default=30)
+    parser.add_argument("--check", action="store_true", help="exit 1 if index imports a heavy library or is too slow")
+    parser.add_argument("--max-import-sec", type=float, default=1.0)
+    args = parser.parse_args()
+    args.path = args.path or ["/healthz", "/", "/metrics"]
+
+    imports, readies, firsts, heavy = [], [], {p: [] for p in args.path}, set()
+    for _ in range(args.runs):
+        probe = measure_import(args)
+        imports.append(probe["seconds"])
+        heavy.update(probe["heavy"])
+        ready, first = measure_server(args)
+        readies.append(ready)
+        for path, r in first.items():
+            firsts[path].append(r["seconds"])
+
+    print(f"runs            {args.runs}")
+    print(f"import index    {_ms(imports)}")
+    print(f"heavy at import {', '.join(sorted(heavy)) or 'none'}")
+    print(f"ready           {_ms(readies)}")
+    for path, values in firsts.items():
+        print(f"first {path:<10}{_ms(values)}")
+
+    if args.check:
+        problems = []
+        if heavy:
+            problems.append(f"index imports {', '.join(sorted(heavy))} at load")
+        if statistics.median(imports) > args.max_import_sec:
+            problems.append(f"import index took {statistics.median(imports):.3f}s > {args.max_import_sec}s")
+        for p in problems:
+            print(f"FAIL {p}")
+        sys.exit(1 if problems else 0)
+
+if __name__ == "__main__":
+    main()
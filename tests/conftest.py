@@ -0,0 +1,68 @@
+import os, sys, uuid
+from datetime import date
+from pathlib import Path
+import pytest
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+# Tests that need Postgres run against a scratch database on the configured server, which must be local:
+#   POSTGRESQL_HOST=127.0.0.1 POSTGRESQL_USER=postgres POSTGRESQL_SSLMODE=disable python -m pytest tests
+# They carry the "postgres" marker. Without a server they are skipped and the run ends with a
+# warning saying so; REQUIRE_POSTGRES=1 turns the skip into an error.
+LOCAL_HOSTS = {"localhost", "127.0.0.1", "::1"}
+DAY = date(2025, 8, 14)
+
+def pytest_configure(config):
+    config.addinivalue_line("markers", "postgres: needs a local Postgres (the scratch_db fixture)")
+
+def pytest_collection_modifyitems(config, items):
+    for item in items:
+        if "scratch_db" in getattr(item, "fixturenames", ()):
+            item.add_marker(pytest.mark.postgres)
+
+def pytest_terminal_summary(terminalreporter):
+    skipped = [r for r in terminalreporter.stats.get("skipped", []) if "postgres" in r.keywords]
+    if skipped:
+        terminalreporter.write_line(
+            f"{len(skipped)} postgres tests NOT run: {skipped[0].longrepr[2]}", yellow=True, bold=True,
+        )
+
+def _no_postgres(reason):
+    if os.getenv("REQUIRE_POSTGRES", "").lower() in {"1", "true", "yes"}:
+        pytest.fail(reason, pytrace=False)
+    pytest.skip(reason)
+
+@pytest.fixture(scope="session")
+def scratch_db():
+    import psycopg2
+    import migrations
+    from db_utils import get_conn, get_db_config
+    host = os.getenv("POSTGRESQL_HOST")
+    if host not in LOCAL_HOSTS and not str(host).startswith("/"):
+        _no_postgres("needs a local Postgres (POSTGRESQL_HOST)")
+    config = get_db_config()
+    name = f"calls_test_{uuid.uuid4().hex[:8]}"
+    try:
+        admin = psycopg2.connect(**{**config, "database": "postgres"})
+    except psycopg2.OperationalError as e:
+        _no_postgres(f"Postgres not reachable: {e}")
+    admin.autocommit = True
+    with admin.cursor() as cur:
+        cur.execute(f"CREATE DATABASE {name}")
+    previous = os.environ.get("POSTGRESQL_DATABASE")
+    os.environ["POSTGRESQL_DATABASE"] = name
+    try:
+        migrations.migrate_up()
+        with get_conn() as conn:
+            with conn.cursor() as cur:
+                for table in migrations.PARTITIONED:
+                    migrations.ensure_partitions(cur, table, DAY)
+        yield name
+    finally:
+        if previous is None:
+            os.environ.pop("POSTGRESQL_DATABASE", None)
+        else:
+            os.environ["POSTGRESQL_DATABASE"] = previous
+        with admin.cursor() as cur:
+            cur.execute(f"DROP DATABASE IF EXISTS {name} WITH (FORCE)")
+        admin.close()
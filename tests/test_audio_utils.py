@@ -0,0 +1,81 @@
+import warnings
+import numpy as np
+import pytest
+from audio_utils import mulaw_encode, decode_wav, encode_wav, MULAW_BIAS
+
+def mulaw_decode(code):
+    # reference G.711 decoder (ulaw2linear)
+    code = ~int(code) & 0xFF
+    exponent = (code >> 4) & 0x07
+    sample = (((code & 0x0F) << 3) + MULAW_BIAS << exponent) - MULAW_BIAS
+    return -sample if code & 0x80 else sample
+
+def encode_ints(samples):
+    return np.frombuffer(mulaw_encode(np.asarray(samples, dtype=np.float64) / 32767), dtype=np.uint8)
+
+def test_every_code_round_trips():
+    codes = [c for c in range(256) if c != 0x7F]  # 0x7F is negative zero, which encodes as 0xFF
+    decoded = [mulaw_decode(c) for c in codes]
+    assert list(encode_ints(decoded)) == codes
+
+def test_known_codes():
+    assert list(encode_ints([0, 1, -1, 32767, -32767, 32635, -32635])) == [0xFF, 0xFF, 0x7F, 0x80, 0x00, 0x80, 0x00]
+
+def test_quantisation_error_within_segment_step():
+    pcm = np.arange(-32767, 32768, 7)
+    decoded = np.array([mulaw_decode(c) for c in encode_ints(pcm)])
+    inside = np.abs(pcm) <= 32635
+    # each segment doubles the step, from 8 near zero to 1024 at the top
+    step = 8 << np.clip(np.log2(np.abs(pcm) + MULAW_BIAS).astype(int) - 7, 0, 7)
+    assert np.all(np.abs(decoded - pcm)[inside] <= step[inside])
+    assert np.all(np.abs(decoded[~inside]) == 32124)
+
+def test_matches_audioop_when_available():
+    with warnings.catch_warnings():
+        warnings.simplefilter("ignore", DeprecationWarning)
+        audioop = pytest.importorskip("audioop")
+    # audioop drops the two low bits before negating, which rounds negative samples one LSB
+    # differently at some segment edges; the positive half is the same transfer function
+    pcm = np.arange(0, 32768, 3).astype("<i2")
+    assert mulaw_encode(pcm.astype(np.float64) / 32767) == audioop.lin2ulaw(pcm.tobytes(), 2)
+
+def test_mulaw_wav_header():
+    x = np.sin(np.linspace(0, 100, 8000)).astype(np.float32) * 0.5
+    raw = encode_wav(x, 8000, "mulaw")
+    assert raw[:4] == b"RIFF" and raw[8:12] == b"WAVE"
+    assert int.from_bytes(raw[20:22], "little") == 7  # WAVE_FORMAT_MULAW
+    assert raw.endswith(mulaw_encode(x))
+
+def tone_wav(seconds, rate=8000):
+    t = np.arange(int(seconds * rate)) / rate
+    # speech-band tone with a quiet gap every 100s, so split_wav has somewhere to cut
+    x = (0.3 * np.sin(2 * np.pi * 440 * t) * ((t % 100) > 1)).astype(np.float32)
+    return x, rate
+
+def test_decode_mulaw_wav():
+    x, rate = tone_wav(2)
+    y, decoded_rate = decode_wav(encode_wav(x, rate, "mulaw"))
+    assert decoded_rate == rate and y.shape == (len(x), 1)
+    assert np.max(np.abs(y[:, 0] - x)) < 0.01
+
+def test_wav_seconds_reads_mulaw():
+    from audio_utils import wav_seconds
+    x, rate = tone_wav(3)
+    assert wav_seconds(encode_wav(x, rate, "mulaw")) == pytest.approx(3)
+    assert wav_seconds(encode_wav(x, rate)) == pytest.approx(3)
+    assert wav_seconds(b"not a wav") == 0
+
+def test_split_mulaw_upload(monkeypatch):
+    import audio_utils, ai_utils
+    monkeypatch.setattr(audio_utils, "AUDIO_ENCODING", "mulaw")
+    monkeypatch.setattr(audio_utils, "AUDIO_PREPROCESS", True)
+    monkeypatch.setattr(audio_utils, "VAD_ENABLED", False)
+    x, rate = tone_wav(400)
+    upload, stats = audio_utils.preprocess_wav(encode_wav(x, rate))
+    assert stats["processed"] and int.from_bytes(upload[20:22], "little") == audio_utils.WAVE_FORMAT_MULAW
+    assert ai_utils._audio_seconds(upload) == pytest.approx(400, abs=1)
+
+    chunks = audio_utils.split_wav(upload)
+    assert len(chunks) > 1
+    assert all(int.from_bytes(c[20:22], "little") == audio_utils.WAVE_FORMAT_MULAW for c in chunks)
+    assert sum(audio_utils.wav_seconds(c) for c in chunks) >= 400
@@ -0,0 +1,48 @@
+import pytest
+import batch_flags
+
+def make_job(calls):
+    return {
+        "id": "flags-test", "start": "2025-08-14", "end": "2025-08-14", "only_pending": True,
+        "status": "created", "skipped": {}, "phases": {},
+        "calls": {
+            call_id: {"call_type": call_type, "transcript_md5": "", "is_voicemail": False, "is_proactive": False,
+                      "is_new_patient": False, "is_dropped": None, "is_booked": False}
+            for call_id, call_type in calls.items()
+        },
+    }
+
+@pytest.fixture
+def offline(monkeypatch, tmp_path):
+    monkeypatch.setattr(batch_flags, "BATCH_DIR", tmp_path)
+    monkeypatch.setattr(batch_flags, "_texts", lambda job: {})
+    monkeypatch.setattr(batch_flags, "get_openai_client", lambda: pytest.fail("no batch should be sent"))
+    monkeypatch.setattr(batch_flags.time, "sleep", lambda s: pytest.fail("nothing to wait for"))
+    applied = []
+    def apply_job(job):
+        applied.append(dict(job["calls"]))
+        job["status"] = "applied"
+    monkeypatch.setattr(batch_flags, "apply_job", apply_job)
+    return applied
+
+def test_job_without_calls_is_applied(offline):
+    job = batch_flags.run(make_job({}))
+    assert job["status"] == "applied"
+    assert job["phases"]["1"]["batch_id"] is None and job["phases"]["2"]["batch_id"] is None
+    assert offline == [{}]
+
+def test_rules_decide_every_phase(offline, monkeypatch):
+    # phase 1 all decided by rules: outbound voicemail, so phase 2 has nothing to ask either
+    monkeypatch.setattr(batch_flags, "rule_verdict", lambda classifier, text: classifier == "voicemail")
+    job = batch_flags.run(make_job({"c1": "outbound", "c2": "outbound"}), wait=False)
+    assert job["status"] == "applied"
+    assert job["phases"]["1"]["decided_by_rules"] == 4
+    assert job["phases"]["2"]["requests"] == 0
+    assert all(c["is_voicemail"] for c in offline[0].values())
+
+def test_stuck_job_from_older_version_resumes(offline):
+    job = make_job({})
+    job["status"] = "phase1_submitted"
+    job["phases"]["1"] = {"requests": 0, "decided_by_rules": 0, "batch_id": None, "status": "completed"}
+    batch_flags.save_job(job)
+    assert batch_flags.run(batch_flags.load_job(job["id"]), wait=False)["status"] == "applied"
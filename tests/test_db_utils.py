@@ -0,0 +1,30 @@
+import pytest
+from db_utils import phone_suffixes, query_all, run_query
+from prometheus_client import REGISTRY
+
+@pytest.mark.parametrize("text, expected", [
+    ("07700900123 - 01612345678", {900123, 2345678, 345678}),
+    ("Answered (07700900123) (01612345678)", {900123, 2345678, 345678}),
+    ("Call 07700 900123 02:15", {900123}),
+    ("02:15 07700 900123", {900123}),
+    ("+44 (0)161 234 5678", {2345678, 345678}),
+    ("(0161) 234 5678", {2345678, 345678}),
+    ("0161-234-5678", {2345678, 345678}),
+    ("ref 123456", {123456}),
+    ("ext 1234", set()),
+    (None, set()),
+])
+def test_phone_suffixes(text, expected):
+    assert phone_suffixes(text) == expected
+
+def test_phone_suffixes_across_fields():
+    assert phone_suffixes("07700900123", "Redirected to 0161 234 5678") == {900123, 2345678, 345678}
+
+def _timed(name):
+    return REGISTRY.get_sample_value("db_query_seconds_count", {"helper": name}) or 0
+
+def test_queries_are_timed_under_their_name(scratch_db):
+    before = _timed("test_select")
+    assert query_all("SELECT 1 AS one", name="test_select") == [{"one": 1}]
+    assert run_query("SELECT 2 AS two", fetch_one=True, name="test_select") == {"two": 2}
+    assert _timed("test_select") == before + 2
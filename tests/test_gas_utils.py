@@ -0,0 +1,136 @@
+import asyncio
+import httpx
+import pytest
+import fake_gas
+import gas_utils
+from gas_utils import GasError, deliver, start_delivery, get_delivery
+
+REPORT = [{"": "Total Calls", "Cheadle": 22, "Total": 22}]
+
+@pytest.fixture
+def gas(monkeypatch):
+    monkeypatch.setattr(gas_utils, "GAS_URL", "http://fake-gas/exec")
+    monkeypatch.setattr(gas_utils, "GAS_RETRIES", 3)
+    monkeypatch.setattr(gas_utils, "GAS_BACKOFF_SEC", 0.001)
+    monkeypatch.setattr(fake_gas, "LATENCY_MS", 0)
+    monkeypatch.setattr(fake_gas, "ERROR_RATE", 0.0)
+    monkeypatch.setattr(fake_gas, "SCRIPT_ERROR_RATE", 0.0)
+    monkeypatch.setattr(fake_gas, "stats", {"requests": 0, "errors": 0, "script_errors": 0, "docs": 0})
+    monkeypatch.setattr(fake_gas, "failures", [])
+    # delivery state in a dict instead of gas_deliveries (test_delivery_state_in_db covers the table)
+    store = {}
+    monkeypatch.setattr(gas_utils, "_insert_delivery", lambda delivery_id, filename: store.__setitem__(delivery_id, {
+        "id": delivery_id, "filename": filename, "status": "pending", "doc_url": None, "error": None,
+        "created_at": 0.0, "finished_at": None, "stale": False}))
+    monkeypatch.setattr(gas_utils, "_update_delivery", lambda delivery_id, status, doc_url=None, error=None: store[delivery_id].update(
+        status=status, doc_url=doc_url, error=error))
+    monkeypatch.setattr(gas_utils, "_select_delivery", lambda delivery_id: dict(store[delivery_id]) if delivery_id in store else None)
+    delays = []
+    backoff = gas_utils._backoff
+    monkeypatch.setattr(gas_utils, "_backoff", lambda attempt, response=None: delays.append(backoff(attempt, response)) or delays[-1])
+    return delays
+
+def run(coro_fn, transport=None):
+    async def main():
+        gas_utils._client = httpx.AsyncClient(transport=transport or httpx.ASGITransport(app=fake_gas.app), follow_redirects=True)
+        try:
+            return await coro_fn()
+        finally:
+            await gas_utils.close_client()
+    return asyncio.run(main())
+
+def test_deliver(gas):
+    assert run(lambda: deliver(REPORT, "2025-08-14")) == "https://docs.google.com/spreadsheets/d/fake-2025-08-14"
+    assert fake_gas.stats["requests"] == 1
+    assert gas == []
+
+def test_retries_503_then_succeeds(gas):
+    fake_gas.failures.extend([(503, None)] * 2)
+    assert run(lambda: deliver(REPORT, "2025-08-14")).endswith("fake-2025-08-14")
+    assert fake_gas.stats["requests"] == 3
+    assert fake_gas.stats["docs"] == 1
+
+def test_429_honours_retry_after(gas):
+    fake_gas.failures.append((429, 0.05))
+    assert run(lambda: deliver(REPORT, "2025-08-14")).endswith("fake-2025-08-14")
+    assert gas == [0.05]
+
+def test_500_is_not_retried(gas):
+    fake_gas.failures.append((500, None))
+    with pytest.raises(GasError):
+        run(lambda: deliver(REPORT, "2025-08-14"))
+    assert fake_gas.stats["requests"] == 1
+
+def test_retries_exhausted(gas):
+    fake_gas.failures.extend([(503, None)] * 10)
+    with pytest.raises(GasError, match="HTTP 503"):
+        run(lambda: deliver(REPORT, "2025-08-14"))
+    assert fake_gas.stats["requests"] == gas_utils.GAS_RETRIES + 1
+    assert len(gas) == gas_utils.GAS_RETRIES
+
+def test_connect_error_is_retried(gas):
+    calls = []
+    def handler(request):
+        calls.append(request)
+        if len(calls) == 1:
+            raise httpx.ConnectError("refused", request=request)
+        return httpx.Response(200, json={"doc_url": "https://docs.google.com/spreadsheets/d/x"})
+    assert run(lambda: deliver(REPORT, "d"), httpx.MockTransport(handler)).endswith("/x")
+    assert len(calls) == 2
+
+def test_read_timeout_is_not_retried(gas):
+    calls = []
+    def handler(request):
+        calls.append(request)
+        raise httpx.ReadTimeout("no answer", request=request)
+    with pytest.raises(GasError, match="ReadTimeout"):
+        run(lambda: deliver(REPORT, "d"), httpx.MockTransport(handler))
+    assert len(calls) == 1
+
+def test_start_delivery(gas):
+    fake_gas.failures.append((503, None))
+    async def build_report():
+        return REPORT
+    async def go():
+        delivery_id = await start_delivery(build_report, "2025-08-14")
+        assert (await get_delivery(delivery_id))["status"] == "pending"
+        await gas_utils._tasks[delivery_id]
+        return await get_delivery(delivery_id)
+    state = run(go)
+    assert state["status"] == "done"
+    assert state["doc_url"].endswith("fake-2025-08-14")
+
+def test_start_delivery_failure(gas):
+    fake_gas.failures.extend([(503, None)] * 10)
+    async def build_report():
+        return REPORT
+    async def go():
+        delivery_id = await start_delivery(build_report, "2025-08-14")
+        await gas_utils._tasks[delivery_id]
+        return await get_delivery(delivery_id)
+    state = run(go)
+    assert state["status"] == "failed"
+    assert "HTTP 503" in state["error"]
+
+def test_delivery_state_in_db(scratch_db, monkeypatch):
+    # what another machine sees when it polls: the row, not this process's memory
+    monkeypatch.setattr(gas_utils, "GAS_URL", "http://fake-gas/exec")
+    monkeypatch.setattr(fake_gas, "LATENCY_MS", 0)
+    async def build_report():
+        return REPORT
+    async def go():
+        delivery_id = await start_delivery(build_report, "2025-08-14")
+        await gas_utils._tasks[delivery_id]
+        return await get_delivery(delivery_id)
+    state = run(go)
+    assert state["status"] == "done" and state["doc_url"].endswith("fake-2025-08-14")
+    assert state["finished_at"] >= state["created_at"] > 0
+    assert asyncio.run(get_delivery("0" * 32)) is None
+
+def test_unfinished_delivery_goes_stale(scratch_db, monkeypatch):
+    gas_utils._insert_delivery("f" * 32, "2025-08-14")
+    gas_utils._update_delivery("f" * 32, "delivering")
+    assert asyncio.run(get_delivery("f" * 32))["status"] == "delivering"
+    monkeypatch.setattr(gas_utils, "GAS_DELIVERY_STALE_SEC", -1)
+    state = asyncio.run(get_delivery("f" * 32))
+    assert state["status"] == "failed" and "did not finish" in state["error"]
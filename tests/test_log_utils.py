@@ -0,0 +1,20 @@
+import io, json, logging, queue
+from log_utils import JsonFormatter, _DroppingQueueHandler, fields
+
+def test_exception_survives_the_queue():
+    log_queue = queue.Queue()
+    logger = logging.getLogger("callreport-test.queue")
+    logger.propagate = False
+    logger.addHandler(_DroppingQueueHandler(log_queue))
+    try:
+        raise ValueError("bad row 7")
+    except ValueError:
+        logger.exception("insert failed for %s", "2025-08-14", extra=fields("db", rows=3))
+    out = io.StringIO()
+    handler = logging.StreamHandler(out)
+    handler.setFormatter(JsonFormatter())
+    handler.handle(log_queue.get_nowait())
+    entry = json.loads(out.getvalue())
+    assert entry["msg"] == "insert failed for 2025-08-14"
+    assert entry["exc"].startswith("Traceback") and "ValueError: bad row 7" in entry["exc"]
+    assert entry["stage"] == "db" and entry["rows"] == 3
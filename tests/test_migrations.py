@@ -0,0 +1,114 @@
+from datetime import datetime, timedelta
+import pandas as pd
+import pytest
+import migrations
+from conftest import DAY
+from db_utils import get_conn, insert_raw_report_df, phone_suffixes, query_all
+
+def raw_rows(calls):
+    return pd.DataFrame([{
+        "Call ID": call_id, "Call Time": call_time, "From": call_from, "Is Voicemail": False,
+        "Is Dropped": False, "Is Redirected": False, "Is Recalled": False, "Recall Id": None,
+        "Phone Key": "0", "Duration": 60, "Cost": 0.0, "Direction": "Inbound", "Status": "Answered",
+        "Call Activity Details": details,
+    } for call_id, call_time, call_from, details in calls])
+
+def execute(sql, params=None):
+    with get_conn() as conn:
+        with conn.cursor() as cur:
+            cur.execute(sql, params)
+
+def seed_day(n=200):
+    start = datetime.combine(DAY, datetime.min.time()) + timedelta(hours=8)
+    insert_raw_report_df(raw_rows([
+        (f"seed-{i}", start + timedelta(minutes=i), f"0770090{i:04d}", f"Answered (0161234{i:04d}) 02:15")
+        for i in range(n)
+    ]))
+    execute("""
+        INSERT INTO metrics (call_id, call_time, call_type, practice, duration_sec)
+        SELECT call_id, call_time, 'inbound', 'Cheadle', call_duration FROM raw_report
+        ON CONFLICT DO NOTHING
+    """)
+    execute("""
+        INSERT INTO transcriptions (filename, site, phone_key, transcript, call_time, call_id)
+        SELECT call_id || '.wav', 'Cheadle', 900000 + row_number() OVER (), '{"raw": "hello"}', call_time,
+               CASE WHEN random() < 0.5 THEN call_id END
+        FROM raw_report
+        ON CONFLICT DO NOTHING
+    """)
+    execute("ANALYZE")
+
+def test_migrate_up_is_idempotent(scratch_db):
+    applied, _ = migrations.migrate_up()
+    assert applied == []
+    assert [v for v, _, done in migrations.status() if not done] == []
+
+def test_explain_checks_pass(scratch_db):
+    seed_day()
+    results = migrations.explain_checks(DAY)
+    assert [name for name, _ in results] == [name for name, _, _, _ in migrations.explain_queries()]
+    assert {name: problems for name, problems in results if problems} == {}
+
+def test_explain_reports_unpruned_and_unindexed_queries(scratch_db):
+    problems = dict(migrations.explain_checks(DAY, [
+        ("unbounded_metrics", "metrics", "SELECT COUNT(*) FROM metrics WHERE is_proactive IS NULL", ()),
+        ("transcript_comment", None, "SELECT filename FROM transcriptions WHERE comment = 'x'", ()),
+    ]))
+    assert any("no partition pruning on metrics" in p for p in problems["unbounded_metrics"])
+    assert problems["transcript_comment"] == ["seq scan on transcriptions"]
+
+def test_call_id_stays_unique_across_call_times(scratch_db):
+    t = datetime.combine(DAY, datetime.min.time()) + timedelta(hours=9)
+    insert_raw_report_df(raw_rows([("dup-1", t, "07700900123", "Answered")]))
+    # the same call re-exported an hour off, next to a new call
+    insert_raw_report_df(raw_rows([("dup-1", t + timedelta(hours=1), "07700900123", "Answered"), ("dup-2", t, "01612345678", "Answered")]))
+    rows = query_all("SELECT call_id, call_time FROM raw_report WHERE call_id LIKE 'dup-%%' ORDER BY call_id")
+    assert rows == [{"call_id": "dup-1", "call_time": t}, {"call_id": "dup-2", "call_time": t}]
+    phones = query_all("SELECT call_id, call_time FROM raw_report_phones WHERE call_id = 'dup-1'")
+    assert phones == [{"call_id": "dup-1", "call_time": t}]
+
+def test_dedupe_call_ids_keeps_earliest(scratch_db):
+    t = datetime.combine(DAY, datetime.min.time()) + timedelta(hours=10)
+    execute("""
+        INSERT INTO raw_report (call_id, call_time, call_from, call_duration, call_direction, call_status, call_activity_details)
+        VALUES ('old-1', %s, '07700900123', 1, 'Inbound', 'Answered', ''), ('old-1', %s, '07700900123', 1, 'Inbound', 'Answered', '')
+    """, (t + timedelta(days=40), t))
+    execute("INSERT INTO raw_report_phones (call_id, call_time, suffix) VALUES ('old-1', %s, 900123)", (t + timedelta(days=40),))
+    with get_conn() as conn:
+        with conn.cursor() as cur:
+            migrations._dedupe_call_ids(cur)
+    assert query_all("SELECT call_time FROM raw_report WHERE call_id = 'old-1'") == [{"call_time": t}]
+    assert query_all("SELECT call_time FROM raw_report_phones WHERE call_id = 'old-1'") == [{"call_time": t}]
+
+def test_phone_backfill_matches_phone_suffixes(scratch_db):
+    texts = [
+        ("p-1", "07700900123 - 01612345678", "Answered (07700900123) (01612345678)"),
+        ("p-2", "Call 07700 900123 02:15", "+44 (0)161 234 5678"),
+        ("p-3", "(0161) 234 5678", "0161-234-5678 ext 12"),
+    ]
+    t = datetime.combine(DAY, datetime.min.time()) + timedelta(hours=11)
+    insert_raw_report_df(raw_rows([(call_id, t, call_from, details) for call_id, call_from, details in texts]))
+    with get_conn() as conn:
+        with conn.cursor() as cur:
+            migrations._rebuild_raw_report_phones(cur)
+            migrations._short_phone_suffixes(cur)
+    stored = {}
+    for r in query_all("SELECT call_id, suffix FROM raw_report_phones WHERE call_id LIKE 'p-%%'"):
+        stored.setdefault(r["call_id"], set()).add(r["suffix"])
+    assert stored == {call_id: phone_suffixes(call_from, details) for call_id, call_from, details in texts}
+
+def test_short_phone_key_matches(scratch_db):
+    from join_utils import match_calls_on_date
+    t = datetime.combine(DAY, datetime.min.time()) + timedelta(hours=13, minutes=5)
+    insert_raw_report_df(raw_rows([
+        ("short-1", t, "0161 234 567", "Answered"),
+        ("long-1", t + timedelta(minutes=20), "07700 765432", "Answered"),
+    ]))
+    # a 6-digit local number in the filename, and the usual 7-digit suffix
+    execute("""
+        INSERT INTO transcriptions (filename, site, phone_key, transcript, call_time)
+        VALUES ('short.wav', 'Cheadle', 234567, '{}', %s), ('long.wav', 'Cheadle', 765432, '{}', %s)
+    """, (t + timedelta(seconds=20), t + timedelta(minutes=20, seconds=5)))
+    matches = dict(match_calls_on_date(DAY)[["transcription_id", "raw_report_id"]].values)
+    assert matches["short.wav"] == "short-1"
+    assert matches["long.wav"] == "long-1"
@@ -0,0 +1,29 @@
+import asyncio
+import profile_utils
+from profile_utils import profile_session
+
+def test_overlapping_cprofile_sessions_fall_back_to_sampling(tmp_path, monkeypatch):
+    monkeypatch.setattr(profile_utils, "PROFILE_DIR", tmp_path)
+    monkeypatch.setattr(profile_utils, "PROFILE_MODE", "cprofile")
+    async def request(name, gate):
+        with profile_session(name) as session:
+            await gate.wait()
+            await asyncio.sleep(0.01)
+        return session.id
+    async def go():
+        gate = asyncio.Event()
+        first = asyncio.create_task(request("first", gate))
+        await asyncio.sleep(0)
+        second = asyncio.create_task(request("second", gate))
+        await asyncio.sleep(0)
+        gate.set()
+        return await first, await second
+    first, second = asyncio.run(go())
+    assert (tmp_path / f"{first}.prof").exists()
+    assert (tmp_path / f"{second}.folded").exists() and not (tmp_path / f"{second}.prof").exists()
+    assert "cProfile was busy" in (tmp_path / f"{second}.txt").read_text()
+    assert not profile_utils._cprofile_lock.locked()
+    # the lock is free again, so the next session gets cProfile
+    with profile_session("third") as third:
+        pass
+    assert (tmp_path / f"{third.id}.prof").exists()
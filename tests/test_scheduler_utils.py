@@ -0,0 +1,64 @@
+from datetime import date
+from fastapi.testclient import TestClient
+import index
+import zip_utils
+from scheduler_utils import TranscriptionScheduler
+
+D1, D2 = date(2025, 8, 13), date(2025, 8, 14)
+
+def queued(s):
+    out = []
+    while (item := s.pop()) is not None:
+        out.append(item)
+    return out
+
+def test_most_recent_date_first_then_turns_and_shortest():
+    s = TranscriptionScheduler()
+    s.add(D1, "Cheadle", 10, "old")
+    s.add(D2, "Cheadle", 30, "c-long")
+    s.add(D2, "Cheadle", 5, "c-short")
+    s.add(D2, "Winsford", 20, "w")
+    s.add(None, "Cheadle", 1, "undated")
+    assert queued(s) == ["c-short", "w", "c-long", "old", "undated"]
+
+def test_boost_goes_first_until_drained():
+    s = TranscriptionScheduler()
+    s.add(D1, "Cheadle", 10, "old-1")
+    s.add(D1, "Cheadle", 20, "old-2")
+    s.add(D2, "Cheadle", 10, "new")
+    assert s.boost(D1)
+    assert s.snapshot()["boosted"][0]["date"] == str(D1)
+    assert [s.pop(), s.pop()] == ["old-1", "old-2"]
+    assert s.snapshot()["boosted"] == []
+    # the boost ended with the queue, so later files of that date wait their turn again
+    s.add(D1, "Cheadle", 1, "old-3")
+    assert queued(s) == ["new", "old-3"]
+
+def test_boost_without_queued_files_is_refused():
+    s = TranscriptionScheduler()
+    s.add(D2, "Cheadle", 10, "new")
+    assert not s.boost(D1)
+    s.add(D1, "Cheadle", 10, "old")
+    assert queued(s) == ["new", "old"]
+    assert s.snapshot()["boosted"] == []
+
+def test_snapshot_lists_pending_boosts():
+    s = TranscriptionScheduler()
+    s.add(D1, "Cheadle", 10, "a")
+    s.add(D1, "Winsford", 10, "b")
+    s.add(D2, "Cheadle", 10, "c")
+    s.boost(D1)
+    snap = s.snapshot()
+    assert [(b["date"], b["queued"]) for b in snap["boosted"]] == [(str(D1), 2)]
+    assert [(e["date"], e["boosted"]) for e in snap["dates"]] == [(str(D2), False), (str(D1), True)]
+
+def test_boost_endpoint(monkeypatch):
+    s = TranscriptionScheduler()
+    s.add(D1, "Cheadle", 10, "a")
+    monkeypatch.setattr(zip_utils, "scheduler", s)
+    client = TestClient(index.app)
+    assert client.post("/transcription/boost", data={"report_date": str(D2)}).status_code == 404
+    res = client.post("/transcription/boost", data={"report_date": str(D1)})
+    assert res.status_code == 200
+    assert res.json()["boosted"][0]["date"] == str(D1)
+    assert client.post("/transcription/boost", data={"report_date": "14/08/2025"}).status_code == 400
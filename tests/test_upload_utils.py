@@ -0,0 +1,34 @@
+import hashlib
+import pytest
+from fastapi.testclient import TestClient
+import index
+import upload_utils
+
+@pytest.fixture
+def client(monkeypatch, tmp_path):
+    monkeypatch.setattr(upload_utils, "UPLOAD_DIR", tmp_path)
+    monkeypatch.setattr(upload_utils, "MACHINE_ID", "m1a2b3")
+    monkeypatch.setattr(index, "process_csv", lambda files: {"csv": [(name, len(data)) for name, data in files]})
+    return TestClient(index.app)
+
+def test_resumable_csv_upload(client):
+    data = b"Call ID,From\n" + b"1,07700900123\n" * 1000
+    res = client.post("/uploads", json={"kind": "csv", "filename": "day.csv", "size": len(data),
+                                        "sha256": hashlib.sha256(data).hexdigest(), "chunk_size": 4096})
+    session = res.json()
+    assert session["id"].endswith("-m1a2b3")
+    for offset in reversed(session["missing_offsets"]):
+        assert client.put(f"/uploads/{session['id']}?offset={offset}", content=data[offset:offset + 4096]).status_code == 200
+    assert client.get(f"/uploads/{session['id']}").json()["missing_offsets"] == []
+    assert client.post(f"/uploads/{session['id']}/finalize").json() == {"csv": [["day.csv", len(data)]]}
+
+def test_session_of_another_machine_is_replayed(client):
+    other = "0" * 32 + "-ffff00"
+    for res in (client.get(f"/uploads/{other}"), client.put(f"/uploads/{other}?offset=0", content=b"x"),
+                client.post(f"/uploads/{other}/finalize")):
+        assert res.status_code == 409
+        assert res.headers["fly-replay"] == "instance=ffff00"
+
+def test_unknown_session(client):
+    assert client.get(f"/uploads/{'0' * 32}-m1a2b3").status_code == 404
+    assert client.get("/uploads/../etc").status_code == 404
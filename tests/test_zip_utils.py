@@ -0,0 +1,33 @@
+import pytest
+from fastapi.testclient import TestClient
+import index
+import zip_utils
+from zip_utils import get_missing_calls
+
+def test_missing_calls_skip_existing_and_in_flight(monkeypatch):
+    monkeypatch.setattr(zip_utils, "_in_flight", {"b.wav"})
+    assert get_missing_calls(["a.wav", "b.wav", "c.wav", "c.wav"], {"a.wav"}) == ["c.wav"]
+
+@pytest.fixture
+def client(monkeypatch):
+    monkeypatch.setattr(index, "get_existing_calls", lambda names: {"a.wav"})
+    monkeypatch.setattr(zip_utils, "_in_flight", set())
+    return TestClient(index.app)
+
+def test_upload_manifest(client):
+    res = client.post("/upload_manifest", json={"files": [{"name": "a.wav", "size": 10}, {"name": "dir/b.wav", "size": "20"}, "c.wav", "notes.txt"]})
+    assert res.status_code == 200
+    assert res.json() == {"files": 3, "missing": ["b.wav", "c.wav"], "missing_bytes": 20}
+
+@pytest.mark.parametrize("size", ["big", [1], {"n": 1}, "1.5"])
+def test_upload_manifest_rejects_bad_size(client, size):
+    res = client.post("/upload_manifest", json={"files": [{"name": "a.wav", "size": size}]})
+    assert res.status_code == 400
+
+def test_transcription_runs_on_its_own_threads(monkeypatch):
+    import asyncio, threading
+    import ai_utils
+    monkeypatch.setattr(ai_utils, "transcribe_one", lambda chunk: {"raw": threading.current_thread().name})
+    tr, mode, _, chunks = asyncio.run(zip_utils._transcribe(b"not a wav", 1))
+    assert (mode, chunks) == ("single", 1)
+    assert tr["raw"].startswith("transcribe")
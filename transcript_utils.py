@@ -1,95 +1,78 @@
+import asyncio, os
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime, timedelta, date
 import pandas as pd
 import numpy as np
 from db_utils import run_query, update_metrics_with_flags
-from ai_utils import detect_voicemail, detect_proactive, detect_new_patient, detect_dropped, detect_booked
+from ai_utils import detect_voicemail, detect_proactive, detect_new_patient, detect_dropped, detect_booked, is_skipped_transcript
+from metrics_utils import PIPELINE_STAGE_SECONDS
+
+# classifier calls in flight at once while flagging a date
+CLASSIFY_CONCURRENCY = int(os.getenv("CLASSIFY_CONCURRENCY", 8))
 
 def day_bounds(d):
     start = datetime.combine(d, datetime.min.time())
     end = start + timedelta(days=1)
     return start, end
 
-def get_transcriptions_on_date(d):
-    start, end = day_bounds(d)
-    return run_query(
-        """
-        SELECT
-        t.*,
-        m.call_type
-        FROM transcriptions AS t
-        JOIN metrics AS m
-        USING (call_id)
-        WHERE m.call_time >= %s AND m.call_time < %s
-        ORDER BY call_time
-        """,
-        (start, end),
-        fetch_all=True
-    )
-
-def get_unrecorded_on_date(d):
-    start, end = day_bounds(d)
-    return run_query(
-        """
-        SELECT 
-            m.call_id,
-            r.call_duration,
-            r.is_voicemail,
-            r.is_dropped,
-            r.is_redirected
-        FROM metrics AS m
-        JOIN raw_report AS r 
-          ON m.call_id = r.call_id
-        WHERE m.call_time >= %s AND m.call_time < %s
-        AND m.is_proactive IS NULL
-        ORDER BY m.call_time
-        """,
-        (start, end),
-        fetch_all=True
-    )
-
-def generate_flags_from_transcripts(d):
-    tr = pd.DataFrame(get_transcriptions_on_date(d))
-    outbound = tr.loc[tr["call_type"] == "outbound", ["call_id", "call_type", "transcript"]].copy()
-    inbound  = tr.loc[tr["call_type"] == "inbound",  ["call_id", "call_type", "transcript"]].copy()
-    outbound["is_new_patient"] = False
-    inbound["is_voicemail"] = False
-    inbound["is_proactive"] = False
-
-    # find voicemails
-    outbound["is_voicemail"] = outbound["transcript"].apply(
-        lambda di: detect_voicemail(di["raw"])
-    )
-
-    # only run detect_proactive where voicemail == False
-    mask = outbound["is_voicemail"] == False
-    outbound["is_proactive"] = False
-    outbound.loc[mask, "is_proactive"] = outbound.loc[mask, "transcript"].apply(
-        lambda di: detect_proactive(di["raw"])
-    )
-
-    # find new patients
-    inbound["is_new_patient"] = inbound["transcript"].apply(
-        lambda di: detect_new_patient(di["raw"])
-    )
+# metrics rows that still need classifying: never flagged, flagged from the raw report
+# before their transcript was matched, or flagged against a different transcript
+PENDING_FLAGS_SQL = """(
+    m.is_proactive IS NULL
+    OR m.flags_transcript_md5 IS DISTINCT FROM md5(t.transcript::text)
+)"""
 
+# TRANSCRIPTIONS_SQL and UNRECORDED_SQL are also what `migrations.py explain` checks the plans of
+TRANSCRIPTIONS_SQL = """
+    SELECT
+    t.*,
+    md5(t.transcript::text) AS transcript_md5,
+    m.call_type
+    FROM transcriptions AS t
+    JOIN metrics AS m
+    USING (call_id)
+    WHERE m.call_time >= %s AND m.call_time < %s
+    AND m.call_type IN ('inbound', 'outbound')
+    {pending}
+    ORDER BY call_time
+"""
 
-    calls = pd.concat([outbound, inbound], ignore_index=True)
+UNRECORDED_SQL = """
+    SELECT 
+        m.call_id,
+        r.call_duration,
+        r.is_voicemail,
+        r.is_dropped,
+        r.is_redirected
+    FROM metrics AS m
+    JOIN raw_report AS r 
+      ON m.call_id = r.call_id AND r.call_time >= %s AND r.call_time < %s
+    WHERE m.call_time >= %s AND m.call_time < %s
+    AND m.is_proactive IS NULL
+    ORDER BY m.call_time
+"""
 
-    # find dropped calls
-    calls["is_dropped"] = calls["transcript"].apply(
-        lambda di: detect_dropped(di["raw"])
-    )
+def get_transcriptions_on_date(d, only_pending=True):
+    start, end = day_bounds(d)
+    pending = "AND " + PENDING_FLAGS_SQL if only_pending else ""
+    return run_query(TRANSCRIPTIONS_SQL.format(pending=pending), (start, end), fetch_all=True, name="transcriptions_on_date")
 
-    # find calls leading to booking from not dropped and not voicemail
-    calls["is_booked"] = False
-    eligible = (~calls["is_voicemail"]) & (~calls["is_dropped"])
-    calls.loc[eligible, "is_booked"] = calls.loc[eligible, "transcript"].apply(
-        lambda di: detect_booked(di["raw"])
-    )
+def get_unrecorded_on_date(d):
+    start, end = day_bounds(d)
+    return run_query(UNRECORDED_SQL, (start, end, start, end), fetch_all=True, name="unrecorded_on_date")
 
-    update_metrics_with_flags(calls)
+def split_skipped(tr: pd.DataFrame):
+    # recordings the signal analyser found empty get fixed flags, no API calls
+    skipped_mask = tr["transcript"].apply(is_skipped_transcript).astype(bool)
+    skipped = tr.loc[skipped_mask, ["call_id", "call_type", "transcript", "transcript_md5"]].copy()
+    skipped["is_voicemail"] = False
+    skipped["is_proactive"] = False
+    skipped["is_new_patient"] = False
+    skipped["is_dropped"] = True
+    skipped["is_booked"] = False
+    return skipped, tr.loc[~skipped_mask]
 
-    # fill the rest for current date
+def fill_unrecorded_on_date(d):
     unrecorded = get_unrecorded_on_date(d)
     columns = ['call_id', 'is_voicemail', 'is_dropped', 'is_redirected']
     unrecorded = pd.DataFrame(unrecorded, columns=columns)
@@ -98,6 +81,58 @@ def generate_flags_from_transcripts(d):
     unrecorded["is_proactive"] = False
     update_metrics_with_flags(unrecorded)
 
-# d = date(2025, 8, 12)
-# generate_flags_from_transcripts(d)
-# print(len(get_unrecorded_on_date(d)))
\ No newline at end of file
+async def _classify_calls(calls: pd.DataFrame):
+    # per-transcript task graph: voicemail gates proactive, voicemail + dropped gate booked;
+    # everything independent runs concurrently, at most CLASSIFY_CONCURRENCY calls in flight
+    loop = asyncio.get_running_loop()
+    executor = ThreadPoolExecutor(max_workers=CLASSIFY_CONCURRENCY, thread_name_prefix="classify")
+
+    def run(detect, text):
+        return loop.run_in_executor(executor, detect, text)
+
+    async def one(call_type, text):
+        if call_type == "outbound":
+            is_voicemail, is_dropped = await asyncio.gather(run(detect_voicemail, text), run(detect_dropped, text))
+            proactive = run(detect_proactive, text) if not is_voicemail else None
+            is_new_patient = False
+        else:
+            is_new_patient, is_dropped = await asyncio.gather(run(detect_new_patient, text), run(detect_dropped, text))
+            is_voicemail = False
+            proactive = None
+
+        booked = run(detect_booked, text) if not is_voicemail and not is_dropped else None
+        is_proactive = await proactive if proactive is not None else False
+        is_booked = await booked if booked is not None else False
+        return is_voicemail, is_proactive, is_new_patient, is_dropped, is_booked
+
+    try:
+        return await asyncio.gather(*(
+            one(call_type, di["raw"]) for call_type, di in zip(calls["call_type"], calls["transcript"])
+        ))
+    finally:
+        executor.shutdown(wait=False, cancel_futures=True)
+
+@PIPELINE_STAGE_SECONDS.labels("flags").time()
+def generate_flags_from_transcripts(d, only_pending=True):
+    # only_pending=False re-classifies every transcript of the day (e.g. after a prompt change)
+    tr = pd.DataFrame(get_transcriptions_on_date(d, only_pending=only_pending))
+    if tr.empty:
+        fill_unrecorded_on_date(d)
+        return
+    skipped, tr = split_skipped(tr)
+
+    # outbound first, then inbound, as the flags were always written
+    cols = ["call_id", "call_type", "transcript", "transcript_md5"]
+    outbound = tr.loc[tr["call_type"] == "outbound", cols]
+    inbound  = tr.loc[tr["call_type"] == "inbound",  cols]
+    calls = pd.concat([outbound, inbound], ignore_index=True)
+
+    flags = ["is_voicemail", "is_proactive", "is_new_patient", "is_dropped", "is_booked"]
+    results = asyncio.run(_classify_calls(calls)) if len(calls) else []
+    calls[flags] = pd.DataFrame(results, columns=flags, dtype=bool)
+
+    calls = pd.concat([calls, skipped], ignore_index=True)
+    update_metrics_with_flags(calls)
+
+    # fill the rest for current date
+    fill_unrecorded_on_date(d)
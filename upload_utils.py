@@ -0,0 +1,204 @@
+import asyncio, hashlib, json, os, re, shutil, tempfile, threading, time, uuid
+from pathlib import Path
+from log_utils import get_logger, fields
+
+# Resumable uploads for large ZIPs and CSVs:
+#   POST /uploads                      {"kind": "zip"|"csv", "filename", "size", "sha256"?} -> session
+#   PUT  /uploads/{id}?offset=N        one chunk, at a multiple of chunk_size; any order, in parallel,
+#                                      repeatable. X-Chunk-Sha256 is checked when sent.
+#   GET  /uploads/{id}                 received bytes and the offsets still missing (to resume)
+#   POST /uploads/{id}/finalize        all chunks present + whole-file sha256 -> ZIP/CSV pipeline
+# Sessions live on the local disk of the machine that created them, under UPLOAD_DIR (data
+# file + meta.json), so a dropped connection or a process restart only costs the chunks in
+# flight. On Fly the session id ends in that machine's FLY_MACHINE_ID; the form pins its
+# requests there with fly-force-instance-id, and a request that lands on another machine is
+# answered with fly-replay (UploadElsewhere). Fly resets the root filesystem when a machine
+# restarts or is redeployed, so sessions only outlive that with UPLOAD_DIR on a mounted volume.
+UPLOAD_DIR = Path(os.getenv("UPLOAD_DIR", "/tmp/uploads"))
+UPLOAD_CHUNK_BYTES = int(os.getenv("UPLOAD_CHUNK_BYTES", 8 * 1024 * 1024))
+UPLOAD_MAX_BYTES = int(os.getenv("UPLOAD_MAX_BYTES", 2 * 1024 ** 3))
+UPLOAD_SESSION_TTL_SEC = float(os.getenv("UPLOAD_SESSION_TTL_SEC", 24 * 3600))
+MACHINE_ID = os.getenv("FLY_MACHINE_ID")
+
+KINDS = {"zip": ".zip", "csv": ".csv"}
+SESSION_ID_RE = re.compile(r"^[0-9a-f]{32}(-[0-9a-z]+)?$")
+
+logger = get_logger(__name__)
+
+class UploadError(Exception):
+    status_code = 400
+
+class UploadNotFound(UploadError):
+    status_code = 404
+
+class UploadConflict(UploadError):
+    status_code = 409
+
+class UploadElsewhere(UploadError):
+    # the session is on another machine; the caller answers with fly-replay to it
+    status_code = 409
+
+    def __init__(self, machine):
+        super().__init__(f"upload session is on machine {machine}")
+        self.machine = machine
+
+_locks = {}
+_locks_guard = threading.Lock()
+
+def _dir(upload_id):
+    if not SESSION_ID_RE.match(upload_id or ""):
+        raise UploadNotFound("Unknown upload id")
+    machine = upload_id.partition("-")[2]
+    if machine and MACHINE_ID and machine != MACHINE_ID:
+        raise UploadElsewhere(machine)
+    return UPLOAD_DIR / upload_id
+
+def _load(upload_id):
+    try:
+        with open(_dir(upload_id) / "meta.json") as f:
+            return json.load(f)
+    except FileNotFoundError:
+        raise UploadNotFound("Unknown upload id")
+
+def _save(meta):
+    path = _dir(meta["id"]) / "meta.json"
+    tmp = path.with_suffix(".tmp")
+    with open(tmp, "w") as f:
+        json.dump(meta, f)
+    os.replace(tmp, path)
+
+def _lock(upload_id):
+    # guards meta.json only; held without awaiting
+    with _locks_guard:
+        return _locks.setdefault(upload_id, threading.Lock())
+
+def _n_chunks(meta):
+    return max(1, -(-meta["size"] // meta["chunk_size"]))
+
+def status(meta):
+    received = set(meta["received"])
+    n = _n_chunks(meta)
+    return {
+        "id": meta["id"],
+        "kind": meta["kind"],
+        "filename": meta["filename"],
+        "size": meta["size"],
+        "chunk_size": meta["chunk_size"],
+        "received_bytes": sum(min(meta["chunk_size"], meta["size"] - i * meta["chunk_size"]) for i in received),
+        "missing_offsets": [i * meta["chunk_size"] for i in range(n) if i not in received],
+        "state": meta["state"],
+    }
+
+def prune_sessions():
+    if not UPLOAD_DIR.exists():
+        return
+    cutoff = time.time() - UPLOAD_SESSION_TTL_SEC
+    for d in UPLOAD_DIR.iterdir():
+        try:
+            if d.is_dir() and d.stat().st_mtime < cutoff:
+                shutil.rmtree(d, ignore_errors=True)
+                _locks.pop(d.name, None)
+        except FileNotFoundError:
+            pass
+
+def create_session(kind, filename, size, sha256=None, chunk_size=None):
+    if kind not in KINDS:
+        raise UploadError(f"kind must be one of {sorted(KINDS)}")
+    filename = Path(str(filename or "")).name
+    if not filename.lower().endswith(KINDS[kind]):
+        raise UploadError(f"{kind} upload must be a {KINDS[kind]} file")
+    if not isinstance(size, int) or size <= 0 or size > UPLOAD_MAX_BYTES:
+        raise UploadError(f"size must be 1..{UPLOAD_MAX_BYTES} bytes")
+    if sha256 is not None and not re.fullmatch(r"[0-9a-fA-F]{64}", str(sha256)):
+        raise UploadError("sha256 must be 64 hex characters")
+    chunk_size = min(int(chunk_size or UPLOAD_CHUNK_BYTES), UPLOAD_CHUNK_BYTES)
+    if chunk_size <= 0:
+        raise UploadError("chunk_size must be positive")
+
+    prune_sessions()
+    upload_id = uuid.uuid4().hex + (f"-{MACHINE_ID}" if MACHINE_ID else "")
+    d = UPLOAD_DIR / upload_id
+    d.mkdir(parents=True)
+    with open(d / "data", "wb") as f:
+        f.truncate(size)
+    meta = {
+        "id": upload_id, "kind": kind, "filename": filename, "size": size,
+        "sha256": sha256.lower() if sha256 else None, "chunk_size": chunk_size,
+        "received": [], "state": "open", "created_at": time.time(),
+    }
+    _save(meta)
+    logger.info("upload session created", extra=fields("upload", upload_id=upload_id, kind=kind, filename=filename, size=size))
+    return status(meta)
+
+def get_status(upload_id):
+    return status(_load(upload_id))
+
+def _write(path, offset, data, chunk_sha256):
+    if chunk_sha256 and hashlib.sha256(data).hexdigest() != chunk_sha256.lower():
+        raise UploadError("chunk sha256 mismatch")
+    try:
+        fd = os.open(path, os.O_WRONLY)
+    except FileNotFoundError:
+        raise UploadConflict("upload already finalized")
+    try:
+        os.pwrite(fd, data, offset)
+    finally:
+        os.close(fd)
+
+async def write_chunk(upload_id, offset, data, chunk_sha256=None):
+    meta = _load(upload_id)
+    if meta["state"] != "open":
+        raise UploadConflict(f"upload is {meta['state']}")
+    if offset < 0 or offset >= meta["size"] or offset % meta["chunk_size"]:
+        raise UploadError(f"offset must be a multiple of {meta['chunk_size']} below {meta['size']}")
+    expected = min(meta["chunk_size"], meta["size"] - offset)
+    if len(data) != expected:
+        raise UploadError(f"chunk at {offset} must be {expected} bytes, got {len(data)}")
+
+    # chunks are written outside the lock, each at its own offset; only meta.json is serialised
+    await asyncio.to_thread(_write, _dir(upload_id) / "data", offset, data, chunk_sha256)
+    with _lock(upload_id):
+        meta = _load(upload_id)
+        if meta["state"] != "open":
+            raise UploadConflict(f"upload is {meta['state']}")
+        index = offset // meta["chunk_size"]
+        if index not in meta["received"]:
+            meta["received"].append(index)
+            _save(meta)
+    return status(meta)
+
+def _sha256_file(path):
+    h = hashlib.sha256()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(1024 * 1024), b""):
+            h.update(block)
+    return h.hexdigest()
+
+async def finalize(upload_id):
+    # returns (path, meta); the caller owns the file at path afterwards
+    with _lock(upload_id):
+        meta = _load(upload_id)
+        if meta["state"] != "open":
+            raise UploadConflict(f"upload is {meta['state']}")
+        missing = status(meta)["missing_offsets"]
+        if missing:
+            raise UploadConflict(f"{len(missing)} chunks missing, first at offset {missing[0]}")
+        meta["state"] = "finalizing"
+        _save(meta)
+
+    d = _dir(upload_id)
+    digest = await asyncio.to_thread(_sha256_file, d / "data")
+    if meta["sha256"] and digest != meta["sha256"]:
+        # keep the session so the client can re-send; the bad chunk is unknown, so all are re-opened
+        with _lock(upload_id):
+            meta.update(state="open", received=[])
+            _save(meta)
+        raise UploadConflict("sha256 mismatch, re-send all chunks")
+
+    fd, path = tempfile.mkstemp(suffix=KINDS[meta["kind"]])
+    os.close(fd)
+    shutil.move(str(d / "data"), path)
+    shutil.rmtree(d, ignore_errors=True)
+    _locks.pop(upload_id, None)
+    logger.info("upload finalized", extra=fields("upload", upload_id=upload_id, kind=meta["kind"], size=meta["size"], sha256=digest))
+    return path, {**meta, "sha256": digest}
@@ -1,20 +1,39 @@
-import asyncio, json, os, re, shutil, tempfile, zipfile, io, wave
+import asyncio, json, os, re, shutil, tempfile, time, zipfile, io, wave
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
 from pathlib import Path
 from fastapi import UploadFile
 from typing import Dict, List
 from datetime import datetime, date
-import pandas as pd
-from ai_utils import transcribe_one
 from db_utils import query_all, run_query
-from join_utils import join_calls_at_date
-from transcript_utils import generate_flags_from_transcripts
+from metrics_utils import (
+    TRANSCRIPTION_QUEUE_DEPTH, TRANSCRIPTIONS_IN_FLIGHT, TRANSCRIPTION_JOBS_ACTIVE,
+    AUDIO_PREPROCESS_SECONDS, AUDIO_PREPROCESS_BYTES, VAD_SKIPPED,
+    RECORDING_TRANSCRIBE_SECONDS, RECORDING_AUDIO_SECONDS
+)
+from profile_utils import profile_job, mark_stage
+from log_utils import get_logger, fields, log_payload
+from site_utils import detect_site
+from scheduler_utils import TranscriptionScheduler
+
+logger = get_logger(__name__)
+
+# chunks of one long recording transcribed at the same time
+SPLIT_CONCURRENCY = int(os.getenv("SPLIT_CONCURRENCY", 4))
+# files transcribed at the same time, shared by every upload job
+TRANSCRIPTION_WORKERS = int(os.getenv("TRANSCRIPTION_WORKERS", 4))
+# threads for the transcription calls, apart from the default executor: they block in
+# RateLimiter.acquire and on the API, and would otherwise starve every asyncio.to_thread route
+TRANSCRIBE_THREADS = int(os.getenv("TRANSCRIBE_THREADS", TRANSCRIPTION_WORKERS * SPLIT_CONCURRENCY))
+transcribe_executor = ThreadPoolExecutor(max_workers=TRANSCRIBE_THREADS, thread_name_prefix="transcribe")
+
+scheduler = TranscriptionScheduler()
+_workers = []
+_date_pending = defaultdict(int)  # date -> files queued or in progress, across jobs
+_in_flight = set()  # filenames queued or in progress, so re-uploads do not transcribe them twice
 
 def extract_site(name: str):
-    sites = ["Cheadle", "Heald Green", "Middleton", "Heckmondwike", "Winsford"]
-    for s in sites:
-        if s.lower().replace(" ", "") in name.lower().replace(" ", ""):
-            return s
-    return None
+    return detect_site(name)
 
 def extract_phone_key(name: str):
     m = re.search(r"-(\d+)_", name)
@@ -26,6 +45,7 @@ def extract_phone_key(name: str):
     return num
 
 def extract_datetime_from_filename(name: str):
+    import pandas as pd
     if not isinstance(name, str):
         return pd.NA, pd.NA
     m = re.search(r"_(\d{14})", name)
@@ -77,15 +97,28 @@ def get_wav_names_zip(zip_path):
         except Exception: pass
         return None
     
+EXISTING_CALLS_SQL = "SELECT filename FROM transcriptions WHERE filename = ANY(%s)"
+
 def get_existing_calls(filenames):
     if not filenames:
         return set()
-    rows = query_all(
-        "SELECT filename FROM transcriptions WHERE filename = ANY(%s)",
-        (list(filenames),)
-    )
+    rows = query_all(EXISTING_CALLS_SQL, (list(filenames),), name="existing_calls")
     return {r["filename"] for r in rows}
 
+def get_missing_calls(filenames, existing=None):
+    # filenames the server neither has a transcript for nor is transcribing right now.
+    # _in_flight is only touched on the event loop, so call this there; async callers look up
+    # existing = get_existing_calls(filenames) in a thread first and pass it in
+    if existing is None:
+        existing = get_existing_calls(filenames)
+    have = existing | _in_flight
+    seen, missing = set(), []
+    for n in filenames:
+        if n not in have and n not in seen:
+            seen.add(n)
+            missing.append(n)
+    return missing
+
 def extract_selected_wavs(zip_path: str, selected: List[str]):
     tmpdir = tempfile.mkdtemp(prefix="unzipped_")
     name_to_path: Dict[str, str] = {}
@@ -105,76 +138,178 @@ def extract_selected_wavs(zip_path: str, selected: List[str]):
 
     return tmpdir, name_to_path
 
-async def _transcription_worker(
-    name_to_path: Dict[str, str],
-    to_process: List[str],
-    zip_path: str,
-    tmpdir: str,
-):
+async def save_wavs(wav_files: List[UploadFile]):
+    # individual recordings posted by the upload form after the manifest check
+    chunk_size = 1024 * 1024
+    tmpdir = tempfile.mkdtemp(prefix="uploaded_")
+    name_to_path: Dict[str, str] = {}
+    for wav_file in wav_files:
+        base = Path(wav_file.filename or "").name
+        try:
+            if not base.lower().endswith(".wav"):
+                continue
+            out_path = os.path.join(tmpdir, base)
+            with open(out_path, "wb") as dst:
+                while True:
+                    chunk = await wav_file.read(chunk_size)
+                    if not chunk:
+                        break
+                    dst.write(chunk)
+            name_to_path[base] = out_path
+        finally:
+            try:
+                await wav_file.close()
+            except Exception:
+                pass
+    return tmpdir, name_to_path
+
+def _read_bytes(p: str) -> bytes:
+    with open(p, "rb") as f:
+        return f.read()
+
+def _wav_duration_sec(src) -> int:
+    # src is a path or raw bytes; only the header is read
+    try:
+        with wave.open(src if isinstance(src, str) else io.BytesIO(src), "rb") as wf:
+            return int(round(wf.getnframes() / float(wf.getframerate())))
+    except Exception:
+        return 0
+
+def _preprocess(wav_bytes: bytes):
+    from audio_utils import preprocess_wav
+    with AUDIO_PREPROCESS_SECONDS.time():
+        return preprocess_wav(wav_bytes)
+
+async def _transcribe_chunk(chunk: bytes, limit: asyncio.Semaphore):
+    from ai_utils import transcribe_one
+    loop = asyncio.get_running_loop()
+    async with limit:
+        with TRANSCRIPTIONS_IN_FLIGHT.track_inprogress():
+            return await loop.run_in_executor(transcribe_executor, transcribe_one, chunk)
+
+async def _transcribe(upload: bytes, duration_sec: int):
+    # long recordings go out as overlapping chunks in parallel and are stitched back
+    from ai_utils import stitch_transcripts
+    from audio_utils import split_wav
     loop = asyncio.get_running_loop()
+    chunks = await loop.run_in_executor(None, split_wav, upload)
+    mode = "split" if len(chunks) > 1 else "single"
+    start = time.perf_counter()
+    limit = asyncio.Semaphore(SPLIT_CONCURRENCY)
+    parts = await asyncio.gather(*(_transcribe_chunk(c, limit) for c in chunks))
+    elapsed = time.perf_counter() - start
+    RECORDING_TRANSCRIBE_SECONDS.labels(mode).observe(elapsed)
+    RECORDING_AUDIO_SECONDS.labels(mode).inc(duration_sec)
+    if mode == "single":
+        return parts[0], mode, elapsed, 1
+    return {"raw": stitch_transcripts([p["raw"] for p in parts])}, mode, elapsed, len(chunks)
+
+async def _process_file(item):
+    from ai_utils import skipped_transcript
+    loop = asyncio.get_running_loop()
+    job, file_name = item["job"], item["file"]
+    site, phone_key, call_time, duration_sec = item["site"], item["phone_key"], item["call_time"], item["duration_sec"]
+
+    raw = await loop.run_in_executor(None, _read_bytes, item["path"])
+    upload, audio_stats = await loop.run_in_executor(None, _preprocess, raw)
+    AUDIO_PREPROCESS_BYTES.labels("in").inc(audio_stats["bytes_in"])
+    AUDIO_PREPROCESS_BYTES.labels("out").inc(audio_stats["bytes_out"])
+    if audio_stats["skip_reason"]:
+        VAD_SKIPPED.labels(audio_stats["skip_reason"]).inc()
+        job["skipped"] += 1
+        tr = skipped_transcript(audio_stats["skip_reason"], audio_stats.get("analysis"))
+        logger.info("transcription skipped", extra=fields(
+            "transcription", file=file_name, site=site, phone_key=phone_key, call_time=call_time,
+            bytes=len(raw), reason=audio_stats["skip_reason"],
+        ))
+    else:
+        job["bytes_in"] += audio_stats["bytes_in"]
+        job["bytes_out"] += audio_stats["bytes_out"]
+        tr, mode, elapsed, n_chunks = await _transcribe(upload, duration_sec)
+        logger.info("transcribed", extra=fields(
+            "transcription", file=file_name, site=site, phone_key=phone_key, call_time=call_time,
+            bytes=len(raw), upload_bytes=len(upload), duration_sec=duration_sec,
+            mode=mode, chunks=n_chunks, seconds=round(elapsed, 3),
+        ))
+    transcript = json.dumps(tr, ensure_ascii=False)
+    log_payload(logger, "transcription", "transcript", transcript, file=file_name)
+    await loop.run_in_executor(None, lambda: run_query(
+        """
+        INSERT INTO transcriptions (filename, site, phone_key, transcript, call_time, duration_sec)
+        VALUES (%s, %s, %s, %s, %s, %s)
+        ON CONFLICT (filename) DO NOTHING
+        """,
+        (file_name, site, phone_key, transcript, call_time, duration_sec,),
+        name="insert_transcription",
+    ))
 
-    def _read_bytes(p: str) -> bytes:
-        with open(p, "rb") as f:
-            return f.read()
+def _file_done(item):
+    job, d = item["job"], item["date"]
+    _in_flight.discard(item["file"])
+    if d is not None:
+        _date_pending[d] -= 1
+        if not _date_pending[d]:
+            # last queued file of this date, across all jobs: this job runs its join
+            del _date_pending[d]
+            job["ready_dates"].add(d)
+    job["remaining"] -= 1
+    if not job["remaining"]:
+        job["done"].set()
 
-    def _wav_duration_sec(wav_bytes: bytes) -> float:
+async def _transcription_worker():
+    while True:
+        item = await scheduler.get()
+        TRANSCRIPTION_QUEUE_DEPTH.dec()
         try:
-            with wave.open(io.BytesIO(wav_bytes), "rb") as wf:
-                frames = wf.getnframes()
-                rate = wf.getframerate()
-                duration = frames / float(rate)
-                return int(round(duration))
-        except:
-            return int(0)
-    
-    try:
-        date_arr = []
-        for file_name in to_process:
-            path = name_to_path.get(file_name)
-            if not path:
-                print(f"skip (no path): {file_name}")
-                continue
+            await _process_file(item)
+        except Exception as e:
+            logger.error("transcription failed", extra=fields("transcription", file=item["file"], error=repr(e)))
+        finally:
+            _file_done(item)
 
-            site = extract_site(file_name) or ""
-            phone_key = extract_phone_key(file_name) or ""
-            dt, iso = extract_datetime_from_filename(file_name)
-            if dt.date() not in date_arr:
-                date_arr.append(dt.date())
+def _ensure_workers():
+    alive = [t for t in _workers if not t.done()]
+    _workers[:] = alive
+    for _ in range(TRANSCRIPTION_WORKERS - len(alive)):
+        _workers.append(asyncio.create_task(_transcription_worker()))
 
-            call_time = iso or None
+async def _transcription_job(job, zip_path: str, tmpdir: str):
+    from join_utils import join_calls_at_date
+    from transcript_utils import generate_flags_from_transcripts
+    loop = asyncio.get_running_loop()
+    TRANSCRIPTION_JOBS_ACTIVE.inc()
+    try:
+        await job["done"].wait()
+        mark_stage("transcription")
+        logger.info("transcription job done", extra=fields(
+            "transcription", files=job["files"], skipped_empty=job["skipped"],
+        ))
+        if job["bytes_in"]:
+            logger.info("audio pre-processing", extra=fields(
+                "transcription", bytes_in=job["bytes_in"], bytes_out=job["bytes_out"],
+                reduction=round(1 - job["bytes_out"] / job["bytes_in"], 3),
+            ))
 
-            try:
-                raw = await loop.run_in_executor(None, _read_bytes, path)
-                duration_sec = await loop.run_in_executor(None, _wav_duration_sec, raw)
-                tr = await loop.run_in_executor(None, transcribe_one, raw)
-                transcript = json.dumps(tr, ensure_ascii=False)
-                print(f"{file_name} | site={site} | phone_key={phone_key} | call_time={call_time}")
-                print(transcript)
-                run_query(
-                    """
-                    INSERT INTO transcriptions (filename, site, phone_key, transcript, call_time, duration_sec)
-                    VALUES (%s, %s, %s, %s, %s, %s)
-                    ON CONFLICT (filename) DO NOTHING
-                    """,
-                    (file_name, site, phone_key, transcript, call_time, duration_sec,)
-                )
+        # dates still queued by another job are joined when that job finishes them
+        waiting = sorted(job["dates"] - job["ready_dates"])
+        if waiting:
+            logger.info("dates left to other jobs", extra=fields("transcription", dates=[str(d) for d in waiting]))
 
+        for d in sorted(job["ready_dates"], reverse=True):
+            try:
+                # off the event loop: both are blocking, and flagging runs its own loop
+                await loop.run_in_executor(None, join_calls_at_date, d)
+                mark_stage("join_calls_at_date")
+                await loop.run_in_executor(None, generate_flags_from_transcripts, d)
+                mark_stage("generate_flags_from_transcripts")
             except Exception as e:
-                print(f"FAIL {file_name} | {e!r}")
-        
-        # process the date
-        if len(date_arr) == 1:
-            d = date_arr[0]
-            join_calls_at_date(d)
-            generate_flags_from_transcripts(d)
-        else:
-            print("WARN! MULTIPLE DATES PROCESSED")
-            print(date_arr)
-
+                logger.error("join failed", extra=fields("transcription", date=str(d), error=repr(e)))
     finally:
+        TRANSCRIPTION_JOBS_ACTIVE.dec()
         # cleanup artifacts
-        try: os.remove(zip_path)
-        except Exception: pass
+        if zip_path:
+            try: os.remove(zip_path)
+            except Exception: pass
         try: shutil.rmtree(tmpdir)
         except Exception: pass
 
@@ -183,6 +318,48 @@ def schedule_transcription_job(
     to_process: List[str],
     zip_path: str,
     tmpdir: str,
+    profile: bool = False,
 ):
-    asyncio.create_task(_transcription_worker(name_to_path, to_process, zip_path, tmpdir))
-    
\ No newline at end of file
+    job = {
+        "files": len(to_process), "remaining": 0, "done": asyncio.Event(),
+        "dates": set(), "ready_dates": set(), "skipped": 0, "bytes_in": 0, "bytes_out": 0,
+    }
+    for file_name in to_process:
+        path = name_to_path.get(file_name)
+        if not path:
+            logger.warning("skip (no path)", extra=fields("transcription", file=file_name))
+            continue
+
+        dt, iso = extract_datetime_from_filename(file_name)
+        d = dt.date() if isinstance(dt, datetime) else None
+        site = extract_site(file_name) or ""
+        item = {
+            "job": job, "file": file_name, "path": path, "date": d, "site": site,
+            "phone_key": extract_phone_key(file_name) or "", "call_time": iso if isinstance(iso, str) else None,
+            "duration_sec": _wav_duration_sec(path),
+        }
+        if d is not None:
+            job["dates"].add(d)
+            _date_pending[d] += 1
+        job["remaining"] += 1
+        _in_flight.add(file_name)
+        scheduler.add(d, site, item["duration_sec"], item)
+        TRANSCRIPTION_QUEUE_DEPTH.inc()
+
+    if not job["remaining"]:
+        job["done"].set()
+    _ensure_workers()
+    asyncio.create_task(profile_job(
+        "transcription_worker",
+        _transcription_job(job, zip_path, tmpdir),
+        enabled=profile,
+    ))
+
+def boost_date(d: date):
+    # None when nothing is queued for d
+    if not scheduler.boost(d):
+        return None
+    return queue_status()
+
+def queue_status():
+    return {**scheduler.snapshot(), "workers": TRANSCRIPTION_WORKERS}